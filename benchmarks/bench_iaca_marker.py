@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+'''
+Benchmark of kerncraft.iaca_marker.find_asm_blocks on large generated assembly.
+
+Generates heavily unrolled AVX loop bodies (similar to what compilers emit for stencil
+kernels) and reports the time needed to locate and characterize the loop blocks.
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import argparse
+import timeit
+
+sys.path[0:0] = ['.', '..']
+
+from kerncraft.iaca_marker import find_asm_blocks
+
+
+def generate_asm(loops=10, unroll=1000, vector_registers=16):
+    '''
+    returns list of assembly lines with *loops* unrolled loops of *unroll* iterations each
+    '''
+    lines = ['        .text\n', 'main:\n', '        pushq     %rbp\n']
+    for l in range(loops):
+        label = '..B1.{}'.format(l)
+        lines.append('{}:  # Preds {}\n'.format(label, label))
+        for u in range(unroll):
+            dst = '%ymm{}'.format(u % vector_registers)
+            src = '%ymm{}'.format((u+1) % vector_registers)
+            lines += [
+                '        vmovupd   {}(%rsi,%rax,8), {}  # load\n'.format(32*u, dst),
+                '        vaddpd    {}(%rdx,%rax,8), {}, {}\n'.format(32*u, dst, src),
+                '        vmulpd    %ymm15, {}, {}\n'.format(src, dst),
+                '        vmovupd   {}, {}(%rdi,%rax,8)\n'.format(dst, 32*u)]
+        lines += ['        addq      ${}, %rax\n'.format(4*unroll),
+                  '        cmpq      %r8, %rax\n',
+                  '        jb        {}  # Prob 82%\n'.format(label)]
+    lines += ['        popq      %rbp\n', '        ret\n']
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--loops', type=int, default=10)
+    parser.add_argument('--unroll', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    asm_lines = generate_asm(args.loops, args.unroll)
+    runtimes = timeit.repeat(
+        lambda: find_asm_blocks(asm_lines), number=1, repeat=args.repeat)
+    best = min(runtimes)
+    print('{} lines, {} blocks'.format(len(asm_lines), len(find_asm_blocks(asm_lines))))
+    print('best of {}: {:.4f} s ({:.0f} lines/s)'.format(
+        args.repeat, best, len(asm_lines)/best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+'''
+Benchmark of kerncraft's own analysis speed and memory consumption.
+
+Times each model configuration over the matrix of example kernels, machine files and problem
+sizes. Every case runs in a fresh process, to measure its peak memory (and to isolate
+failures). Results are stored per commit (as JSON in --results-dir) and compared to previously
+stored results. Regressions are reported and lead to exit status 1.
+
+With --fake-tools, stand-in compiler and iaca.sh (see benchmarks/tools) are used, so that the
+in-core models (ECMCPU, ECMCPU-builtin) can be timed without Intel tools.
+
+Examples:
+    ./run_benchmarks.py --kernels 2d-5pt copy --sizes 1000 --models ECMData-LC LC
+    ./run_benchmarks.py --fake-tools --models ECMCPU --compare 1a2b3c4
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import glob
+import json
+import time
+import platform
+import argparse
+import subprocess
+import multiprocessing
+from collections import OrderedDict
+
+sys.path[0:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')]
+
+from ruamel import yaml
+
+from kerncraft import profiling
+from kerncraft.api import analyze_many
+from kerncraft.kernel import KernelCode
+from kerncraft.machinemodel import MachineModel
+from kerncraft.pycparser import clean_code
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES_DIR = os.path.join(BASE_DIR, '..', 'examples')
+TOOLS_DIR = os.path.join(BASE_DIR, 'tools')
+
+# name: (model, options)
+CONFIGS = OrderedDict([
+    ('ECMData-SIM', ('ECMData', {'cache_predictor': 'SIM'})),
+    ('ECMData-LC', ('ECMData', {'cache_predictor': 'LC'})),
+    ('ECMData-AN', ('ECMData', {'cache_predictor': 'AN'})),
+    ('LC', ('LC', {})),
+    ('Roofline', ('Roofline', {'cache_predictor': 'SIM'})),
+    ('ECMCPU', ('ECMCPU', {'incore_model': 'IACA', 'asm_increment': 32})),
+    ('ECMCPU-builtin', ('ECMCPU', {'incore_model': 'builtin', 'asm_increment': 32})),
+])
+DEFAULT_CONFIGS = ['ECMData-SIM', 'ECMData-LC', 'ECMData-AN', 'LC', 'Roofline']
+
+
+def kernel_constants(kernel):
+    '''returns names of all constants required by *kernel* (array dimensions and loop bounds)'''
+    symbols = set()
+    for var_type, dimensions in kernel.variables.values():
+        for d in dimensions or []:
+            symbols |= d.free_symbols
+    for index, start, stop, step in kernel._loop_stack:
+        for e in [start, stop, step]:
+            symbols |= getattr(e, 'free_symbols', set())
+    return sorted([str(s) for s in symbols])
+
+
+def run_case(kernel_file, machine_file, config, size, fake_tools=False):
+    '''analyzes one case and returns measurements (runs in a dedicated process)'''
+    model, options = CONFIGS[config]
+    try:
+        with open(machine_file) as f:
+            machine_yaml = yaml.load(f, Loader=yaml.Loader)
+        if fake_tools:
+            machine_yaml['compiler'] = os.path.join(TOOLS_DIR, 'fake_cc')
+            os.environ['PATH'] = TOOLS_DIR + os.pathsep + os.environ['PATH']
+        machine = MachineModel(machine_yaml=machine_yaml)
+
+        start, start_cpu = profiling.timer(), profiling.cpu_time()
+        with profiling.profile() as profiler:
+            with profiling.phase('parse'):
+                with open(kernel_file) as f:
+                    kernel = KernelCode(clean_code(f.read()))
+            constants = {c: size for c in kernel_constants(kernel)}
+            with profiling.phase('analysis'):
+                list(analyze_many(kernel, machine, model, [constants], options))
+        return {'wall': profiling.timer() - start,
+                'cpu': profiling.cpu_time() - start_cpu,
+                'max rss': profiling.max_rss(),
+                'phases': profiler.point_times(None)}
+    except (Exception, SystemExit) as e:
+        # kerncraft exits on unsupported kernels and machines
+        return {'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+def measure(case, repeat=1, timeout=None, fake_tools=False):
+    '''runs *case* *repeat* times in fresh processes and returns the fastest measurement'''
+    best = None
+    for i in range(repeat):
+        pool = multiprocessing.Pool(1)
+        try:
+            result = pool.apply_async(run_case, case + (fake_tools,)).get(timeout)
+        except multiprocessing.TimeoutError:
+            result = {'error': 'timeout after {} s'.format(timeout)}
+        finally:
+            pool.terminate()
+            pool.join()
+        if 'error' in result:
+            return result
+        if best is None or result['wall'] < best['wall']:
+            best = result
+    return best
+
+
+def current_commit():
+    '''returns short hash of HEAD, suffixed with "-dirty" if there are uncommitted changes'''
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR).decode().strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=BASE_DIR)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('-dirty' if dirty else '')
+
+
+def load_results(results_dir, commit):
+    with open(os.path.join(results_dir, commit + '.json')) as f:
+        return json.load(f)
+
+
+def latest_results(results_dir, exclude):
+    '''returns most recently stored results not belonging to commit *exclude* (or None)'''
+    files = [f for f in glob.glob(os.path.join(results_dir, '*.json'))
+             if os.path.basename(f) != exclude + '.json']
+    if not files:
+        return None
+    with open(max(files, key=os.path.getmtime)) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=0.2, min_wall=0.05):
+    '''
+    returns list of regressions of *results* compared to *baseline*
+
+    A case regressed if its wall time (at least *min_wall* seconds longer) or peak memory
+    increased by more than *threshold* (relative), or if it failed but succeeded before.
+    '''
+    regressions = []
+    for case, r in sorted(results.items()):
+        b = baseline.get(case)
+        if b is None or 'error' in b:
+            continue
+        if 'error' in r:
+            regressions.append((case, 'fails: ' + r['error']))
+            continue
+        if r['wall'] > b['wall']*(1+threshold) and r['wall'] - b['wall'] >= min_wall:
+            regressions.append((case, 'wall time {:.3f} s -> {:.3f} s (+{:.0%})'.format(
+                b['wall'], r['wall'], r['wall']/b['wall']-1)))
+        if r['max rss'] and b['max rss'] and r['max rss'] > b['max rss']*(1+threshold):
+            regressions.append((case, 'peak memory {:.1f} MB -> {:.1f} MB (+{:.0%})'.format(
+                b['max rss'], r['max rss'], r['max rss']/b['max rss']-1)))
+    return regressions
+
+
+def find_files(directory, names, extension):
+    if not names:
+        return sorted(glob.glob(os.path.join(directory, '*' + extension)))
+    return [os.path.join(directory, n if n.endswith(extension) else n + extension)
+            for n in names]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kernels', nargs='+', metavar='NAME',
+                        help='Kernels from examples/kernels (default: all).')
+    parser.add_argument('--machines', nargs='+', metavar='NAME',
+                        help='Machine files from examples/machine-files (default: all).')
+    parser.add_argument('--models', nargs='+', choices=list(CONFIGS), default=DEFAULT_CONFIGS,
+                        help='Model configurations (default: {}).'.format(
+                            ' '.join(DEFAULT_CONFIGS)))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000],
+                        help='Problem sizes, all constants of a kernel are set to the size '
+                             '(default: 100 1000).')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Repetitions per case, the fastest is stored (default: 1).')
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='Time limit per case in seconds (default: 600).')
+    parser.add_argument('--fake-tools', action='store_true',
+                        help='Use stand-in compiler and iaca.sh from benchmarks/tools.')
+    parser.add_argument('--results-dir', default=os.path.join(BASE_DIR, 'results'),
+                        help='Directory to store results in (default: benchmarks/results).')
+    parser.add_argument('--commit', default=current_commit(),
+                        help='Name of stored results (default: current git commit).')
+    parser.add_argument('--compare', metavar='COMMIT',
+                        help='Compare to results of COMMIT (default: most recent results).')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative increase of time or memory reported as regression '
+                             '(default: 0.2).')
+    args = parser.parse_args()
+
+    kernels = find_files(os.path.join(EXAMPLES_DIR, 'kernels'), args.kernels, '.c')
+    machines = find_files(os.path.join(EXAMPLES_DIR, 'machine-files'), args.machines, '.yaml')
+
+    results = OrderedDict()
+    print('{:<64}{:>10}{:>10}'.format('case', 'wall [s]', 'RSS [MB]'))
+    for kernel_file in kernels:
+        for machine_file in machines:
+            for config in args.models:
+                for size in args.sizes:
+                    case_name = '{} {} {} {}'.format(
+                        os.path.basename(kernel_file), os.path.basename(machine_file),
+                        config, size)
+                    r = measure((kernel_file, machine_file, config, size),
+                                args.repeat, args.timeout, args.fake_tools)
+                    results[case_name] = r
+                    if 'error' in r:
+                        print('{:<64}{:>20}'.format(case_name, 'failed'))
+                    else:
+                        print('{:<64}{:>10.3f}{:>10.1f}'.format(
+                            case_name, r['wall'], r['max rss'] or 0))
+                    sys.stdout.flush()
+
+    if args.compare:
+        baseline = load_results(args.results_dir, args.compare)
+    else:
+        baseline = latest_results(args.results_dir, args.commit)
+
+    if not os.path.isdir(args.results_dir):
+        os.makedirs(args.results_dir)
+    with open(os.path.join(args.results_dir, args.commit + '.json'), 'w') as f:
+        json.dump({'commit': args.commit,
+                   'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'host': platform.node(),
+                   'python': platform.python_version(),
+                   'results': results}, f, indent=1)
+
+    if baseline is None:
+        print('No previous results to compare to.')
+        return
+    regressions = compare(results, baseline['results'], args.threshold)
+    print('Compared to {} ({}): {} regression(s)'.format(
+        baseline['commit'], baseline['date'], len(regressions)))
+    for case, message in regressions:
+        print('  {}: {}'.format(case, message))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+#!/bin/sh
+# Stand-in iaca.sh for benchmarks/run_benchmarks.py (--fake-tools)
+#
+# Prints a fixed IACA throughput report (matching the loop emitted by fake_cc), regardless of
+# the analyzed binary.
+arch=HSW
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -arch) arch="$2"; shift ;;
+    esac
+    shift
+done
+
+cat <<REPORT
+Intel(R) Architecture Code Analyzer Version - 2.1
+Analyzed File - stand-in
+Binary Format - 64Bit
+Architecture  - $arch
+Analysis Type - Throughput
+
+Throughput Analysis Report
+--------------------------
+Block Throughput: 1.00 Cycles       Throughput Bottleneck: Port2_AGU, Port3_AGU
+
+Port Binding In Cycles Per Iteration:
+---------------------------------------------------------------------------------------
+|  Port  |  0   -  DV  |  1   |  2   -  D   |  3   -  D   |  4   |  5   |  6   |  7   |
+---------------------------------------------------------------------------------------
+| Cycles | 1.0    0.0  | 1.0  | 1.0    1.0  | 1.0    1.0  | 1.0  | 0.5  | 0.5  | 0.0  |
+---------------------------------------------------------------------------------------
+
+Total Num Of Uops: 7
+REPORT
@@ -0,0 +1,5 @@
+def analyze_many(*args, **kwargs):
+    '''analyzes kernels for many sets of constants, see kerncraft.api.analyze_many()'''
+    # imported on first use, importing kerncraft modules does not load models and sympy
+    from .api import analyze_many
+    return analyze_many(*args, **kwargs)
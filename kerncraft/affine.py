@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+'''
+Lightweight representation of affine array access expressions
+
+An access like a[j+1][i-1] into double a[M][N] is linear in the loop indices (i, j) with
+coefficients that depend only on symbolic constants (N, M):
+
+    N*j + i + N - 1  ->  AffineExpression({'j': N, 'i': 1}, N - 1)
+
+Once constants are substituted, coefficients and constant are plain ints. Arithmetic,
+comparison and evaluation (vectorized with numpy) are then exact and do not involve sympy,
+which is only needed to convert from the parser and back for reporting.
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import numbers
+import functools
+
+import sympy
+import numpy
+
+
+def _normalize(value):
+    '''returns *value* as int, if it is an integer number, otherwise unchanged'''
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, sympy.Integer):
+        return int(value)
+    if isinstance(value, sympy.Expr) and value.is_Number:
+        raise ValueError("non-integer coefficient in access expression: {}".format(value))
+    return value
+
+
+def _is_scalar(value):
+    return isinstance(value, (numbers.Integral, sympy.Expr)) and not \
+        isinstance(value, AffineExpression)
+
+
+@functools.total_ordering
+class AffineExpression(object):
+    '''
+    Expression sum(coefficients[index]*index) + constant
+
+    Indices are given by name. Coefficients and constant are ints or sympy expressions of
+    constants (not containing any index).
+    '''
+    __slots__ = ('coefficients', 'constant', '_symbols')
+
+    def __init__(self, coefficients=None, constant=0, symbols=None):
+        self.coefficients = {}
+        for name, c in (coefficients or {}).items():
+            c = _normalize(c)
+            if c != 0:
+                self.coefficients[name] = c
+        self.constant = _normalize(constant)
+        # sympy symbols of indices, to convert back with the same assumptions
+        self._symbols = symbols or {}
+
+    @classmethod
+    def from_sympy(cls, expr, indices):
+        '''
+        returns AffineExpression of sympy *expr* in *indices* (list of sympy symbols)
+
+        Raises ValueError if *expr* is not affine in *indices*.
+        '''
+        indices = [i for i in indices if i in expr.free_symbols]
+        symbols = {str(i): i for i in indices}
+        if not indices:
+            return cls(constant=expr, symbols=symbols)
+
+        try:
+            poly = sympy.Poly(expr, *indices)
+        except sympy.PolynomialError:
+            raise ValueError("access expression is not affine in loop indices: {}".format(expr))
+
+        coefficients = {}
+        constant = 0
+        for monom, coeff in poly.terms():
+            if sum(monom) == 0:
+                constant = coeff
+            elif sum(monom) == 1:
+                coefficients[str(indices[monom.index(1)])] = coeff
+            else:
+                raise ValueError(
+                    "access expression is not affine in loop indices: {}".format(expr))
+        return cls(coefficients, constant, symbols)
+
+    def to_sympy(self):
+        '''returns sympy expression'''
+        expr = sympy.sympify(self.constant)
+        for name, c in sorted(self.coefficients.items()):
+            expr += c*self._symbols.get(name, sympy.Symbol(name, positive=True))
+        return expr
+
+    def subs(self, constants):
+        '''returns AffineExpression with *constants* (dictionary of symbol: value) substituted'''
+        def subs(value):
+            if isinstance(value, sympy.Expr):
+                return value.subs(constants)
+            return value
+        return AffineExpression({name: subs(c) for name, c in self.coefficients.items()},
+                                subs(self.constant), self._symbols)
+
+    @property
+    def is_numeric(self):
+        '''True if coefficients and constant are ints (i.e., all constants are substituted)'''
+        return isinstance(self.constant, int) and \
+            all([isinstance(c, int) for c in self.coefficients.values()])
+
+    @property
+    def is_constant(self):
+        '''True if expression does not depend on any index'''
+        return not self.coefficients
+
+    def evaluate(self, indices):
+        '''
+        returns value for *indices* (dictionary of index name: int or numpy.array)
+
+        All constants need to be substituted.
+        '''
+        assert self.is_numeric, "constants need to be substituted before evaluation"
+        value = self.constant
+        for name, c in self.coefficients.items():
+            value = value + c*indices[name]
+        return value
+
+    def _merge(self, other, sign):
+        if _is_scalar(other):
+            other = AffineExpression(constant=other)
+        elif not isinstance(other, AffineExpression):
+            return NotImplemented
+        coefficients = dict(self.coefficients)
+        for name, c in other.coefficients.items():
+            coefficients[name] = coefficients.get(name, 0) + sign*c
+        symbols = dict(other._symbols)
+        symbols.update(self._symbols)
+        return AffineExpression(coefficients, self.constant + sign*other.constant, symbols)
+
+    def __add__(self, other):
+        return self._merge(other, 1)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self._merge(other, -1)
+
+    def __rsub__(self, other):
+        return (-self).__add__(other)
+
+    def __neg__(self):
+        return self*-1
+
+    def __mul__(self, other):
+        if not _is_scalar(other):
+            return NotImplemented
+        return AffineExpression({name: c*other for name, c in self.coefficients.items()},
+                                self.constant*other, self._symbols)
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        if _is_scalar(other):
+            other = AffineExpression(constant=other)
+        elif not isinstance(other, AffineExpression):
+            return NotImplemented
+        return self.coefficients == other.coefficients and self.constant == other.constant
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        if eq is NotImplemented:
+            return eq
+        return not eq
+
+    def __lt__(self, other):
+        diff = self - other
+        if diff is NotImplemented:
+            return diff
+        if not diff.is_constant or not isinstance(diff.constant, int):
+            raise TypeError("cannot order {!r} and {!r}, difference is not a number".format(
+                self, other))
+        return diff.constant < 0
+
+    def __hash__(self):
+        return hash((frozenset(self.coefficients.items()), self.constant))
+
+    def __repr__(self):
+        return 'AffineExpression({!r}, {!r})'.format(
+            dict(sorted(self.coefficients.items())), self.constant)
+
+    def __str__(self):
+        return str(self.to_sympy())
+
+
+def evaluate_many(expressions, indices):
+    '''
+    returns numpy.array of values of all *expressions* (rows) for all *indices* (columns)
+
+    *indices* is a dictionary of index name: numpy.array (all of equal length). Evaluation is
+    one matrix product of the coefficient matrix with the index vectors.
+    '''
+    names = sorted(indices)
+    length = len(next(iter(indices.values()))) if indices else 1
+    if not expressions:
+        return numpy.zeros((0, length), dtype=numpy.int64)
+    assert all([e.is_numeric for e in expressions]), \
+        "constants need to be substituted before evaluation"
+    coefficients = numpy.array([[e.coefficients.get(n, 0) for n in names] for e in expressions],
+                               dtype=numpy.int64)
+    constants = numpy.array([e.constant for e in expressions], dtype=numpy.int64)
+    if not names:
+        return numpy.repeat(constants[:, numpy.newaxis], length, axis=1)
+    counters = numpy.array([indices[n] for n in names], dtype=numpy.int64)
+    return coefficients.dot(counters) + constants[:, numpy.newaxis]
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+'''
+Programmatic interface to kerncraft, without command line parsing
+
+Example:
+    >>> from kerncraft import analyze_many
+    >>> for r in analyze_many(open('2d-5pt.c').read(), 'phinally.yaml', ['ECMData'],
+    ...                       [{'N': n, 'M': n} for n in [100, 1000, 10000]],
+    ...                       {'cache_predictor': 'LC'}):
+    ...     print(r['constants'], r['results']['cycles'])
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import io
+import argparse
+import multiprocessing
+
+import six
+
+from . import models as kc_models
+from . import kerncraft as kc
+from .kernel import Kernel, KernelCode
+from .machinemodel import MachineModel
+from .pycparser import clean_code
+
+
+def create_options(options=None, model_names=()):
+    '''
+    returns argparse.Namespace as used by models, with command line defaults overwritten by
+    *options*
+
+    Option names are the destinations of the command line arguments (e.g., cache_predictor for
+    --cache-predictor). If *options* already is a Namespace it is returned unchanged.
+    '''
+    if isinstance(options, argparse.Namespace):
+        return options
+    parser = kc.create_parser()
+    args = argparse.Namespace(**{
+        a.dest: a.default for a in parser._actions if a.dest != argparse.SUPPRESS})
+    args.machines = args.code_file = args.store = None
+    for name, value in (options or {}).items():
+        if not hasattr(args, name):
+            raise ValueError('unknown option {!r}'.format(name))
+        setattr(args, name, value)
+    args.pmodel = list(model_names)
+    kc.check_arguments(args, parser)
+    return args
+
+
+def _constants_items(constants):
+    '''returns list of (name, value) pairs of *constants* (a dictionary or pairs)'''
+    if isinstance(constants, dict):
+        constants = constants.items()
+    return [(six.text_type(k), int(v)) for k, v in constants]
+
+
+def _analyze(kernel, machine, model_names, constants, args, report=False):
+    '''analyzes all models with *constants* and returns list of results'''
+    kernel.clear_state()
+    for name, value in constants:
+        kernel.set_constant(name, value)
+    for index, block_size in args.tile:
+        kernel.set_tiling(index, block_size)
+
+    results = []
+    for model_name in model_names:
+        model = getattr(kc_models, model_name)(kernel, machine, args)
+        model.analyze()
+        result = {'model': model_name, 'constants': dict(constants), 'results': model.results}
+        if report:
+            output = io.StringIO()
+            model.report(output_file=output)
+            result['report'] = output.getvalue()
+        results.append(result)
+    return results
+
+
+# States of worker processes by setup function (see init_worker())
+_worker_states = {}
+
+
+def init_worker(setup, *args):
+    '''
+    sets up the current process as worker, with the state returned by *setup* called with *args*
+
+    Used as initializer of pool processes (see create_pool()) or directly, if work is done in
+    this process. Workers get their state with worker_state(*setup*), so several kinds of work
+    (e.g., kerncraft corpus and cachetile) do not interfere.
+    '''
+    _worker_states[setup] = setup(*args)
+
+
+def worker_state(setup):
+    '''returns state of the current worker process, as set up by init_worker() with *setup*'''
+    return _worker_states[setup]
+
+
+def create_pool(processes, setup, *args):
+    '''
+    returns multiprocessing.Pool of *processes* processes, each set up with init_worker()
+
+    *setup* needs to be a module level function, it is called once per process.
+    '''
+    return multiprocessing.Pool(processes, init_worker, (setup,) + args)
+
+
+def _setup_worker(code, machine, model_names, args, report):
+    '''parses kernel and machine once per worker process'''
+    if isinstance(machine, dict):
+        machine = MachineModel(machine_yaml=machine)
+    else:
+        machine = MachineModel(machine)
+    return {'kernel': KernelCode(code), 'machine': machine, 'model_names': model_names,
+            'args': args, 'report': report}
+
+
+def _worker_analyze(constants):
+    worker = worker_state(_setup_worker)
+    return _analyze(worker['kernel'], worker['machine'], worker['model_names'], constants,
+                    worker['args'], worker['report'])
+
+
+def analyze_many(kernel, machine, models, constants_iterable, options=None, processes=None,
+                 report=False):
+    '''
+    analyzes *kernel* on *machine* with all *models* for every set of constants and yields
+    the results
+
+    :param kernel: KernelCode (or other Kernel) object or C code of the loop kernel
+    :param machine: MachineModel object or path to machine description
+    :param models: model name or list of model names (e.g., ['ECM', 'Roofline'])
+    :param constants_iterable: iterable of constants, each a dictionary (e.g., {'N': 1000}) or
+                               sequence of name and value pairs
+    :param options: dictionary of model options, named like command line arguments (e.g.,
+                    {'cache_predictor': 'LC', 'cores': 4}), see create_options()
+    :param processes: if given, constants are distributed to a pool of *processes* processes
+                      (requires kernel as KernelCode or code)
+    :param report: if True, the textual reports of models are included
+
+    For each set of constants and model, a dictionary with 'model', 'constants' and 'results'
+    (and 'report') is yielded, in order of *constants_iterable*. The kernel is only parsed once
+    and in-core analyses are shared among constants. A given kernel object is modified (constants
+    are set), as done by the command line interface.
+    '''
+    if isinstance(models, six.string_types):
+        models = [models]
+    models = list(models)
+    unknown_models = [m for m in models if m not in kc_models.__all__]
+    if unknown_models:
+        raise ValueError('unknown models: {}'.format(', '.join(unknown_models)))
+    args = create_options(options, models)
+    constants_iterable = (_constants_items(c) for c in constants_iterable)
+
+    if processes is None:
+        if not isinstance(kernel, Kernel):
+            kernel = KernelCode(clean_code(kernel))
+        if not isinstance(machine, MachineModel):
+            machine = MachineModel(machine)
+        return _iter_results(
+            _analyze(kernel, machine, models, constants, args, report)
+            for constants in constants_iterable)
+
+    if isinstance(kernel, KernelCode):
+        code = kernel.kernel_code
+    elif isinstance(kernel, six.string_types):
+        code = clean_code(kernel)
+    else:
+        raise ValueError('kernel needs to be given as KernelCode or code with processes')
+    if isinstance(machine, MachineModel):
+        machine = machine._path or machine._data
+    pool = create_pool(processes, _setup_worker, code, machine, models, args, report)
+    return _iter_results(pool.imap(_worker_analyze, constants_iterable), pool)
+
+
+def _iter_results(results_iterable, pool=None):
+    '''yields single results from lists of results, terminates *pool* when done'''
+    try:
+        for results in results_iterable:
+            for result in results:
+                yield result
+    finally:
+        if pool is not None:
+            pool.terminate()
@@ -7,9 +7,13 @@ from __future__ import division
 from itertools import chain
 from collections import defaultdict
 from pprint import pprint
+import threading
 
 import sympy
 
+from . import profiling
+from .footprint import FootprintAnalyzer
+
 
 # Not useing functools.cmp_to_key, because it does not exit in python 2.x
 def cmp_to_key(mycmp):
@@ -66,6 +70,7 @@ class LayerConditionPredictor(CachePredictor):
     '''
     Predictor class based on layer condition analysis.
     '''
+    @profiling.profiled('layer conditions')
     def __init__(self, kernel, machine):
         CachePredictor.__init__(self, kernel, machine)
         
@@ -120,15 +125,14 @@ class LayerConditionPredictor(CachePredictor):
             destinations.update(
                 [(var_name, tuple(r)) for r in self.kernel._destinations.get(var_name, [])])
             acs = accesses[var_name]
-            # Transform them into sympy expressions
-            acs = [self.kernel.access_to_sympy(var_name, r) for r in acs]
-            # Replace constants with their integer counter parts, to make the entries sortable
-            acs = [self.kernel.subs_consts(e) for e in acs]
+            # Transform them into affine expressions and replace constants with their integer
+            # counter parts, to make the entries sortable
+            acs = [self.kernel.access_to_affine(var_name, r, subs_consts=True) for r in acs]
             # Sort accesses by decreasing order
             acs.sort(reverse=True)
 
             # Create reuse distances by substracting accesses pairwise in decreasing order
-            distances += [(acs[i-1]-acs[i]).simplify() for i in range(1,len(acs))]
+            distances += [(acs[i-1]-acs[i]).to_sympy() for i in range(1,len(acs))]
             # Add infinity for each array
             distances.append(sympy.oo)
             
@@ -218,76 +222,85 @@ class CacheSimulationPredictor(CachePredictor):
         inner_index = sympy.Symbol(inner_loop['index'], positive=True)
         inner_increment = inner_loop['increment']# Calculate the number of iterations for warm-up
         max_cache_size = max(map(lambda c: c.size(), csim.levels(with_mem=False)))
-        max_array_size = max(self.kernel.array_sizes(in_bytes=True, subs_consts=True).values())
+        array_sizes = self.kernel.array_sizes(in_bytes=True, subs_consts=True).values()
 
-        offsets = []
-        if max_array_size < max_cache_size:
-            # Full caching possible, go through all itreration before actual initialization
-            offsets = list(self.kernel.compile_global_offsets(
-                iteration=range(0, self.kernel.iteration_length())))
+        with profiling.phase('predictor warm-up'):
+            offsets = []
+            if sum(array_sizes) < max_cache_size:
+                full_caching = True
+            elif max(array_sizes) < max_cache_size:
+                # Decide by data actually touched (e.g., without halos)
+                full_caching = FootprintAnalyzer(self.kernel).working_set() < max_cache_size
+            else:
+                full_caching = False
+            if full_caching:
+                # Full caching possible, go through all itreration before actual initialization
+                offsets = list(self.kernel.compile_global_offsets(
+                    iteration=range(0, self.kernel.iteration_length())))
 
-        # Regular Initialization
-        warmup_indices = {
-            sympy.Symbol(l['index'], positive=True): ((l['stop']-l['start'])//l['increment'])//3
-            for l in self.kernel.get_loop_stack(subs_consts=True)}
-        warmup_iteration_count = self.kernel.indices_to_global_iterator(warmup_indices)
-        
-        # Make sure we are not handeling gigabytes of data, but 1.5x the maximum cache size
-        while warmup_iteration_count*element_size > max_cache_size*1.5:
-            for index in [sympy.Symbol(l['index'], positive=True)
-                          for l in self.kernel.get_loop_stack()]:
-                if warmup_indices[index] > 1:
-                    warmup_indices[index] -= 1
-                    break
+            # Regular Initialization
+            warmup_indices = {
+                sympy.Symbol(l['index'], positive=True): ((l['stop']-l['start'])//l['increment'])//3
+                for l in self.kernel.get_loop_stack(subs_consts=True)}
             warmup_iteration_count = self.kernel.indices_to_global_iterator(warmup_indices)
-        
-        # Align iteration count with cachelines
-        # do this by aligning either writes (preferred) or reads:
-        # Assumption: writes (and reads) increase linearly
-        o = list(self.kernel.compile_global_offsets(iteration=warmup_iteration_count))[0]
-        if o[1]:
-            # we have a write to work with:
-            first_offset = min(o[1])
-        else:
-            # we use reads
-            first_offset = min(o[0])
-        # Distance from cacheline boundary (in bytes)
-        diff = first_offset - \
-               (int(first_offset)>>csim.first_level.cl_bits<<csim.first_level.cl_bits)
-        warmup_iteration_count -= (diff//element_size)//inner_increment
-        warmup_indices = self.kernel.global_iterator_to_indices(warmup_iteration_count)
-
-        offsets += list(self.kernel.compile_global_offsets(
-            iteration=range(0, warmup_iteration_count)))
-
-        # Do the warm-up
-        csim.loadstore(offsets, length=element_size)
-        # FIXME compile_global_offsets should already expand to element_size
-
-        # Force write-back on all cache levels
-        csim.force_write_back()
-
-        # Reset stats to conclude warm-up phase
-        csim.reset_stats()
-
-        # Benchmark iterations:
-        # Strting point is one past the last warmup element
-        bench_iteration_start = warmup_iteration_count
-        # End point is the end of the current dimension (cacheline alligned)
-        first_dim_factor = int((inner_loop['stop'] - warmup_indices[inner_index] - 1) 
-                               // (elements_per_cacheline//inner_increment))
-        bench_iteration_end = (bench_iteration_start + 
-                               elements_per_cacheline*inner_increment*first_dim_factor)
-
-        # compile access needed for one cache-line
-        offsets = list(self.kernel.compile_global_offsets(
-            iteration=range(bench_iteration_start, bench_iteration_end)))
-        # simulate
-        csim.loadstore(offsets, length=element_size)
-        # FIXME compile_global_offsets should already expand to element_size
-
-        # Force write-back on all cache levels
-        csim.force_write_back()
+
+            # Make sure we are not handeling gigabytes of data, but 1.5x the maximum cache size
+            while warmup_iteration_count*element_size > max_cache_size*1.5:
+                for index in [sympy.Symbol(l['index'], positive=True)
+                              for l in self.kernel.get_loop_stack()]:
+                    if warmup_indices[index] > 1:
+                        warmup_indices[index] -= 1
+                        break
+                warmup_iteration_count = self.kernel.indices_to_global_iterator(warmup_indices)
+
+            # Align iteration count with cachelines
+            # do this by aligning either writes (preferred) or reads:
+            # Assumption: writes (and reads) increase linearly
+            o = list(self.kernel.compile_global_offsets(iteration=warmup_iteration_count))[0]
+            if o[1]:
+                # we have a write to work with:
+                first_offset = min(o[1])
+            else:
+                # we use reads
+                first_offset = min(o[0])
+            # Distance from cacheline boundary (in bytes)
+            diff = first_offset - \
+                   (int(first_offset)>>csim.first_level.cl_bits<<csim.first_level.cl_bits)
+            warmup_iteration_count -= (diff//element_size)//inner_increment
+            warmup_indices = self.kernel.global_iterator_to_indices(warmup_iteration_count)
+
+            offsets += list(self.kernel.compile_global_offsets(
+                iteration=range(0, warmup_iteration_count)))
+
+            # Do the warm-up
+            csim.loadstore(offsets, length=element_size)
+            # FIXME compile_global_offsets should already expand to element_size
+
+            # Force write-back on all cache levels
+            csim.force_write_back()
+
+            # Reset stats to conclude warm-up phase
+            csim.reset_stats()
+
+        with profiling.phase('predictor benchmark'):
+            # Benchmark iterations:
+            # Strting point is one past the last warmup element
+            bench_iteration_start = warmup_iteration_count
+            # End point is the end of the current dimension (cacheline alligned)
+            first_dim_factor = int((inner_loop['stop'] - warmup_indices[inner_index] - 1) 
+                                   // (elements_per_cacheline//inner_increment))
+            bench_iteration_end = (bench_iteration_start + 
+                                   elements_per_cacheline*inner_increment*first_dim_factor)
+
+            # compile access needed for one cache-line
+            offsets = list(self.kernel.compile_global_offsets(
+                iteration=range(bench_iteration_start, bench_iteration_end)))
+            # simulate
+            csim.loadstore(offsets, length=element_size)
+            # FIXME compile_global_offsets should already expand to element_size
+
+            # Force write-back on all cache levels
+            csim.force_write_back()
         
         # use stats to build results
         self.stats = list(csim.stats())
@@ -326,3 +339,244 @@ class CacheSimulationPredictor(CachePredictor):
                 'total lines evicts': self.stats[cache_level+1]['STORE_count']/first_dim_factor,
                 'cycles': None})
         return infos
+
+
+class AnalyticPredictor(CachePredictor):
+    '''
+    Predictor class based on analytic reuse analysis of LRU caches.
+
+    Accesses to each array are ordered by their offset, and each access reuses the cache line
+    touched by its predecessor some iterations earlier. Reuse hits in a cache level if less
+    than *ways* other lines, mapped to the same set, were loaded into that level in between.
+    Those lines are counted exactly from the address ranges all streams reaching that level
+    (i.e., missing in all levels above) covered in between.
+
+    Only the access functions and loop bounds are used, runtime is independent of the problem
+    size. Assumptions: steady state in the middle of the iteration space (boundary effects of
+    the inner loop are ignored), all streams advance with positive strides of at most one cache
+    line per iteration, and all data is cached if the data touched by the kernel fits into a level
+    (like CacheSimulationPredictor).
+
+    Misses and evicts agree with those of CacheSimulationPredictor, except if the touched data
+    barely fits into a level: the simulation then also sees conflict misses (e.g., L3 misses of
+    3d-long-range-stencil with N=M=100 on Sandy Bridge are 0.875 in the simulation and 0 here).
+    Hits follow the meaning of LayerConditionPredictor: cache lines per stream, which hit in this
+    or any level above. CacheSimulationPredictor counts hits per element access instead.
+    '''
+    def __init__(self, kernel, machine):
+        CachePredictor.__init__(self, kernel, machine)
+        csim = self.machine.get_cachesim()
+
+        # FIXME handle multiple datatypes
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        cacheline_size = self.machine['cacheline size']
+
+        loop_stack = list(self.kernel.get_loop_stack(subs_consts=True))
+        inner_loop = loop_stack[-1]
+        inner_index = inner_loop['index']
+
+        # Address distances translate to iterations only if outer loops sweep the arrays
+        # linearly: all outer loops have step length 1 and array references follow loop order
+        if any([l['increment'] != 1 for l in loop_stack[:-1]]):
+            raise ValueError("Can not apply analytic prediction, since not all outer loops are "
+                             "of step length 1.")
+
+        # Reference point in the middle of the iteration space
+        indices = {str(k): int(v) for k, v in self.kernel.global_iterator_to_indices(
+            self.kernel.iteration_length()//2).items()}
+        base_offsets = self.kernel.array_base_offsets()
+
+        # Gather streams (per array, by decreasing address) with their stride in bytes per
+        # iteration
+        streams = {}
+        strides = {}
+        destinations = {}
+        for var_name in base_offsets:
+            accesses = []
+            for kind, arefs in [('load', self.kernel._sources.get(var_name, [])),
+                                ('store', self.kernel._destinations.get(var_name, []))]:
+                for aref in arefs:
+                    expr = self.kernel.access_to_affine(var_name, aref, subs_consts=True)
+                    coefficients = [abs(expr.coefficients.get(l['index'], 0)) for l in loop_stack]
+                    coefficients = [c for c in coefficients if c != 0]
+                    if coefficients != sorted(coefficients, reverse=True):
+                        raise ValueError("Can not apply analytic prediction, order of indices in "
+                                         "array references does not follow order of loops.")
+                    stride = expr.coefficients.get(inner_index, 0) * \
+                        int(inner_loop['increment']) * element_size
+                    if stride == 0:
+                        # Invariant in inner loop, always cached
+                        continue
+                    if not 0 < stride <= cacheline_size:
+                        raise ValueError("Can not apply analytic prediction, strides in inner "
+                                         "loop need to be positive and at most one cache line.")
+                    address = expr.evaluate(indices)*element_size + base_offsets[var_name]
+                    accesses.append((address, kind, stride))
+            if not accesses:
+                continue
+            if len(set([a[2] for a in accesses])) > 1:
+                raise ValueError("Can not apply analytic prediction, accesses to {} have "
+                                 "different strides in inner loop.".format(var_name))
+            accesses.sort(reverse=True)
+            streams[var_name] = [a[0] for a in accesses]
+            strides[var_name] = accesses[0][2]
+            # Stores within one cache line are written back as one stream
+            store_addresses = [a[0] for a in accesses if a[1] == 'store']
+            destinations[var_name] = len(
+                [a for i, a in enumerate(store_addresses)
+                 if i == 0 or store_addresses[i-1] - a >= cacheline_size])
+        if not streams:
+            raise ValueError("Can not apply analytic prediction, no access depends on the inner "
+                             "loop index.")
+
+        # Lines per stream and per cache line of work
+        lines_per_stream = {v: s/element_size for v, s in strides.items()}
+        evicts = sum([destinations[v]*lines_per_stream[v] for v in streams])
+        array_sizes = self.kernel.array_sizes(in_bytes=True, subs_consts=True).values()
+        working_set = None
+
+        results = {'streams': streams, 'strides': strides, 'cache': []}
+        # Streams (array, index) reaching the current cache level, initially all
+        reaching = {v: list(range(len(a))) for v, a in streams.items()}
+        # Hits in all levels so far
+        hit_lines = 0.0
+        for c in csim.levels(with_mem=False):
+            hits = []
+            misses = []
+            # Full caching is decided like in CacheSimulationPredictor
+            full_caching = sum(array_sizes) < c.size()
+            if not full_caching and max(array_sizes) < c.size():
+                # Decide by data actually touched (e.g., without halos)
+                if working_set is None:
+                    working_set = FootprintAnalyzer(self.kernel).working_set()
+                full_caching = working_set < c.size()
+            if full_caching:
+                hits = [(v, i) for v in reaching for i in reaching[v]]
+            else:
+                for var_name, reaching_streams in reaching.items():
+                    for j, k in zip([None]+reaching_streams, reaching_streams):
+                        if j is None:
+                            # Leading stream, loads new data
+                            misses.append((var_name, k))
+                            continue
+                        if self._reuse_hits(
+                                var_name, j, k, reaching, streams, strides, c, element_size):
+                            hits.append((var_name, k))
+                        else:
+                            misses.append((var_name, k))
+
+            hit_lines += sum([lines_per_stream[v] for v, i in hits], 0.0)
+            results['cache'].append({
+                'name': c.name,
+                'hits': hit_lines,
+                'misses': sum([lines_per_stream[v] for v, i in misses], 0.0),
+                'evicts': evicts,
+                'missing streams': sorted(misses)})
+            reaching = defaultdict(list)
+            for v, i in sorted(misses):
+                reaching[v].append(i)
+
+        self.results = results
+
+    @staticmethod
+    def _reuse_hits(var_name, j, k, reaching, streams, strides, cache, element_size):
+        '''
+        Returns True if stream *k* of *var_name* hits *cache* with the line left by stream *j*
+
+        Considered is the first access of *k* to a line. The line was last accessed by *j* on
+        its last element, since then each stream reaching *cache* loaded the lines of the
+        elapsed iterations.
+        '''
+        cl_size = cache.cl_size
+        stride = strides[var_name]
+        address = streams[var_name][k]
+        target_line = address//cl_size
+        target_set = target_line % cache.sets
+        # Iterations since k was at the start of its current line
+        delay = (address - target_line*cl_size)/stride
+        # Iterations between last access of j and first access of k to target line
+        window = max(0, streams[var_name][j] - streams[var_name][k] - cl_size + element_size) / \
+            stride
+
+        conflicts = 0
+        for v, reaching_streams in reaching.items():
+            stride = strides[v]
+            # Line ranges covered by streams of this array, merged
+            ranges = []
+            for i in reaching_streams:
+                position = streams[v][i] - int(delay*stride)
+                ranges.append(((position - int(window*stride) + stride)//cl_size,
+                               (position + element_size - 1)//cl_size))
+            merged = []
+            for first, last in sorted(ranges, reverse=True):
+                if first > last:
+                    continue
+                if merged and last >= merged[-1][0] - 1:
+                    merged[-1] = (min(first, merged[-1][0]), max(last, merged[-1][1]))
+                else:
+                    merged.append((first, last))
+            for first, last in merged:
+                # Lines mapped to the same set as target line
+                conflicts += (last - target_set)//cache.sets - \
+                    (first - 1 - target_set)//cache.sets
+                if v == var_name and first <= target_line <= last:
+                    conflicts -= 1
+        return conflicts < cache.ways
+
+    def get_hits(self):
+        '''Returns a list with cache lines of hits per cache level'''
+        return [c['hits'] for c in self.results['cache']]
+
+    def get_misses(self):
+        '''Returns a list with cache lines of misses per cache level'''
+        return [c['misses'] for c in self.results['cache']]
+
+    def get_evicts(self):
+        '''Returns a list with cache lines of misses per cache level'''
+        return [c['evicts'] for c in self.results['cache']]
+
+    def get_infos(self):
+        '''Returns verbose information about the predictor'''
+        return self.results
+
+
+PREDICTORS = {'LC': LayerConditionPredictor,
+              'SIM': CacheSimulationPredictor,
+              'AN': AnalyticPredictor}
+
+
+# Protects predictions of machines, which may be shared among threads (e.g., in server mode)
+_predictions_lock = threading.Lock()
+# Number of predictors kept per machine, least recently used ones are dropped first
+PREDICTIONS_LIMIT = 16
+
+
+def get_predictor(name, kernel, machine):
+    '''
+    returns cache predictor *name* (LC, SIM or AN) for *kernel* on *machine*
+
+    Predictors are kept in machine.predictions, which is shared among what-if variants with the
+    same cache configuration (see MachineModel.what_if()). As long as a kernel and its constants
+    are unchanged, an existing prediction is reused. At most PREDICTIONS_LIMIT predictors are
+    kept, so long running processes (e.g., kerncraft serve) do not hold on to every kernel.
+    '''
+    if name not in PREDICTORS:
+        raise NotImplementedError("Unknown cache predictor, only LC (layer condition), "
+                                  "SIM (cache simulation with pycachesim) and AN (analytic) "
+                                  "are supported.")
+    state = tuple(sorted([(str(k), v) for k, v in kernel.constants.items()]))
+    key = (name, id(kernel), state)
+    with _predictions_lock:
+        cached = machine.predictions.pop(key, None)
+        # ids may be reused after a kernel was freed, so the kernel itself is compared as well
+        if cached is not None and cached[0] is kernel:
+            machine.predictions[key] = cached
+            return cached[1]
+
+    predictor = PREDICTORS[name](kernel, machine)
+    with _predictions_lock:
+        machine.predictions.pop(key, None)
+        machine.predictions[key] = (kernel, predictor)
+        while len(machine.predictions) > PREDICTIONS_LIMIT:
+            machine.predictions.popitem(last=False)
+    return predictor
@@ -22,6 +22,7 @@ from six.moves import range
 from ruamel import yaml
 
 from . import models
+from .api import create_pool, init_worker, worker_state
 from .kernel import KernelCode, KernelDescription
 from .machinemodel import MachineModel
 
@@ -39,33 +40,243 @@ def create_parser():
                         help='Increases verbosity level.')
     parser.add_argument('--cores', '-c', metavar='CORES', type=int, default=1,
                         help='Number of cores to be used in parallel. (default: 1)')
+    parser.add_argument('--cache-predictor', '-P', choices=['LC', 'SIM', 'AN'], default='SIM',
+                        help='Change cache predictor to use, options are LC (layer conditions), '
+                             'SIM (cache simulation with pycachesim) and AN (analytic LRU miss '
+                             'counting), default is SIM.')
+    parser.add_argument('--jobs', '-j', metavar='JOBS', type=int, default=1,
+                        help='Number of model evaluations to run in parallel. (default: 1)')
+    parser.add_argument('--analytic', action='store_true',
+                        help='Solve layer conditions for block lengths instead of searching with '
+                             'the ECMData model.')
+    parser.add_argument('--safety-factor', metavar='FACTOR', type=float, default=0.5,
+                        help='Fraction of each cache considered available by --analytic. '
+                             '(default: 0.5)')
+    parser.add_argument('--cache-level', metavar='LEVEL',
+                        help='Cache level to block for with --analytic, defaults to the first '
+                             'level reachable with at least the minimal block length.')
+    parser.add_argument('--confirm', action='store_true',
+                        help='Confirm block length found by --analytic with one model '
+                             'evaluation.')
     parser.add_argument('description_file', metavar='FILE', type=argparse.FileType(),
                         help='File with loop kernel description in YAML')
     return parser
 
 
-def simulate(kernel, model, define_dict, blocking_constant, blocking_length):
-    '''Setup and execute model with given blocking length'''
+def _setup_worker(description, machine_path, model_args):
+    '''Parse kernel description and machine file once per evaluation process'''
+    kernel = KernelDescription(yaml.load(description, Loader=yaml.Loader))
+    machine = MachineModel(machine_path)
+    return {'kernel': kernel, 'model': models.ECMData(kernel, machine, model_args)}
+
+
+def _evaluate(point):
+    '''Setup and execute model with given constants, returns cycles per transfer level'''
+    worker = worker_state(_setup_worker)
+    kernel = worker['kernel']
+    model = worker['model']
     kernel.clear_state()
 
-    # Add constants from define arguments
-    for k, v in define_dict.items():
+    for k, v in point:
         kernel.set_constant(k, v)
-    
-    kernel.set_constant(blocking_constant, blocking_length)
 
     model.analyze()
-    return sum([cy for dscr, cy in model.results['cycles']])
+    return point, [(level, float(cy)) for level, cy in model.results['cycles']]
+
+
+class ModelEvaluator(object):
+    '''
+    Memoizing and (optionally) parallel evaluator of the ECMData model
+
+    Points are dictionaries mapping blocking constant names to block lengths. Constants given by
+    *define_dict* are added to each evaluation.
+    '''
+    def __init__(self, description, machine_path, model_args, define_dict, jobs=1):
+        self.define_dict = define_dict
+        self.cache = {}
+        init_args = (description, machine_path, model_args)
+        if jobs > 1:
+            self._pool = create_pool(jobs, _setup_worker, *init_args)
+        else:
+            self._pool = None
+            init_worker(_setup_worker, *init_args)
+
+    def _key(self, point):
+        constants = dict(self.define_dict)
+        constants.update(point)
+        return tuple(sorted((six.text_type(k), int(v)) for k, v in constants.items()))
+
+    def evaluate(self, points):
+        '''Returns list of cycles per transfer level for each point, only unknown points are
+        passed to the model'''
+        keys = [self._key(p) for p in points]
+        missing = sorted(set(k for k in keys if k not in self.cache))
+        if self._pool is not None:
+            results = self._pool.map(_evaluate, missing)
+        else:
+            results = list(map(_evaluate, missing))
+        self.cache.update(results)
+        return [self.cache[k] for k in keys]
+
+    def evaluated_points(self, blocking_constants):
+        '''Returns list of (point, cycles) tuples of all evaluations done so far'''
+        names = [six.text_type(c) for c in blocking_constants]
+        evaluated = []
+        for key, cycles in self.cache.items():
+            key = dict(key)
+            evaluated.append(({c: key[n] for c, n in zip(blocking_constants, names)}, cycles))
+        return evaluated
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+def point_rank(point, cycles):
+    '''Sort key for points: lowest runtime first, larger blocks win ties'''
+    return (sum([cy for level, cy in cycles]), -reduce(operator.mul, point.values(), 1))
+
+
+def layer_condition_block_lengths(kernel, machine, define_dict, blocking_constants,
+                                 safety_factor=1.0):
+    '''
+    Solves the layer conditions for the largest block length fitting each cache level
+
+    Returns a list of dictionaries with dimension, cache level and block length. Only
+    *safety_factor* of each cache's size is considered available. With multiple blocking constants,
+    all blocks are assumed to be of equal length. An empty list is returned if layer conditions can
+    not be applied to the kernel.
+    '''
+    kernel.clear_state()
+    for k, v in define_dict.items():
+        kernel.set_constant(k, v)
+    # Dummy values for blocking constants, layer conditions stay symbolic in them
+    for c in blocking_constants:
+        kernel.set_constant(c, 1)
+
+    lc = models.LC(kernel, machine)
+    try:
+        lc.analyze()
+    except ValueError:
+        return []
+    finally:
+        kernel.clear_state()
+
+    cache_order = [l['level'] for l in machine['memory hierarchy']]
+    x = sympy.Symbol('x', positive=True)
+    defined = {sympy.Symbol(k, positive=True): v for k, v in define_dict.items()}
+    equal_lengths = {c: x for c in blocking_constants}
+    solutions = []
+    for dimension, lc_info in sorted(lc.results['dimensions'].items()):
+        requirement = lc_info['cache_requirement_bytes'].subs(defined).subs(equal_lengths)
+        if x not in requirement.free_symbols:
+            continue
+        for cache_name, cache_info in lc_info['caches'].items():
+            available = cache_info['cache_size']*safety_factor
+            roots = [r for r in sympy.solve(sympy.Eq(requirement, available), x)
+                     if r.is_real and r > 0]
+            if not roots:
+                continue
+            solutions.append({'dimension': dimension,
+                              'cache': cache_name,
+                              'cache size': cache_info['cache_size'],
+                              'length': int(max(roots))})
+    solutions.sort(key=lambda s: (cache_order.index(s['cache']), s['dimension']))
+    return solutions
+
+
+def layer_condition_seeds(kernel, machine, define_dict, blocking_constants, min_length,
+                          max_length):
+    '''Returns block sizes at which the layer conditions are just fulfilled'''
+    seeds = []
+    for solution in layer_condition_block_lengths(
+            kernel, machine, define_dict, blocking_constants):
+        length = min(max(solution['length'], min_length), max_length)
+        seed = {c: length for c in blocking_constants}
+        if seed not in seeds:
+            seeds.append(seed)
+    return seeds
+
+
+def refine(evaluator, start, min_length, max_length, min_step=10, rel_resolution=1/32):
+    '''
+    Local pattern search around *start*
+
+    All neighbours (+/- step in each dimension) are evaluated in one batch, the best is moved to.
+    If no neighbour is better, step lengths are halved until they fall below *min_step* or
+    *rel_resolution* of the current block length.
+    '''
+    current = dict(start)
+    current_rank = point_rank(current, evaluator.evaluate([current])[0])
+    steps = {c: max(v//2, min_step) for c, v in current.items()}
+
+    def active_steps():
+        return {c: s for c, s in steps.items()
+                if s >= max(min_step, int(current[c]*rel_resolution))}
+
+    while active_steps():
+        neighbours = []
+        for c, s in active_steps().items():
+            for v in (current[c]-s, current[c]+s):
+                v = min(max(v, min_length), max_length)
+                if v != current[c]:
+                    n = dict(current)
+                    n[c] = v
+                    neighbours.append(n)
+        best = None
+        for n, cycles in zip(neighbours, evaluator.evaluate(neighbours)):
+            rank = point_rank(n, cycles)
+            if rank < current_rank and (best is None or rank < best[1]):
+                best = (n, rank)
+        if best is not None:
+            current, current_rank = best
+        else:
+            steps = {c: s//2 for c, s in steps.items()}
+
+    return current
+
+
+def pareto_sets(evaluated, rel_tolerance=1e-6):
+    '''
+    Returns Pareto optimal block sizes for each transfer level
+
+    A point qualifies for a level, if it achieves the minimal cycle count of that level. Of all
+    qualifying points those are kept that are not dominated by a point with larger or equal block
+    lengths in all dimensions.
+    '''
+    if not evaluated:
+        return []
+    levels = [level for level, cy in evaluated[0][1]]
+    result = []
+    for i, level in enumerate(levels):
+        min_cycles = min([cycles[i][1] for point, cycles in evaluated])
+        qualified = [point for point, cycles in evaluated
+                     if cycles[i][1] <= min_cycles*(1+rel_tolerance)]
+        pareto = []
+        for p in qualified:
+            dominated = any(q != p and all(q[c] >= p[c] for c in p) for q in qualified)
+            if not dominated and p not in pareto:
+                pareto.append(p)
+        pareto.sort(key=lambda p: sorted((six.text_type(k), v) for k, v in p.items()))
+        result.append((level, min_cycles, pareto))
+    return result
+
+
+def format_point(point):
+    return ', '.join(['{}={}'.format(k, v)
+                      for k, v in sorted(point.items(), key=lambda i: six.text_type(i[0]))])
 
 
 def run(parser, args):
     # machine information
     # Read machine description
     machine = MachineModel(args.machine.name)
-    
+
     # process kernel description
     description = six.text_type(args.description_file.read())
-    kernel = KernelDescription(yaml.load(description))
+    kernel = KernelDescription(yaml.load(description, Loader=yaml.Loader))
 
     # Add constants from define arguments
     define_dict = {}
@@ -73,72 +284,138 @@ def run(parser, args):
         assert name not in define_dict, "Redefinition of constants is not allowed."
         define_dict[name] = int(value)
 
-    model = models.ECMData(kernel, machine, args, parser)
-    
-    # Select constant to search blocksize for
+    # Select constants to search blocksize for
     undefined_constants = set()
     for var_name, var_info in kernel.variables.items():
         var_type, var_size = var_info
+        if var_size is None:
+            continue
         for size in var_size:
             for s in size.atoms(sympy.Symbol):
                 if s.name not in define_dict:
                     undefined_constants.add(s)
-    assert len(undefined_constants) == 1, "There are multiple or none undefined constants {!r}. " \
-        "Exactly one must be undefined.".format(undefined_constants)
-    blocking_constant = undefined_constants.pop()
-    
+    assert len(undefined_constants) >= 1, "There are no undefined constants. At least one " \
+        "must be undefined."
+    blocking_constants = sorted(undefined_constants, key=lambda s: s.name)
+
     if args.verbose >= 1:
-        print("blocking constant:", blocking_constant)
-        
+        print("blocking constants:", ', '.join(map(str, blocking_constants)))
+
     # min and max block lengths
     min_length = args.min_block_length
-    min_runtime = simulate(kernel, model, define_dict, blocking_constant, min_length)
-    
-    # determain max search length
-    # upper bound: number of floats that fit into the last level cache
-    max_length = int(machine['memory hierarchy'][-2]['size per group'])//4
+    # upper bound: number of elements that fit into the last level cache
+    element_size = kernel.datatypes_size[kernel.datatype]
+    llc_size = max([c.size() for c in machine.get_cachesim().levels(with_mem=False)])
+    max_length = int(llc_size)//element_size
     if args.verbose >= 1:
-        print("upper search bound:", max_length)
-    length = min_length*3
-    while length < max_length:
-        runtime = simulate(kernel, model, define_dict, blocking_constant, length)
-        if args.verbose >= 1:
-            print("min", min_length, min_runtime, "current", length, runtime, "max", max_length)
-        
-        # Increase search window
-        if runtime > min_runtime:
-            max_length = length  # and break
-        else:
-            length *= 2  # continue search
-    
-    # search end of block
-    while max_length - min_length > 10:
-        # Take median for benchmark:
-        length = (max_length - min_length) // 2 + min_length
-        
-        # Execute simulation
-        runtime = simulate(kernel, model, define_dict, blocking_constant, length)
-        if args.verbose >= 1:
-            print("min", min_length, min_runtime, "current", length, runtime, "max", max_length)
-        
-        # Narrow search area
-        if runtime <= min_runtime:
-            min_runtime = runtime
-            min_length = length
-        else:
-            max_runtime = runtime
-            max_length = length
-    
-    if length <= max_length:
-        if args.verbose:
-            print("found for {}:".format(blocking_constant))
-        print(length)
-        sys.exit(0)
+        print("search bounds:", min_length, max_length)
+
+    model_args = argparse.Namespace(
+        cache_predictor=args.cache_predictor, cores=args.cores, verbose=0, unit=None)
+
+    if args.analytic:
+        best_point = analytic_block_lengths(
+            args, kernel, machine, define_dict, blocking_constants, min_length, max_length)
+        if args.confirm:
+            evaluator = ModelEvaluator(description, args.machine.name, model_args, define_dict)
+            cycles = evaluator.evaluate([best_point])[0]
+            print('confirmed with {}: {} cy/CL'.format(
+                args.cache_predictor,
+                ' | '.join(['{} = {:.1f}'.format(level, cy) for level, cy in cycles])))
     else:
-        if args.verbose:
-            print("nothing found. exceeded search window and not change in performance found.")
+        best_point = search_block_lengths(
+            args, kernel, description, machine, model_args, define_dict, blocking_constants,
+            min_length, max_length)
+
+    if len(blocking_constants) == 1:
+        print(best_point[blocking_constants[0]])
+    else:
+        print(format_point(best_point))
+
+    return best_point
+
+
+def analytic_block_lengths(args, kernel, machine, define_dict, blocking_constants, min_length,
+                           max_length):
+    '''Select block lengths from layer condition solutions, without any model evaluation'''
+    solutions = layer_condition_block_lengths(
+        kernel, machine, define_dict, blocking_constants, safety_factor=args.safety_factor)
+    if not solutions:
+        print("Layer conditions can not be applied to this kernel, try without --analytic.",
+              file=sys.stderr)
         sys.exit(1)
-        
+
+    # Per cache level, the highest dimension that still allows the minimal block length
+    selected = {}
+    for s in solutions:
+        if s['length'] >= min_length:
+            selected[s['cache']] = s
+
+    print("Layer condition block lengths (safety factor {}):".format(args.safety_factor))
+    for s in solutions:
+        print('{:>8} {}D: {} <= {}{}'.format(
+            s['cache'], s['dimension'], ', '.join(map(str, blocking_constants)), s['length'],
+            ' *' if selected.get(s['cache']) is s else ''))
+
+    if args.cache_level:
+        if args.cache_level not in selected:
+            print("No block length of at least {} fits into {}.".format(
+                min_length, args.cache_level), file=sys.stderr)
+            sys.exit(1)
+        target = selected[args.cache_level]
+    else:
+        if not selected:
+            print("No block length of at least {} fits into any cache level.".format(
+                min_length), file=sys.stderr)
+            sys.exit(1)
+        target = min(selected.values(), key=lambda s: solutions.index(s))
+
+    if args.verbose >= 1:
+        print("blocking for {} {}D layer condition".format(target['cache'], target['dimension']))
+    return {c: min(target['length'], max_length) for c in blocking_constants}
+
+
+def search_block_lengths(args, kernel, description, machine, model_args, define_dict,
+                         blocking_constants, min_length, max_length):
+    '''Search block lengths with the ECMData model, seeded by layer conditions'''
+    evaluator = ModelEvaluator(description, args.machine.name, model_args, define_dict,
+                               jobs=args.jobs)
+    try:
+        # Analytic seeding from layer conditions
+        seeds = layer_condition_seeds(
+            kernel, machine, define_dict, blocking_constants, min_length, max_length)
+        if not seeds:
+            # Fall back to a geometric ladder of equal block lengths
+            ladder = []
+            length = min_length
+            while length < max_length:
+                ladder.append({c: length for c in blocking_constants})
+                length *= 2
+            ladder.append({c: max_length for c in blocking_constants})
+            best = min(zip(ladder, evaluator.evaluate(ladder)), key=lambda pc: point_rank(*pc))
+            seeds = [best[0]]
+        if args.verbose >= 1:
+            print("seeds:", '; '.join(map(format_point, seeds)))
+
+        # Local refinement around each seed
+        candidates = [refine(evaluator, s, min_length, max_length) for s in seeds]
+        best = min(zip(candidates, evaluator.evaluate(candidates)), key=lambda pc: point_rank(*pc))
+        best_point, best_cycles = best
+
+        if args.verbose >= 1:
+            print("evaluations:", len(evaluator.cache))
+        print("Pareto optimal block sizes per cache level:")
+        for level, min_cycles, pareto in pareto_sets(
+                evaluator.evaluated_points(blocking_constants)):
+            print('{:>8}: {:.1f} cy/CL with {}'.format(
+                level, min_cycles, '; '.join(map(format_point, pareto))))
+        if args.verbose >= 1:
+            print("found for {}:".format(', '.join(map(str, blocking_constants))))
+    finally:
+        evaluator.close()
+
+    return best_point
+
 
 def main():
     # Create and populate parser
@@ -152,4 +429,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+'''
+Analysis of many kernels in one pool of processes (kerncraft corpus)
+
+Kernels are given as files, directories (all *.c files in them) or glob patterns. Constants are
+taken from the .testcases file next to a kernel (e.g., 2d-5pt.testcases for 2d-5pt.c), if there
+is one, otherwise from --define:
+
+    [{'constants': [('N', 2000), ('M', 62500)]}, ...]
+
+Every combination of kernel, constants, model and machine is a work item. Items are distributed
+to a pool of processes, which keep parsed kernels, machines and in-core analyses for all their
+items. Results are reported as soon as they are available and added to one --store file, which is
+saved after each finished item.
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import ast
+import copy
+import glob
+import itertools
+import multiprocessing
+import os
+import pickle
+import shutil
+import sys
+import time
+
+import six
+
+from . import models
+from . import output
+from . import kerncraft as kc
+from .api import create_options, create_pool, init_worker, worker_state
+from .kernel import KernelCode, get_c_parser
+from .machinemodel import MachineModel
+from .pycparser import clean_code
+
+
+def discover_kernels(paths):
+    '''returns sorted list of kernel files in *paths* (files, directories or glob patterns)'''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = glob.glob(os.path.join(path, '*.c'))
+        elif os.path.exists(path):
+            found = [path]
+        else:
+            found = glob.glob(path)
+        files += [f for f in found if f not in files]
+    return sorted(files)
+
+
+def load_testcases(kernel_file):
+    '''
+    returns list of cases in the .testcases file accompanying *kernel_file* or None if there is
+    no such file
+    '''
+    testcases_file = os.path.splitext(kernel_file)[0] + '.testcases'
+    if not os.path.exists(testcases_file):
+        return None
+    with open(testcases_file) as f:
+        return ast.literal_eval(f.read())
+
+
+def load_constants(kernel_file, define=()):
+    '''
+    returns list of constants (dictionaries) to analyze *kernel_file* with
+
+    Constants are read from the accompanying .testcases file, if it exists. Otherwise all
+    combinations of *define* (list of name and values) are returned.
+    '''
+    testcases = load_testcases(kernel_file)
+    if testcases is not None:
+        return [dict(case['constants']) for case in testcases]
+    if not define:
+        return []
+    return [dict(constants) for constants in itertools.product(
+        *[[(name, v) for v in values] for name, values in define])]
+
+
+def collect_items(kernel_files, machines, model_names, define=()):
+    '''returns list of work items, one per kernel, constants, model and machine'''
+    items = []
+    for kernel_file in kernel_files:
+        constants_list = load_constants(kernel_file, define)
+        if not constants_list:
+            # reported as skipped
+            constants_list = [None]
+        for constants in constants_list:
+            for model_name in model_names:
+                for machine in machines:
+                    items.append({'kernel': kernel_file, 'constants': constants,
+                                  'model': model_name, 'machine': machine})
+    return items
+
+
+def _setup_worker(args):
+    '''returns state of worker process: options, parsed kernels and machines'''
+    get_c_parser()
+    return {'args': args, 'kernels': {}, 'machines': {}}
+
+
+def analyze_item(item):
+    '''
+    analyzes work *item* and returns it with "status" (ok, error or skipped), "time" and
+    "results", "storage key" and "summary" (or "error")
+
+    Items may contain "options" (e.g., {'cache_predictor': 'LC'}), which overwrite the model
+    options of the run for this item.
+    '''
+    item = dict(item)
+    start = time.time()
+    if item['constants'] is None:
+        item.update(status='skipped', error='no constants (.testcases file or --define)',
+                    time=0.0)
+        return item
+    try:
+        worker = worker_state(_setup_worker)
+        kernels, machines = worker['kernels'], worker['machines']
+        if item['kernel'] not in kernels:
+            with open(item['kernel']) as f:
+                # without file name, intermediate files are temporary and do not collide among
+                # worker processes
+                kernels[item['kernel']] = KernelCode(clean_code(six.text_type(f.read())))
+        if item['machine'] not in machines:
+            machines[item['machine']] = MachineModel(item['machine'])
+        kernel, machine = kernels[item['kernel']], machines[item['machine']]
+
+        kernel.clear_state()
+        for name, value in sorted(item['constants'].items()):
+            kernel.set_constant(name, value)
+        args = worker['args']
+        if item.get('options'):
+            args = copy.copy(args)
+            for name, value in item['options'].items():
+                setattr(args, name, value)
+        model = getattr(models, item['model'])(kernel, machine, args)
+        model.analyze()
+        item.update({'status': 'ok', 'results': model.results,
+                     'storage key': tuple(kernel.constants.items()),
+                     'summary': output.summarize(
+                         item['model'], model, os.path.basename(item['machine']),
+                         format_constants(item['constants']))})
+    except (Exception, SystemExit) as e:
+        # models exit on unsupported kernels and machines
+        item.update(status='error', error='{}: {}'.format(type(e).__name__, e))
+    item['time'] = time.time() - start
+    return item
+
+
+def run(items, args, jobs=1, callback=None):
+    '''
+    analyzes *items* with model options *args* on *jobs* processes and returns them, in order of
+    completion (calling *callback* with each)
+    '''
+    pool = None
+    if jobs > 1:
+        pool = create_pool(jobs, _setup_worker, args)
+        finished_items = pool.imap_unordered(analyze_item, items)
+    else:
+        init_worker(_setup_worker, args)
+        finished_items = (analyze_item(item) for item in items)
+    finished = []
+    try:
+        for item in finished_items:
+            finished.append(item)
+            if callback:
+                callback(item)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return finished
+
+
+def format_constants(constants):
+    return ' '.join(['{}={}'.format(k, v) for k, v in sorted((constants or {}).items())])
+
+
+def format_item(item):
+    summary = item.get('summary') or {}
+    line = '{:<7} {:>8.2f} s  {} {} {} {}'.format(
+        item['status'], item['time'], os.path.basename(item['kernel']),
+        format_constants(item['constants']), item['model'], os.path.basename(item['machine']))
+    if summary.get('cy/CL') is not None:
+        line += '  {:.2f} cy/CL'.format(summary['cy/CL'])
+    if summary.get('bottleneck'):
+        line += ' ({})'.format(summary['bottleneck'])
+    return line
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='kerncraft corpus', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='Kernel files, directories containing them or glob patterns.')
+    parser.add_argument('--machine', '-m', type=kc.machine_path, required=True, action='append',
+                        dest='machines', metavar='MACHINE',
+                        help='Path to machine description yaml file or to a directory of them. '
+                             'May be given multiple times.')
+    parser.add_argument('--pmodel', '-p', choices=models.__all__, required=True, action='append',
+                        default=[], help='Performance model to apply. May be given multiple '
+                                         'times.')
+    parser.add_argument('-D', '--define', nargs=2, metavar=('KEY', 'VALUE'), default=[],
+                        action=kc.AppendStringRange,
+                        help='Define constant for kernels without .testcases file. Values must '
+                             'be integer or match start-stop[:num[log[base]]].')
+    parser.add_argument('--cache-predictor', '-P', choices=['LC', 'SIM', 'AN'], default='SIM',
+                        help='Cache predictor to use (default: SIM).')
+    parser.add_argument('--cores', '-c', metavar='CORES', type=int, default=1,
+                        help='Number of cores to be used in parallel. (default: 1)')
+    parser.add_argument('--incore-model', choices=['IACA', 'builtin'], default='IACA',
+                        help='In-core analyzer used by ECM, ECMCPU and RooflineIACA models '
+                             '(default: IACA).')
+    parser.add_argument('--tool-timeout', metavar='SECONDS', type=float,
+                        help='Abort work items if an external tool of the in-core analysis '
+                             '(compiler, assembler or iaca.sh) runs longer than SECONDS.')
+    parser.add_argument('--jobs', '-j', metavar='JOBS', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Number of processes (default: number of CPUs).')
+    parser.add_argument('--store', metavar='PICKLE',
+                        help='Adds results to PICKLE file for later processing.')
+    parser.add_argument('--output-format', choices=['text', 'jsonl', 'csv'], default='text',
+                        help='Output format: text (one line per work item, default), jsonl or '
+                             'csv (see kerncraft --output-format).')
+    parser.add_argument('--output', '-o', metavar='FILE', type=argparse.FileType('w'),
+                        help='Write output to FILE instead of stdout.')
+    parser.add_argument('--verbose', '-v', action='count', default=0,
+                        help='Print errors of work items.')
+    return parser
+
+
+def main(argv=None, output_file=sys.stdout):
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('--jobs needs to be at least 1')
+    machines = kc.machine_files(args.machines)
+    kernel_files = discover_kernels(args.paths)
+    if not machines:
+        parser.error('no machine files (*.yml or *.yaml) found')
+    if not kernel_files:
+        parser.error('no kernel files found')
+    if args.output:
+        output_file = args.output
+
+    model_args = create_options({'cache_predictor': args.cache_predictor, 'cores': args.cores,
+                                 'incore_model': args.incore_model,
+                                 'tool_timeout': args.tool_timeout}, args.pmodel)
+    define = [(name, list(values)) for name, values in args.define]
+    items = collect_items(kernel_files, machines, args.pmodel, define)
+
+    writer = None
+    if args.output_format != 'text':
+        writer = output.WRITERS[args.output_format](output_file)
+    result_storage = {}
+    if args.store and os.path.exists(args.store):
+        with open(args.store, 'rb') as f:
+            try:
+                result_storage = pickle.load(f)
+            except EOFError:
+                pass
+
+    def store():
+        # Save storage to file (if requested)
+        if args.store:
+            tempname = args.store + '.tmp'
+            with open(tempname, 'wb+') as f:
+                pickle.dump(result_storage, f)
+            shutil.move(tempname, args.store)
+
+    def report(item):
+        if item['status'] == 'ok':
+            storage_name = item['model']
+            if len(machines) > 1:
+                storage_name += ' ({})'.format(os.path.basename(item['machine']))
+            result_storage.setdefault(os.path.basename(item['kernel']), {}).setdefault(
+                item['storage key'], {})[storage_name] = item['results']
+            store()
+        if writer is None:
+            print(format_item(item), file=output_file)
+            if args.verbose > 0 and 'error' in item:
+                print('        ' + item['error'], file=output_file)
+            output_file.flush()
+        elif item['status'] == 'ok':
+            writer.write({'kernel': os.path.basename(item['kernel']), 'machine': item['machine'],
+                          'model': item['model'], 'constants': item['constants'],
+                          'results': item['results']})
+        else:
+            print(format_item(item) + ': ' + item['error'], file=sys.stderr)
+
+    start = time.time()
+    finished = run(items, model_args, min(args.jobs, len(items)), callback=report)
+
+    statuses = [i['status'] for i in finished]
+    print('{} items of {} kernels in {:.1f} s ({:.1f} s in items): {}'.format(
+        len(finished), len(kernel_files), time.time() - start,
+        sum([i['time'] for i in finished]),
+        ', '.join(['{} {}'.format(statuses.count(s), s)
+                   for s in ['ok', 'error', 'skipped'] if s in statuses])),
+        file=output_file if writer is None else sys.stderr)
+    if 'error' in statuses:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+'''
+Exact footprints (touched byte ranges) of array accesses in loop nests
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+
+import numpy
+
+from .intervals import Intervals
+
+
+def repeat(intervals, shift, count):
+    '''returns union of *count* copies of *intervals*, each moved by *shift* to the previous'''
+    if count <= 0:
+        return Intervals()
+    if shift == 0 or count == 1:
+        return intervals.copy()
+    if shift < 0:
+        return repeat(intervals.shift(shift*(count-1)), -shift, count)
+    lowers, uppers = intervals.arrays()
+    if len(lowers) == 1 and shift <= uppers[0] - lowers[0]:
+        # copies overlap or touch, resulting in one range
+        return Intervals([int(lowers[0]), int(uppers[0]) + shift*(count-1)], sane=True)
+
+    if shift > uppers[-1] - lowers[0]:
+        # copies are disjoint and in order
+        offsets = numpy.arange(count)*shift
+        return Intervals.from_arrays((lowers + offsets[:, numpy.newaxis]).ravel(),
+                                     (uppers + offsets[:, numpy.newaxis]).ravel(), sane=True)
+
+    # union of copies by doubling, i.e. log2(count) unions
+    result = Intervals()
+    offset = 0
+    block = intervals
+    copies = 1
+    while count:
+        if count & 1:
+            result = result | block.shift(offset)
+            offset += copies*shift
+        count >>= 1
+        if count:
+            block = block | block.shift(copies*shift)
+            copies *= 2
+    return result
+
+
+class FootprintAnalyzer(object):
+    '''
+    Computes the exact byte ranges touched in each array, per loop level.
+
+    Level *l* comprises loops *l* and deeper (in loop stack order) running through all their
+    iterations, while indices of outer loops are fixed. Thus level 0 is the whole kernel and
+    level len(loop stack) a single iteration of the inner most loop body.
+
+    Byte ranges are relative to the beginning of each array. Constants need to be set in kernel.
+    '''
+    def __init__(self, kernel, indices=None):
+        '''*indices* optionally fixes outer loop indices (dictionary of name: value), default is
+        the first iteration of each loop'''
+        self.kernel = kernel
+        self.loop_stack = list(kernel.get_loop_stack(subs_consts=True))
+        self.indices = {l['index']: int(l['start']) for l in self.loop_stack}
+        if indices:
+            self.indices.update({str(k): int(v) for k, v in indices.items()})
+        self._cache = {}
+
+    def iteration_counts(self):
+        '''returns number of iterations per loop'''
+        return [max(0, -(-int(l['stop'] - l['start'])//int(l['increment'])))
+                for l in self.loop_stack]
+
+    def access_intervals(self, var_name, access, level=0):
+        '''returns Intervals touched by a single *access* on *level*'''
+        element_size = self.kernel.datatypes_size[self.kernel.variables[var_name][0]]
+        expr = self.kernel.access_to_affine(var_name, access, subs_consts=True)
+        indices = dict(self.indices)
+        for l in self.loop_stack[level:]:
+            indices[l['index']] = int(l['start'])
+        address = int(expr.evaluate(indices))*element_size
+        intervals = Intervals([address, address + element_size], sane=True)
+        for l, count in reversed(list(zip(self.loop_stack, self.iteration_counts()))[level:]):
+            shift = expr.coefficients.get(l['index'], 0)*int(l['increment'])*element_size
+            intervals = repeat(intervals, shift, count)
+        return intervals
+
+    def touched(self, var_name, level=0):
+        '''returns Intervals of bytes touched in array *var_name* on *level*'''
+        if (var_name, level) not in self._cache:
+            intervals = Intervals()
+            for access in array_accesses(self.kernel, var_name):
+                intervals = intervals | self.access_intervals(var_name, access, level)
+            self._cache[(var_name, level)] = intervals
+        return self._cache[(var_name, level)]
+
+    def working_set(self, level=0):
+        '''returns number of bytes touched on *level*, in all arrays'''
+        return sum([len(self.touched(v, level)) for v in self.arrays()])
+
+    def arrays(self):
+        '''returns sorted names of arrays (non scalar variables)'''
+        return sorted([v for v, (t, size) in self.kernel.variables.items() if size is not None])
+
+    def analyze(self):
+        '''returns list of footprints, one per level'''
+        results = []
+        for level in range(len(self.loop_stack)+1):
+            arrays = {v: len(self.touched(v, level)) for v in self.arrays()}
+            results.append({
+                'level': level,
+                'loops': [l['index'] for l in self.loop_stack[level:]],
+                'arrays': arrays,
+                'ranges': {v: len(self.touched(v, level).data) for v in self.arrays()},
+                'working set': sum(arrays.values())})
+        return results
+
+    def report(self, output_file=sys.stdout):
+        print('{:>6} {:>12} {:>16}  {}'.format('level', 'loops', 'working set [B]',
+                                                'per array [B] (ranges)'),
+              file=output_file)
+        for r in self.analyze():
+            print('{:>6} {:>12} {:>16}  {}'.format(
+                r['level'], ','.join(r['loops']) or '-', r['working set'],
+                ' '.join(['{}: {} ({})'.format(v, r['arrays'][v], r['ranges'][v])
+                          for v in sorted(r['arrays'])])),
+                file=output_file)
+
+
+def array_accesses(kernel, var_name):
+    '''returns all (load and store) accesses to array *var_name*'''
+    return [a for a in kernel._sources.get(var_name, []) + kernel._destinations.get(var_name, [])
+            if a is not None]
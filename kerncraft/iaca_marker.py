@@ -11,6 +11,8 @@ if sys.version_info[0] == 2 and sys.version_info < (2, 7) or \
     sys.exit(1)
 
 import re
+from collections import Counter
+
 from six.moves import map
 from six.moves import input
 
@@ -26,6 +28,19 @@ END_MARKER = ['        movl      $222, %ebx # INSERTED BY KERNCRAFT IACA MARKER
               '        .byte     144        # INSERTED BY KERNCRAFT IACA MARKER UTILITY\n']
 
 
+# Line classification, tried in this order on comment-free lines
+LINE_RE = re.compile(
+    r'^(?:(?P<packed>v?(?:mul|add|sub|div)h?p[ds])'
+    r'|(?P<label>\S+:)'
+    r'|(?P<inc>inc[bwlq]?\s+%\[a-z0-9]+)'
+    r'|(?P<add>add[bwlq]?\s+\$[0-9]+,\s*%[a-z0-9]+)'
+    r'|(?P<dec>dec[bwlq]?)'
+    r'|(?P<sub>sub[bwlq]?\s+\$[0-9]+,))')
+MEM_REF_RE = re.compile(r'(?P<off>\d*)\(%(?P<basep>\w+),%(?P<idx>\w+)(?:,(?P<scale>\d))?\)$')
+REGISTER_RE = re.compile(r'%(?:[xy]mm[0-9]+|r[a-z0-9]+)')
+REGISTER_CLASSES = {'x': 'XMM', 'y': 'YMM', 'r': 'GP'}
+
+
 def find_asm_blocks(asm_lines):
     '''
     finds blocks probably corresponding to loops in assembly
@@ -34,64 +49,65 @@ def find_asm_blocks(asm_lines):
 
     last_label_line = -1
     last_label = None
+    jump_re = None
     packed_ctr = 0
     avx_ctr = 0
-    xmm_references = []
-    ymm_references = []
-    gp_references = []
+    references = {'XMM': Counter(), 'YMM': Counter(), 'GP': Counter()}
     mem_references = []
     increments = {}
     for i, line in enumerate(asm_lines):
         # Register access counts
-        ymm_references += re.findall('%ymm[0-9]+', line)
-        xmm_references += re.findall('%xmm[0-9]+', line)
-        gp_references += re.findall('%r[a-z0-9]+', line)
+        if '%' in line:
+            for reg in REGISTER_RE.findall(line):
+                references[REGISTER_CLASSES[reg[1]]][reg] += 1
 
         # Strip comments and whitespaces
         line = line.split('#')[0]
         line = line.strip()
 
-        if re.match(r"^[v]?(mul|add|sub|div)[h]?p[ds]", line):
+        m = LINE_RE.match(line)
+        kind = m.lastgroup if m else None
+        if kind == 'packed':
             if line.startswith('v'):
                 avx_ctr += 1
             packed_ctr += 1
-        elif re.match(r'^\S+:', line):
+        elif kind == 'label':
             last_label = line[0:line.find(':')]
             last_label_line = i
+            jump_re = None
+            if last_label:
+                jump_re = re.compile(r'^j[a-z]+\s+'+re.escape(last_label)+r'\s*')
 
             # Reset counters
             packed_ctr = 0
             avx_ctr = 0
-            xmm_references = []
-            ymm_references = []
-            gp_references = []
+            references = {'XMM': Counter(), 'YMM': Counter(), 'GP': Counter()}
             mem_references = []
             increments = {}
-        elif re.match(r'^inc[bwlq]?\s+%\[a-z0-9]+', line):
+        elif kind == 'inc':
             reg_start = line.find('%')+1
             increments[line[reg_start:]] = 1
-        elif re.match(r'^add[bwlq]?\s+\$[0-9]+,\s*%[a-z0-9]+', line):
+        elif kind == 'add':
             const_start = line.find('$')+1
             const_end = line[const_start+1:].find(',')+const_start+1
             reg_start = line.find('%')+1
             increments[line[reg_start:]] = int(line[const_start:const_end])
-        elif re.match(r'^dec[bwlq]?', line):
+        elif kind == 'dec':
             reg_start = line.find('%')+1
             increments[line[reg_start:]] = -1
-        elif re.match(r'^sub[bwlq]?\s+\$[0-9]+,', line):
+        elif kind == 'sub':
             const_start = line.find('$')+1
             const_end = line[const_start+1:].find(',')+const_start+1
             reg_start = line.find('%')+1
             increments[line[reg_start:]] = -int(line[const_start:const_end])
-        elif re.search(r'\d*\(%\w+,%\w+(,\d)?\)$', line):
-            m = re.search(r'(?P<off>\d*)\(%(?P<basep>\w+),%(?P<idx>\w+)(?:,(?P<scale>\d))?\)$',
-                          line)
+        elif line.endswith(')') and MEM_REF_RE.search(line):
+            m = MEM_REF_RE.search(line)
             mem_references.append((
                 int(m.group('off')) if m.group('off') else 0,
                 m.group('basep'),
                 m.group('idx'),
                 int(m.group('scale')) if m.group('scale') else 1))
-        elif last_label and re.match(r'^j[a-z]+\s+'+re.escape(last_label)+r'\s*', line):
+        elif jump_re is not None and line.startswith('j') and jump_re.match(line):
             # End of block
             # deduce loop increment from memory index register
             pointer_increment = None  # default -> can not decide, let user choose
@@ -115,18 +131,19 @@ def find_asm_blocks(asm_lines):
                         # good, all scales are equal
                         pointer_increment = mem_scales[0]*increments[idx_reg]
 
+            # (total, unique) register references
+            stats = {k: (sum(c.values()), len(c)) for k, c in references.items()}
             blocks.append({'first_line': last_label_line,
                            'last_line': i,
                            'ops': i-last_label_line,
                            'label': last_label,
                            'packed_instr': packed_ctr,
                            'avx_instr': avx_ctr,
-                           'XMM': (len(xmm_references), len(set(xmm_references))),
-                           'YMM': (len(ymm_references), len(set(ymm_references))),
-                           'GP': (len(gp_references), len(set(gp_references))),
-                           'regs': (len(xmm_references) + len(ymm_references) + len(gp_references),
-                                    len(set(xmm_references)) + len(set(ymm_references)) +
-                                    len(set(gp_references))),
+                           'XMM': stats['XMM'],
+                           'YMM': stats['YMM'],
+                           'GP': stats['GP'],
+                           'regs': (stats['XMM'][0] + stats['YMM'][0] + stats['GP'][0],
+                                    stats['XMM'][1] + stats['YMM'][1] + stats['GP'][1]),
                            'pointer_increment': pointer_increment,
                            'lines': asm_lines[last_label_line:i+1],})
 
@@ -0,0 +1,569 @@
+#!/usr/bin/env python
+'''
+In-core throughput analysis of marked assembly blocks.
+
+Two analyzers are available, both returning a dictionary with the keys "throughput" (block
+throughput in cycles), "port cycles" (dict of cycles per port) and "uops":
+  * iaca_analysis() runs Intel's iaca.sh on an assembled binary with IACA markers
+  * port_pressure_analysis() is a built-in static analyzer based on instruction tables (see
+    incore_tables/*.yml), which works offline and in-process
+
+latency_analysis() complements both with the loop-carried dependency (critical path) latency.
+'''
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import re
+import sys
+import math
+import copy
+import threading
+import subprocess
+from distutils.spawn import find_executable
+
+import six
+from ruamel import yaml
+
+from . import profiling
+from .kernel import check_output
+
+
+TABLES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'incore_tables')
+
+# Splits operand lists on commas outside of parenthesis (AT&T memory references)
+OPERAND_RE = re.compile(r'(?:[^,(]|\([^)]*\))+')
+VECTOR_REGISTER_RE = re.compile(r'%([xyz])mm[0-9]+')
+VECTOR_WIDTHS = {'x': ('xmm', 16), 'y': ('ymm', 32), 'z': ('zmm', 64)}
+# Instructions which do not write to their last operand or do not access memory at all
+NO_DESTINATION = ('cmp', 'test', 'ucomi', 'vucomi', 'comi', 'vcomi', 'prefetch', 'j')
+NO_MEMORY_ACCESS = ('lea', 'nop')
+# Instructions which also read their (register) destination, besides two-operand forms
+READS_DESTINATION = ('vfmadd', 'vfmsub', 'vfnmadd', 'vfnmsub')
+ZERO_IDIOMS = ('xor', 'vxorpd', 'vxorps', 'vpxor', 'pxor', 'xorpd', 'xorps', 'sub')
+
+# Maps register names to the full architectural register they are part of
+REGISTER_ALIASES = {}
+for _l in 'abcd':
+    for _name in ['r{}x', 'e{}x', '{}x', '{}l', '{}h']:
+        REGISTER_ALIASES[_name.format(_l)] = 'r{}x'.format(_l)
+for _l in ['si', 'di', 'bp', 'sp']:
+    for _name in ['r{}', 'e{}', '{}', '{}l']:
+        REGISTER_ALIASES[_name.format(_l)] = 'r{}'.format(_l)
+for _n in range(8, 16):
+    for _name in ['r{}', 'r{}d', 'r{}w', 'r{}b']:
+        REGISTER_ALIASES[_name.format(_n)] = 'r{}'.format(_n)
+for _n in range(32):
+    for _name in ['xmm{}', 'ymm{}', 'zmm{}']:
+        REGISTER_ALIASES[_name.format(_n)] = 'vmm{}'.format(_n)
+
+
+def load_instruction_table(machine):
+    '''
+    returns the instruction table for *machine*
+
+    The "instruction table" entry of the machine description is used if present, otherwise the
+    built-in table matching its "micro-architecture".
+    '''
+    try:
+        return machine['instruction table']
+    except KeyError:
+        pass
+    table_path = os.path.join(TABLES_DIR, machine['micro-architecture']+'.yml')
+    if not os.path.exists(table_path):
+        raise ValueError(
+            "No instruction table available for micro-architecture {}. Add an "
+            "'instruction table' entry to the machine description.".format(
+                machine['micro-architecture']))
+    with open(table_path) as f:
+        return yaml.load(f, Loader=yaml.Loader)
+
+
+def parse_instruction(line):
+    '''
+    returns (mnemonic, operands) of an AT&T assembly *line*
+
+    None is returned for empty lines, labels and directives.
+    '''
+    line = line.split('#')[0].strip()
+    if not line or line.endswith(':') or line.startswith('.'):
+        return None
+    parts = line.split(None, 1)
+    operands = []
+    if len(parts) > 1:
+        operands = [o.strip() for o in OPERAND_RE.findall(parts[1]) if o.strip()]
+    return parts[0], operands
+
+
+def _table_keys(mnemonic, vector_width):
+    '''returns instruction table keys to try for *mnemonic*, most specific first'''
+    names = [mnemonic]
+    if vector_width:
+        # FMA operand orders, legacy SSE encodings and single precision share entries
+        for transform in [lambda m: re.sub(r'^(v?fn?m(?:add|sub))(?:132|213|231)', r'\1', m),
+                          lambda m: m if m.startswith('v') else 'v'+m,
+                          lambda m: re.sub(r'([ps])s$', r'\1d', m)]:
+            names += [transform(n) for n in names]
+    if re.match(r'^[a-z]+[bwlq]$', mnemonic):
+        # operand size suffix
+        names.append(mnemonic[:-1])
+    if mnemonic.startswith('j') and mnemonic != 'jmp':
+        names.append('jcc')
+
+    keys = []
+    for n in names:
+        for k in ([n+' '+vector_width] if vector_width else []) + [n]:
+            if k not in keys:
+                keys.append(k)
+    return keys
+
+
+def lookup_instruction(mnemonic, operands, table):
+    '''returns (key, entry) of instruction table matching *mnemonic* and *operands*'''
+    widths = sorted(set(VECTOR_REGISTER_RE.findall(' '.join(operands))))
+    vector_width = VECTOR_WIDTHS[widths[-1]][0] if widths else None
+    for key in _table_keys(mnemonic, vector_width):
+        if key in table['instructions']:
+            return key, table['instructions'][key]
+    return None, None
+
+
+def _access_size(mnemonic, operands):
+    '''returns the number of bytes loaded or stored by an instruction'''
+    widths = sorted(set(VECTOR_REGISTER_RE.findall(' '.join(operands))))
+    if not widths or re.search(r'(sd|q|broadcastsd)$', mnemonic):
+        return 8
+    elif re.search(r'(ss|l|broadcastss)$', mnemonic):
+        return 4
+    elif re.search(r'f128$', mnemonic):
+        return 16
+    return VECTOR_WIDTHS[widths[-1]][1]
+
+
+def instruction_uops(mnemonic, operands, table):
+    '''
+    returns (uops, port uops, latency, key) of an instruction
+
+    *port uops* is a list of (cycles, ports) tuples, including those of memory accesses. *key* is
+    None if the instruction was not found in *table*.
+    '''
+    key, entry = lookup_instruction(mnemonic, operands, table)
+    if entry is None:
+        return 0, [], 0, None
+
+    memory_operands = [o for o in operands if '(' in o]
+    is_store = bool(operands) and '(' in operands[-1] and not mnemonic.startswith(NO_DESTINATION)
+    is_load = bool(memory_operands) and (
+        not is_store or not entry.get('move') or len(memory_operands) > 1)
+    if key.split()[0] in NO_MEMORY_ACCESS:
+        is_load = is_store = False
+
+    port_uops = []
+    uops = 0
+    if not (entry.get('move') and (is_load or is_store)):
+        for uop in entry['uops']:
+            if isinstance(uop[0], int):
+                port_uops.append((uop[0], uop[1:]))
+            else:
+                port_uops.append((1, uop))
+            uops += 1
+    size = _access_size(mnemonic, operands)
+    if is_load:
+        data_cycles = max(1, int(math.ceil(size/table['load']['bytes per cycle'])))
+        port_uops += [(1, table['load']['ports']), (data_cycles, table['load']['data ports'])]
+        uops += 1
+    if is_store:
+        data_cycles = max(1, int(math.ceil(size/table['store']['bytes per cycle'])))
+        port_uops += [(1, table['store']['address ports']),
+                      (data_cycles, table['store']['data ports'])]
+        uops += 2
+
+    return uops, port_uops, entry['latency'], key
+
+
+def distribute(port_cycles, cycles, ports):
+    '''
+    distributes *cycles* over *ports*, such that the highest pressure among them is minimal
+
+    *port_cycles* is updated in-place and the added cycles per port are returned.
+    '''
+    levels = sorted(port_cycles[p] for p in ports)
+    for k in range(1, len(levels)+1):
+        level = (sum(levels[:k]) + cycles)/k
+        if k == len(levels) or level <= levels[k]:
+            break
+    added = {}
+    for p in ports:
+        if port_cycles[p] < level:
+            added[p] = level - port_cycles[p]
+            port_cycles[p] = level
+    return added
+
+
+@profiling.profiled('port pressure analysis')
+def port_pressure_analysis(asm_lines, table):
+    '''
+    static throughput analysis of the assembly block *asm_lines* based on instruction *table*
+
+    Returns dictionary with "throughput", "port cycles", "uops", a per-instruction breakdown in
+    "instructions" and the lines not found in *table* in "unknown instructions".
+    '''
+    instructions = []
+    for line in asm_lines:
+        parsed = parse_instruction(line)
+        if parsed is None:
+            continue
+        mnemonic, operands = parsed
+        uops, port_uops, latency, key = instruction_uops(mnemonic, operands, table)
+        instructions.append({'line': line.split('#')[0].strip(),
+                             'mnemonic': mnemonic,
+                             'operands': operands,
+                             'key': key,
+                             'uops': uops,
+                             'port uops': port_uops,
+                             'latency': latency,
+                             'port cycles': {}})
+
+    # Macro fusion of compare-and-branch pairs (only the branch uop remains)
+    for prev, instr in zip(instructions, instructions[1:]):
+        if (instr['key'] == 'jcc' and prev['key'] in table.get('macro fusion', []) and
+                not any('(' in o for o in prev['operands'])):
+            prev['uops'] = 0
+            prev['port uops'] = []
+
+    port_cycles = {p: 0.0 for p in table['ports']}
+    for instr in instructions:
+        for cycles, ports in instr['port uops']:
+            for p, c in distribute(port_cycles, cycles, ports).items():
+                instr['port cycles'][p] = instr['port cycles'].get(p, 0.0) + c
+
+    return {'throughput': max(port_cycles.values()),
+            'port cycles': port_cycles,
+            'uops': sum([i['uops'] for i in instructions]),
+            'instructions': instructions,
+            'unknown instructions': [i['line'] for i in instructions if i['key'] is None]}
+
+
+def format_analysis(analysis, ports):
+    '''returns human readable table of a port_pressure_analysis() result'''
+    lines = ['Block Throughput: {:.2f} Cycles'.format(analysis['throughput']),
+             '',
+             '| Num Of |' + '|'.join(['{:^6}'.format(p) for p in ports]) + '|',
+             '|  Uops  |' + '|'.join(['------']*len(ports)) + '|']
+    for instr in analysis['instructions']:
+        lines.append('| {:^6} |'.format(instr['uops'] if instr['key'] else 'X') + '|'.join(
+            ['{:^6.2f}'.format(instr['port cycles'][p]) if p in instr['port cycles'] else ' '*6
+             for p in ports]) + '| ' + instr['line'])
+    lines.append('| {:^6} |'.format(analysis['uops']) + '|'.join(
+        ['{:^6.2f}'.format(analysis['port cycles'].get(p, 0.0)) for p in ports]) + '| Total')
+    if analysis['unknown instructions']:
+        lines += ['', 'X - instruction not found in instruction table, ignored']
+    return '\n'.join(lines)
+
+
+def _register(operand):
+    '''returns the full register name of a register *operand*, None for other operands'''
+    if operand.startswith('%'):
+        return REGISTER_ALIASES.get(operand[1:], operand[1:])
+
+
+def instruction_dependencies(mnemonic, operands):
+    '''
+    returns (sources, address sources, destinations) registers of an instruction
+
+    *address sources* are registers used to address memory operands, flags are ignored.
+    '''
+    sources = []
+    address_sources = []
+    for o in operands:
+        if '(' in o:
+            address_sources += [REGISTER_ALIASES.get(r, r) for r in re.findall(r'%(\w+)', o)]
+        elif _register(o):
+            sources.append(_register(o))
+    if not operands or mnemonic.startswith(NO_DESTINATION):
+        return sources, address_sources, []
+
+    destination = _register(operands[-1])
+    if destination is None:
+        return sources, address_sources, []
+    if (len(operands) > 2 or (len(operands) == 2 and re.match(r'^v?mov', mnemonic))) and \
+            not mnemonic.startswith(READS_DESTINATION):
+        # write-only destination (three operand form or move)
+        sources = sources[:-1]
+    # without operand size suffix (only if there is one, e.g., subq but not sub)
+    names = [mnemonic]
+    if re.match(r'^[a-z]+[bwlq]$', mnemonic):
+        names.append(mnemonic[:-1])
+    if any(n in ZERO_IDIOMS for n in names) and set(map(_register, operands)) == {destination}:
+        # dependency breaking zero idiom (e.g., xor %eax, %eax)
+        sources = []
+    return sources, address_sources, [destination]
+
+
+@profiling.profiled('latency analysis')
+def latency_analysis(asm_lines, table, iterations=60):
+    '''
+    loop-carried dependency analysis of the assembly block *asm_lines* based on instruction *table*
+
+    The block is executed repeatedly with infinite resources (i.e., only latencies of register
+    dependencies are considered) and the growth of the completion time per iteration in steady
+    state is the loop-carried latency. Loads add their latency only to the path through the
+    address registers.
+
+    Returns dictionary with "latency" (cycles per block iteration) and the lines of the
+    instructions on the critical "dependency chain".
+    '''
+    instructions = []
+    for line in asm_lines:
+        parsed = parse_instruction(line)
+        if parsed is None:
+            continue
+        mnemonic, operands = parsed
+        key, entry = lookup_instruction(mnemonic, operands, table)
+        latency = entry['latency'] if entry else 0
+        load_latency = 0
+        if entry and any('(' in o for o in operands[:-1]) and \
+                key.split()[0] not in NO_MEMORY_ACCESS:
+            load_latency = table['load']['latency']
+            if entry.get('move'):
+                latency = 0
+        sources, address_sources, destinations = instruction_dependencies(mnemonic, operands)
+        sources = [(r, 0) for r in sources] + [(r, load_latency) for r in address_sources]
+        instructions.append((line.split('#')[0].strip(), sources, destinations, latency,
+                             load_latency))
+
+    # ready time and producing (iteration, instruction index) per register
+    ready = {}
+    predecessor = {}
+    completion = []
+    for it in range(2*iterations):
+        for idx, (line, sources, destinations, latency, load_latency) in enumerate(
+                instructions):
+            # the instruction completes *latency* cycles after the slowest source
+            finish, producer = latency + load_latency, None
+            for r, source_latency in sources:
+                if r in ready and ready[r][0] + latency + source_latency > finish:
+                    finish = ready[r][0] + latency + source_latency
+                    producer = ready[r][1]
+            predecessor[(it, idx)] = producer
+            for r in destinations:
+                ready[r] = (finish, (it, idx))
+        completion.append(max([t for t, p in ready.values()] or [0]))
+    latency = (completion[-1] - completion[iterations-1])/iterations
+
+    # Follow the latest finishing instruction back through steady state iterations, until an
+    # instruction repeats. In between lies the loop-carried dependency chain.
+    path = []
+    if latency > 0:
+        node = max(ready.values())[1]
+        while node is not None and node[0] >= iterations and node[1] not in path:
+            path.append(node[1])
+            node = predecessor[node]
+        if node is not None and node[1] in path:
+            path = path[path.index(node[1]):]
+
+    return {'latency': latency,
+            'dependency chain': [instructions[i][0] for i in sorted(path)]}
+
+
+@profiling.profiled('IACA')
+def iaca_analysis(bin_name, micro_architecture, verbose=0, timeout=None):
+    '''
+    runs iaca.sh on marked binary *bin_name* and returns parsed results
+
+    *timeout* (optional) limits the run time of iaca.sh in seconds.
+
+    Returns dictionary with "throughput", "port cycles", "uops" and the raw "output".
+    '''
+    # Making sure iaca.sh is available:
+    if find_executable('iaca.sh') is None:
+        print("iaca.sh was not found. Make sure it is found in PATH.", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        cmd = ['iaca.sh', '-64', '-arch', micro_architecture, bin_name]
+        if verbose >= 3:
+            print('Executing:', ' '.join(cmd))
+        iaca_output = check_output(cmd, timeout=timeout).decode('utf-8')
+    except OSError as e:
+        print("IACA execution failed:", ' '.join(cmd), file=sys.stderr)
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print("IACA throughput analysis failed:", e, file=sys.stderr)
+        sys.exit(1)
+
+    # Get total cycles per loop iteration
+    match = re.search(
+        r'^Block Throughput: ([0-9\.]+) Cycles', iaca_output, re.MULTILINE)
+    assert match, "Could not find Block Throughput in IACA output."
+    block_throughput = float(match.groups()[0])
+
+    # Find ports and cyles per port
+    ports = [l for l in iaca_output.split('\n') if l.startswith('|  Port  |')]
+    cycles = [l for l in iaca_output.split('\n') if l.startswith('| Cycles |')]
+    assert ports and cycles, "Could not find ports/cylces lines in IACA output."
+    ports = [p.strip() for p in ports[0].split('|')][2:]
+    cycles = [c.strip() for c in cycles[0].split('|')][2:]
+    port_cycles = []
+    for i in range(len(ports)):
+        if '-' in ports[i] and ' ' in cycles[i]:
+            subports = [p.strip() for p in ports[i].split('-')]
+            subcycles = [c for c in cycles[i].split(' ') if bool(c)]
+            port_cycles.append((subports[0], float(subcycles[0])))
+            port_cycles.append((subports[0]+subports[1], float(subcycles[1])))
+        elif ports[i] and cycles[i]:
+            port_cycles.append((ports[i], float(cycles[i])))
+    port_cycles = dict(port_cycles)
+
+    match = re.search(r'^Total Num Of Uops: ([0-9]+)', iaca_output, re.MULTILINE)
+    assert match, "Could not find Uops in IACA output."
+    uops = float(match.groups()[0])
+
+    return {'throughput': block_throughput,
+            'port cycles': port_cycles,
+            'uops': uops,
+            'output': iaca_output}
+
+
+def analysis_options(args):
+    '''returns keyword arguments of analyze_kernel() from parsed command line *args*'''
+    return {'incore_model': args.incore_model, 'asm_block': args.asm_block,
+            'asm_increment': args.asm_increment, 'verbose': args.verbose,
+            'timeout': args.tool_timeout}
+
+
+def machine_key(machine):
+    '''
+    returns the parts of *machine* in-core analyses depend on: compiler, compiler flags,
+    micro-architecture and instruction table
+
+    What-if variants which only change cycle model parameters (e.g., clock or bandwidths) have
+    the same key.
+    '''
+    try:
+        table = repr(machine['instruction table'])
+    except KeyError:
+        # built-in table of micro-architecture
+        table = None
+    return (machine['compiler'], tuple(machine['compiler flags']),
+            machine['micro-architecture'], table)
+
+
+# Analyses per generated code, machine key and block selection. The generated code does not
+# depend on values of constants, so analyses can be reused across sweeps (and requests in server
+# mode).
+_analysis_cache = {}
+_analysis_cache_lock = threading.Lock()
+# Locks of analyses in progress, concurrent analyses of the same code wait for the first one
+_analysis_locks = {}
+
+
+def analyze_kernel(kernel, machine, incore_model='IACA', asm_block='auto', asm_increment=0,
+                   verbose=0, timeout=None):
+    '''
+    compiles *kernel* and analyzes the marked assembly block with the selected *incore_model*
+
+    *incore_model* is either "IACA" (runs iaca.sh) or "builtin" (see port_pressure_analysis()).
+    Returns the analyzer's result dictionary, "output" contains the textual report. If an
+    instruction table is available, the results of latency_analysis() are included (otherwise
+    "latency" is None). *timeout* (optional) limits the run time of each external tool
+    (compiler, assembler and iaca.sh) in seconds.
+
+    Results are cached, repeated calls with identical generated code and machine (see
+    machine_key()) will neither compile nor analyze again. Concurrent calls (e.g., from
+    analyze_kernel_async()) wait for the analysis in progress.
+    '''
+    key = (kernel.as_code(), machine_key(machine), incore_model, asm_block, asm_increment)
+    with _analysis_cache_lock:
+        cached = _analysis_cache.get(key)
+        if cached is None:
+            key_lock = _analysis_locks.setdefault(key, threading.Lock())
+    if cached is None:
+        with key_lock:
+            with _analysis_cache_lock:
+                cached = _analysis_cache.get(key)
+            if cached is None:
+                try:
+                    analysis = _analyze_kernel(kernel, machine, incore_model, asm_block,
+                                               asm_increment, verbose, timeout)
+                    with _analysis_cache_lock:
+                        _analysis_cache[key] = (copy.deepcopy(analysis),
+                                                copy.deepcopy(kernel.asm_block))
+                finally:
+                    # also if tools failed, waiting calls will try again
+                    with _analysis_cache_lock:
+                        _analysis_locks.pop(key, None)
+                return analysis
+    kernel.asm_block = copy.deepcopy(cached[1])
+    return copy.deepcopy(cached[0])
+
+
+def _analyze_kernel(kernel, machine, incore_model, asm_block, asm_increment, verbose, timeout):
+    asm_name = kernel.compile(machine['compiler'], compiler_args=machine['compiler flags'],
+                              timeout=timeout)
+    if incore_model == 'builtin':
+        kernel.select_asm_block(asm_name, asm_block=asm_block, asm_increment=asm_increment)
+        table = load_instruction_table(machine)
+        analysis = port_pressure_analysis(kernel.asm_block['lines'], table)
+        analysis['output'] = format_analysis(analysis, table['ports'])
+    else:
+        bin_name = kernel.assemble(
+            machine['compiler'], asm_name, iaca_markers=True, asm_block=asm_block,
+            asm_increment=asm_increment, timeout=timeout)
+        analysis = iaca_analysis(bin_name, machine['micro-architecture'], verbose=verbose,
+                                 timeout=timeout)
+        try:
+            table = load_instruction_table(machine)
+        except ValueError:
+            table = None
+
+    if table is not None:
+        analysis.update(latency_analysis(kernel.asm_block['lines'], table))
+    else:
+        analysis.update({'latency': None, 'dependency chain': []})
+    return analysis
+
+
+class AsyncAnalysis(object):
+    '''
+    analyze_kernel() running in a background thread, see analyze_kernel_async()
+
+    The thread mostly waits for external tools, so other work (e.g., cache predictions) can be
+    done in the meantime.
+    '''
+    def __init__(self, kernel, machine, **kwargs):
+        self._result = None
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run, args=(kernel, machine), kwargs=kwargs)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, kernel, machine, **kwargs):
+        try:
+            self._result = analyze_kernel(kernel, machine, **kwargs)
+        except BaseException:
+            # including exits on failed external tools
+            self._exc_info = sys.exc_info()
+
+    def ready(self):
+        '''returns True if the analysis has finished'''
+        return not self._thread.is_alive()
+
+    def get(self):
+        '''waits for the analysis and returns its result (or raises its exception)'''
+        self._thread.join()
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+        return self._result
+
+
+def analyze_kernel_async(kernel, machine, **kwargs):
+    '''
+    starts analyze_kernel() in the background and returns an AsyncAnalysis
+
+    Keyword arguments are those of analyze_kernel(). *kernel* must not be changed (e.g., by
+    set_constant() or clear_state()) until AsyncAnalysis.get() returned.
+    '''
+    return AsyncAnalysis(kernel, machine, **kwargs)
@@ -2,50 +2,127 @@
 '''
 A simple interval implementation
 '''
+from bisect import bisect_left, bisect_right
+
+import numpy
 
 
 class Intervals(object):
-    '''Very simple interval implementation for integers (might also work on floats)'''
+    '''
+    Set of half-open integer ranges [lower, upper) (might also work on floats)
+
+    Ranges are kept disjoint and sorted, in two arrays of lower and upper bounds, so that
+    lookups and insertions use bisection. Touching ranges are merged.
+    '''
 
     def __init__(self, *args, **kwargs):
         '''If keywords *sane* is True (default: False), checks will not be done on given data.'''
-        self.data = list(args)
-        if not kwargs.get('sane', False):
-            self.data = [d for d in self.data if d[1] > d[0]]
-            self._enforce_order()
-            self._enforce_no_overlap()
-
-    def _enforce_order(self):
-        '''Enforces the order of all entries in internal storage'''
-        self.data.sort(key=lambda d: d[0])
-
-    def _enforce_no_overlap(self, start_at=0):
-        '''Enforces that no ranges overlap in internal storage'''
-        i = start_at
-        while i+1 < len(self.data):
-            if self.data[i][1] >= self.data[i+1][0]:
-                # beginning of i+1-th range is contained in i-th range
-                if self.data[i][1] < self.data[i+1][1]:
-                    # i+1-th range is longer, thus enlarge i-th range
-                    self.data[i][1] = self.data[i+1][1]
-
-                # removed contained range
-                del self.data[i+1]
-            i += 1
+        if kwargs.get('sane', False):
+            self._lowers = [d[0] for d in args]
+            self._uppers = [d[1] for d in args]
+        else:
+            self._lowers = []
+            self._uppers = []
+            for lower, upper in args:
+                self.add(lower, upper)
+
+    @property
+    def data(self):
+        '''List of [lower, upper] ranges'''
+        return [[l, u] for l, u in zip(self._lowers, self._uppers)]
+
+    def arrays(self):
+        '''Returns numpy arrays of lower and upper bounds'''
+        return numpy.array(self._lowers, dtype=numpy.int64), \
+            numpy.array(self._uppers, dtype=numpy.int64)
+
+    def add(self, lower, upper):
+        '''Adds range [*lower*, *upper*), merging it with overlapping and touching ranges'''
+        if upper <= lower:
+            return
+        # first range which ends at or after lower and first range which starts after upper
+        first = bisect_left(self._uppers, lower)
+        last = bisect_right(self._lowers, upper)
+        if first < last:
+            lower = min(lower, self._lowers[first])
+            upper = max(upper, self._uppers[last-1])
+        self._lowers[first:last] = [lower]
+        self._uppers[first:last] = [upper]
+
+    def union(self, other):
+        '''Returns union of both intervals'''
+        if len(other._lowers) > len(self._lowers):
+            self, other = other, self
+        if len(other._lowers) <= 64 and len(other._lowers)*8 < len(self._lowers):
+            # few ranges are inserted by bisection
+            result = self.copy()
+            for lower, upper in zip(other._lowers, other._uppers):
+                result.add(lower, upper)
+            return result
+
+        # otherwise all ranges are sorted and merged at once
+        return Intervals.from_arrays(numpy.concatenate([self._lowers, other._lowers]),
+                                     numpy.concatenate([self._uppers, other._uppers]))
+
+    @classmethod
+    def from_arrays(cls, lowers, uppers, sane=False):
+        '''Returns Intervals of ranges given by arrays of *lowers* and *uppers*, in any order and
+        possibly overlapping (unless *sane* is True)'''
+        result = cls()
+        lowers = numpy.asarray(lowers)
+        uppers = numpy.asarray(uppers)
+        if sane:
+            result._lowers = lowers.tolist()
+            result._uppers = uppers.tolist()
+            return result
+        nonempty = uppers > lowers
+        lowers, uppers = lowers[nonempty], uppers[nonempty]
+        if not len(lowers):
+            return result
+        order = numpy.argsort(lowers, kind='mergesort')
+        lowers, uppers = lowers[order], numpy.maximum.accumulate(uppers[order])
+        # a range starts, where its lower bound is beyond all previous upper bounds
+        starts = numpy.flatnonzero(numpy.concatenate([[True], lowers[1:] > uppers[:-1]]))
+        ends = numpy.concatenate([starts[1:], [len(lowers)]]) - 1
+        result._lowers = lowers[starts].tolist()
+        result._uppers = uppers[ends].tolist()
+        return result
 
     def __and__(self, other):
         '''Combines two intervals, under the assumption that they are sane'''
-        return Intervals(*(self.data+other.data))
+        return self.union(other)
+
+    __or__ = __and__
+
+    def shift(self, offset):
+        '''Returns intervals moved by *offset*'''
+        result = Intervals()
+        result._lowers = [l+offset for l in self._lowers]
+        result._uppers = [u+offset for u in self._uppers]
+        return result
+
+    def copy(self):
+        result = Intervals()
+        result._lowers = list(self._lowers)
+        result._uppers = list(self._uppers)
+        return result
 
     def __len__(self):
         '''Returns sum of range lengths'''
-        return int(sum(upper-lower for (lower, upper) in self.data))
+        return int(sum(upper-lower for (lower, upper) in zip(self._lowers, self._uppers)))
 
     def __contains__(self, needle):
-        return any(lower <= needle < upper for (lower, upper) in self.data)
+        i = bisect_right(self._lowers, needle) - 1
+        return i >= 0 and needle < self._uppers[i]
+
+    def __iter__(self):
+        return iter(zip(self._lowers, self._uppers))
 
     def __repr__(self):
         return str(self.__class__) + '(' + ', '.join([list.__repr__(d) for d in self.data]) + ')'
 
     def __eq__(self, other):
-        return self.data == other.data
+        return self._lowers == other._lowers and self._uppers == other._uppers
+
+    def __ne__(self, other):
+        return not self == other
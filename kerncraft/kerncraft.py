@@ -14,6 +14,8 @@ if sys.version_info[0] == 2 and sys.version_info < (2, 7) or \
 
 import argparse
 import os.path
+import glob
+import io
 import pickle
 import shutil
 import math
@@ -29,6 +31,9 @@ from six.moves import range
 from ruamel import yaml
 
 from . import models
+from . import output
+from . import profiling
+from . import api
 from .kernel import KernelCode, KernelDescription
 from .machinemodel import MachineModel
 
@@ -105,10 +110,22 @@ class AppendStringRange(argparse.Action):
             setattr(namespace, self.dest, [values])
 
 
+def machine_path(path):
+    '''argparse type of machine files or directories, which need to exist'''
+    if not os.path.exists(path):
+        raise argparse.ArgumentTypeError("can't open '{}': no such file or directory".format(path))
+    return path
+
+
 def create_parser():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--machine', '-m', type=argparse.FileType('r'), required=True,
-                        help='Path to machine description yaml file.')
+    parser.add_argument('--machine', '-m', type=machine_path, required=True, action='append',
+                        dest='machines', metavar='MACHINE',
+                        help='Path to machine description yaml file or to a directory of them '
+                             '(all *.yml and *.yaml files). May be given multiple times, results '
+                             'of multiple machines are compared at the end.')
+    parser.add_argument('--jobs', '-j', metavar='JOBS', type=int, default=1,
+                        help='Number of machines to analyze in parallel. (default: 1)')
     parser.add_argument('--pmodel', '-p', choices=models.__all__, required=True, action='append',
                         default=[], help='Performance model to apply')
     parser.add_argument('-D', '--define', nargs=2, metavar=('KEY', 'VALUE'), default=[],
@@ -117,6 +134,11 @@ def create_parser():
                              'match start-stop[:num[log[base]]]. If range is given, all '
                              'permutation s will be tested. Overwrites constants from testcase '
                              'file.')
+    parser.add_argument('--tile', '-t', nargs=2, metavar=('INDEX', 'SIZE'), default=[],
+                        action='append',
+                        help='Tile loop with counter INDEX into blocks of SIZE iterations in '
+                             'generated code (used by ECM, ECMCPU and Benchmark models). May be '
+                             'given multiple times.')
     parser.add_argument('--verbose', '-v', action='count', default=0,
                         help='Increases verbosity level.')
     parser.add_argument('code_file', metavar='FILE', type=argparse.FileType(),
@@ -128,19 +150,49 @@ def create_parser():
                         help='Increment of stor pointer within one ASM block in bytes. If 0, '
                              'automatic detetection will be used and can lead to user input being '
                              'required.')
+    parser.add_argument('--incore-model', choices=['IACA', 'builtin'], default='IACA',
+                        help='In-core analyzer used by ECM, ECMCPU and RooflineIACA models: IACA '
+                             '(runs iaca.sh) or builtin (static port-pressure analysis based on '
+                             'instruction tables), default is IACA.')
+    parser.add_argument('--tool-timeout', metavar='SECONDS', type=float,
+                        help='Abort if an external tool of the in-core analysis (compiler, '
+                             'assembler or iaca.sh) runs longer than SECONDS. The in-core analysis '
+                             'runs in the background, while cache misses are predicted.')
     parser.add_argument('--store', metavar='PICKLE', type=argparse.FileType('a+b'),
                         help='Addes results to PICKLE file for later processing.')
+    parser.add_argument('--output-format', choices=['text', 'jsonl', 'csv'], default='text',
+                        help='Output format: text (human readable reports, default), jsonl (one '
+                             'JSON object per kernel, constants and model) or csv (one row per '
+                             'result value). Records are written as soon as they are computed, '
+                             'units are normalized (e.g., 1.2 GB/s becomes 1.2e9).')
+    parser.add_argument('--output', '-o', metavar='FILE', type=argparse.FileType('w'),
+                        help='Write output to FILE instead of stdout.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Measure wall time, CPU time and peak memory of analysis phases '
+                             '(e.g., parse, compile, IACA), print a summary and add times per '
+                             'phase to results (as "profile").')
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help='Write profile to FILE: Chrome trace if FILE ends with .json, '
+                             'cProfile statistics otherwise (implies --profile).')
     parser.add_argument('--unit', '-u', choices=['cy/CL', 'cy/It', 'It/s', 'FLOP/s'],
                         help='Select the output unit, defaults to model specific if not given.')
     parser.add_argument('--cores', '-c', metavar='CORES', type=int, default=1,
                         help='Number of cores to be used in parallel. (default: 1)')
     parser.add_argument('--kernel-description', action='store_true',
                         help='Use kernel description instead of analyzing the kernel code.')
+    parser.add_argument('--what-if', metavar='KEY=VALUE[,VALUE...]', action='append', default=[],
+                        help='Change machine parameter KEY (e.g., clock, L2.size, MEM.bandwidth or '
+                             'L2.cycles per cacheline transfer) to VALUE, values starting with * '
+                             'scale (e.g., MEM.bandwidth=*1.3). All combinations of given values '
+                             'are analyzed. Cache predictions are reused if only cycle model '
+                             'parameters (clock, bandwidths and cycles) change. May be given '
+                             'multiple times.')
 
     # Needed for ECM, ECMData and Roofline model:
-    parser.add_argument('--cache-predictor', '-P', choices=['LC', 'SIM'], default='SIM',
-                        help='Change cache predictor to use, options are LC (layer conditions) and '
-                             'SIM (cache simulation with pycachesim), default is SIM.')
+    parser.add_argument('--cache-predictor', '-P', choices=['LC', 'SIM', 'AN'], default='SIM',
+                        help='Change cache predictor to use, options are LC (layer conditions), '
+                             'SIM (cache simulation with pycachesim) and AN (analytic LRU miss '
+                             'counting), default is SIM.')
 
     for m in models.__all__:
         ag = parser.add_argument_group('arguments for '+m+' model', getattr(models, m).name)
@@ -155,9 +207,99 @@ def check_arguments(args, parser):
             args.asm_block = int(args.asm_block)
         except ValueError:
             parser.error('--asm-block can only be "auto", "manual" or an integer')
+    if args.tile and args.kernel_description:
+        parser.error('--tile can not be used with --kernel-description')
+    try:
+        args.tile = [(index, int(size)) for index, size in args.tile]
+    except ValueError:
+        parser.error('--tile SIZE must be an integer')
+    what_if = []
+    for option in args.what_if:
+        if not isinstance(option, six.string_types):
+            # already parsed
+            what_if.append(option)
+            continue
+        key, sep, values = option.partition('=')
+        if not sep or not key.strip() or not values.strip():
+            parser.error('--what-if needs to be given as KEY=VALUE[,VALUE...]')
+        what_if.append((key.strip(), [v.strip() for v in values.split(',')]))
+    args.what_if = what_if
+    if args.machines is not None:
+        args.machines = machine_files(args.machines)
+        if not args.machines:
+            parser.error('no machine files (*.yml or *.yaml) found')
+    if args.jobs < 1:
+        parser.error('--jobs needs to be at least 1')
+    if args.tool_timeout is not None and args.tool_timeout <= 0:
+        parser.error('--tool-timeout needs to be positive')
+
+
+def machine_files(paths):
+    '''returns list of machine files, with directories replaced by their yaml files'''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = sorted(glob.glob(os.path.join(path, '*.yml')) +
+                           glob.glob(os.path.join(path, '*.yaml')))
+        else:
+            found = [path]
+        files += [f for f in found if f not in files]
+    return files
+
+
+def what_if_variants(machine, args, parser):
+    '''returns list of (overrides, machine) for all combinations of --what-if values'''
+    if not args.what_if:
+        return [((), machine)]
+    variants = []
+    for overrides in itertools.product(*[[(key, v) for v in values]
+                                         for key, values in args.what_if]):
+        try:
+            variants.append((overrides, machine.what_if(overrides)))
+        except ValueError as e:
+            parser.error('--what-if: {}'.format(e))
+    return variants
+
+
+def print_header(kernel, args, define, model_name, output_file=sys.stdout, overrides=(),
+                 machine_file=None):
+    print('{:=^80}'.format(' kerncraft '), file=output_file)
+    print('{:<40}{:>40}'.format(args.code_file.name, '-m '+(machine_file or args.machines[0])),
+          file=output_file)
+    print(' '.join(['-D {} {}'.format(k,v) for k,v in define] +
+                   ['-t {} {}'.format(i, b) for i, b in args.tile] +
+                   ["--what-if '{}={}'".format(k, v) for k, v in overrides]), file=output_file)
+    print('{:-^80}'.format(' '+model_name+' '), file=output_file)
+
+    if args.verbose > 1:
+        if not args.kernel_description:
+            kernel.print_kernel_code(output_file=output_file)
+            print('', file=output_file)
+        kernel.print_variables_info(output_file=output_file)
+        kernel.print_kernel_info(output_file=output_file)
+    if args.verbose > 0:
+        kernel.print_constants_info(output_file=output_file)
 
 
 def run(parser, args, output_file=sys.stdout):
+    if args.output:
+        output_file = args.output
+    if not args.profile and not args.profile_output:
+        run_sweep(parser, args, output_file)
+        return
+
+    with profiling.profile(args.profile_output) as profiler:
+        run_sweep(parser, args, output_file)
+    # keep machine readable output parsable
+    print(profiler.summary(), file=output_file if args.output_format == 'text' else sys.stderr)
+
+
+def run_sweep(parser, args, output_file=sys.stdout):
+    # Machine readable output (if requested)
+    writer = None
+    if args.output_format != 'text':
+        writer = output.WRITERS[args.output_format](output_file)
+
     # Try loading results file (if requested)
     result_storage = {}
     if args.store:
@@ -168,19 +310,57 @@ def run(parser, args, output_file=sys.stdout):
             pass
         args.store.close()
 
-    # machine information
-    # Read machine description
-    machine = MachineModel(args.machine.name)
+    # process kernel, once for all machines
+    with profiling.phase('parse'):
+        if not args.kernel_description:
+            code = six.text_type(args.code_file.read())
+            code = clean_code(code)
+            kernel = KernelCode(code, filename=args.code_file.name)
+        else:
+            description = six.text_type(args.code_file.read())
+            kernel = KernelDescription(yaml.load(description))
 
-    # process kernel
-    if not args.kernel_description:
-        code = six.text_type(args.code_file.read())
-        code = clean_code(code)
-        kernel = KernelCode(code, filename=args.code_file.name)
-    else:
-        description = six.text_type(args.code_file.read())
-        kernel = KernelDescription(yaml.load(description))
+    define_product = get_define_product(kernel, args)
+
+    def store():
+        # Save storage to file (if requested)
+        if args.store:
+            tempname = args.store.name + '.tmp'
+            with open(tempname, 'wb+') as f:
+                pickle.dump(result_storage, f)
+            shutil.move(tempname, args.store.name)
 
+    summaries = []
+    jobs = min(args.jobs, len(args.machines))
+    if jobs == 1 or profiling.get_profiler():
+        # sequential, with output as soon as results are available
+        for machine_file in args.machines:
+            summaries += analyze_machine(kernel, machine_file, define_product, args, parser,
+                                         output_file, writer, result_storage, store)
+    else:
+        # in parallel, output is passed on in order of machines
+        pool = api.create_pool(jobs, _setup_worker, kernel, define_product, args, parser)
+        try:
+            for text, records, storage, machine_summaries in pool.imap(
+                    _worker_analyze_machine, args.machines):
+                output_file.write(text)
+                for record in records:
+                    writer.write(record)
+                for kernel_name, points in storage.items():
+                    for constants, point_results in points.items():
+                        result_storage.setdefault(kernel_name, {}).setdefault(
+                            constants, {}).update(point_results)
+                store()
+                summaries += machine_summaries
+        finally:
+            pool.terminate()
+
+    if len(args.machines) > 1 and writer is None:
+        output.print_comparison(summaries, output_file)
+
+
+def get_define_product(kernel, args):
+    '''returns list of all combinations of defines (guessed, if none were given)'''
     # if no defines were given, guess suitable defines in-mem
     # TODO support in-cache
     # TODO broaden cases to n-dimensions
@@ -225,6 +405,21 @@ def run(parser, args, output_file=sys.stdout):
                     define_dict[name].append([name, v])
         define_product = list(itertools.product(*list(define_dict.values())))
 
+    return define_product
+
+
+def analyze_machine(kernel, machine_file, define_product, args, parser, output_file, writer,
+                    result_storage, store=None):
+    '''
+    analyzes *kernel* on machine described in *machine_file* for all defines and models,
+    returns list of summaries for the comparison of machines
+
+    Reports are printed to *output_file* (or given to *writer*), results are added to
+    *result_storage* and *store* is called after each define.
+    '''
+    variants = what_if_variants(MachineModel(machine_file), args, parser)
+    summaries = []
+
     for define in define_product:
         # Reset state of kernel
         kernel.clear_state()
@@ -233,48 +428,96 @@ def run(parser, args, output_file=sys.stdout):
         for k, v in define:
             kernel.set_constant(k, v)
 
-        for model_name in set(args.pmodel):
-            # print header
-            print('{:=^80}'.format(' kerncraft '), file=output_file)
-            print('{:<40}{:>40}'.format(args.code_file.name, '-m '+args.machine.name),
-                  file=output_file)
-            print(' '.join(['-D {} {}'.format(k,v) for k,v in define]), file=output_file)
-            print('{:-^80}'.format(' '+model_name+' '), file=output_file)
-
-            if args.verbose > 1:
-                if not args.kernel_description:
-                    kernel.print_kernel_code(output_file=output_file)
-                    print('', file=output_file)
-                kernel.print_variables_info(output_file=output_file)
-                kernel.print_kernel_info(output_file=output_file)
-            if args.verbose > 0:
-                kernel.print_constants_info(output_file=output_file)
-
-            model = getattr(models, model_name)(kernel, machine, args, parser)
-
-            model.analyze()
-            model.report(output_file=output_file)
-
-            # Add results to storage
-            kernel_name = os.path.split(args.code_file.name)[1]
-            if kernel_name not in result_storage:
-                result_storage[kernel_name] = {}
-            if tuple(kernel.constants.items()) not in result_storage[kernel_name]:
-                result_storage[kernel_name][tuple(kernel.constants.items())] = {}
-            result_storage[kernel_name][tuple(kernel.constants.items())][model_name] = \
-                model.results
-
-            print('', file=output_file)
-
-        # Save storage to file (if requested)
-        if args.store:
-            tempname = args.store.name + '.tmp'
-            with open(tempname, 'wb+') as f:
-                pickle.dump(result_storage, f)
-            shutil.move(tempname, args.store.name)
+        # Select loops to tile in generated code
+        for index, block_size in args.tile:
+            kernel.set_tiling(index, block_size)
+
+        for overrides, machine in variants:
+            what_if = ' '.join(['{}={}'.format(k, v) for k, v in overrides])
+            for model_name in set(args.pmodel):
+                if writer is None:
+                    print_header(kernel, args, define, model_name, output_file, overrides,
+                                 machine_file)
+
+                point = '{} {}'.format(model_name,
+                                       ' '.join(['{}={}'.format(k, v) for k, v in define]))
+                if overrides:
+                    point += ' [{}]'.format(what_if)
+                profiling.set_point(point)
+                with profiling.phase('analysis'):
+                    model = getattr(models, model_name)(kernel, machine, args, parser)
+                    model.analyze()
+                if profiling.get_profiler():
+                    model.results['profile'] = dict(profiling.get_profiler().point_times(point))
+
+                kernel_name = os.path.split(args.code_file.name)[1]
+                with profiling.phase('report'):
+                    if writer is None:
+                        model.report(output_file=output_file)
+                        print('', file=output_file)
+                    else:
+                        record = {'kernel': kernel_name, 'machine': machine_file,
+                                  'model': model_name, 'constants': dict(define),
+                                  'results': model.results}
+                        if overrides:
+                            record['what-if'] = dict(overrides)
+                        writer.write(record)
+
+                # Add results to storage
+                if kernel_name not in result_storage:
+                    result_storage[kernel_name] = {}
+                if tuple(kernel.constants.items()) not in result_storage[kernel_name]:
+                    result_storage[kernel_name][tuple(kernel.constants.items())] = {}
+                storage_name = '{} [{}]'.format(model_name, what_if) if overrides else model_name
+                if len(args.machines) > 1:
+                    storage_name += ' ({})'.format(os.path.basename(machine_file))
+                result_storage[kernel_name][tuple(kernel.constants.items())][storage_name] = \
+                    model.results
+                if len(args.machines) > 1:
+                    summaries.append(output.summarize(
+                        model_name, model, machine=os.path.basename(machine_file),
+                        point=' '.join(['{}={}'.format(k, v) for k, v in define] +
+                                       ['{}={}'.format(k, v) for k, v in overrides])))
+
+        if store is not None:
+            store()
+
+    return summaries
+
+
+def _setup_worker(kernel, define_product, args, parser):
+    '''returns state of pool worker processes (see run_sweep())'''
+    # intermediate files are named after the kernel file, which would collide among workers
+    kernel._filename = None
+    return {'kernel': kernel, 'define_product': define_product, 'args': args, 'parser': parser}
+
+
+def _worker_analyze_machine(machine_file):
+    '''analyzes one machine, returns reports, records, results and summaries'''
+    worker = api.worker_state(_setup_worker)
+    args = worker['args']
+    output_file = io.StringIO()
+    writer = None
+    if args.output_format != 'text':
+        writer = output.RecordCollector()
+    storage = {}
+    summaries = analyze_machine(worker['kernel'], machine_file, worker['define_product'],
+                                args, worker['parser'], output_file, writer, storage)
+    return output_file.getvalue(), writer.records if writer else [], storage, summaries
 
 
 def main():
+    # Server mode (kerncraft serve ...)
+    if sys.argv[1:2] == ['serve']:
+        from . import server
+        server.main(sys.argv[2:])
+        return
+    # Corpus mode (kerncraft corpus ...)
+    if sys.argv[1:2] == ['corpus']:
+        from . import corpus
+        corpus.main(sys.argv[2:])
+        return
+
     # Create and populate parser
     parser = create_parser()
 
@@ -11,9 +11,11 @@ import tempfile
 import subprocess
 import os
 import os.path
+import signal
 import sys
 import numbers
 import collections
+import threading
 from functools import reduce
 from string import ascii_letters
 from distutils.spawn import find_executable
@@ -29,12 +31,82 @@ from six.moves import filter
 from six.moves import map
 from six.moves import zip_longest
 import six
-from pylru import lrudecorator
 
 from .pycparser import CParser, c_ast, plyparser
 from .pycparser.c_generator import CGenerator
 
 from . import iaca_marker as iaca
+from . import profiling
+from .affine import AffineExpression, evaluate_many
+
+
+# Constructing a CParser loads the PLY tables, therefore parsers are reused (one per thread)
+_c_parsers = threading.local()
+
+
+def get_c_parser():
+    '''returns the C parser of the current thread'''
+    if not hasattr(_c_parsers, 'parser'):
+        # need to refer to local lextab, otherwise the systemwide lextab would be imported
+        _c_parsers.parser = CParser(lextab='kerncraft.pycparser.lextab',
+                                    yacctab='kerncraft.pycparser.yacctab')
+    return _c_parsers.parser
+
+
+class TimeoutExpired(subprocess.CalledProcessError):
+    '''raised by check_output() if a command did not finish within its timeout'''
+    def __init__(self, cmd, timeout, output=None):
+        subprocess.CalledProcessError.__init__(self, -1, cmd, output)
+        self.timeout = timeout
+
+    def __str__(self):
+        return "Command '{}' timed out after {} seconds".format(' '.join(self.cmd), self.timeout)
+
+
+def check_output(cmd, timeout=None, **kwargs):
+    '''
+    runs *cmd* and returns its output, like subprocess.check_output()
+
+    If *timeout* (in seconds) is given, *cmd* is killed after that time and TimeoutExpired (a
+    subclass of subprocess.CalledProcessError) is raised. *cmd* then runs in its own process
+    group, which is killed as a whole (e.g., including the compiler started by a driver or a
+    wrapper script).
+    '''
+    use_process_group = timeout is not None and hasattr(os, 'killpg')
+    if use_process_group:
+        if six.PY2:
+            kwargs['preexec_fn'] = os.setsid
+        else:
+            kwargs['start_new_session'] = True
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, **kwargs)
+    timed_out = []
+
+    def kill():
+        timed_out.append(True)
+        try:
+            if use_process_group:
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except OSError:
+            # already finished
+            pass
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+    try:
+        output = process.communicate()[0]
+    finally:
+        if timer is not None:
+            timer.cancel()
+    if timed_out:
+        raise TimeoutExpired(cmd, timeout, output)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, output)
+    return output
 
 
 def prefix_indent(prefix, textblock, later_prefix=' '):
@@ -129,6 +201,66 @@ def find_array_references(ast):
         return reduce(operator.add, [find_array_references(o[1]) for o in ast.children()], [])
 
 
+
+def find_inner_loop(floop):
+    '''returns the for loop directly nested in *floop* or None'''
+    if type(floop.stmt) is c_ast.For:
+        return floop.stmt
+    elif type(floop.stmt) is c_ast.Compound and floop.stmt.block_items and \
+            type(floop.stmt.block_items[-1]) is c_ast.For and \
+            all([type(s) is c_ast.Pragma for s in floop.stmt.block_items[:-1]]):
+        return floop.stmt.block_items[-1]
+    return None
+
+
+def transform_loop_tiling(floop, tiled_loops):
+    '''
+    Strip-mines loops in nest of *floop* and interchanges the block loops to the outside
+    (in-place)
+
+    *tiled_loops* is a list of (index name, block size name) tuples in loop nest order. Returns
+    the new outer-most loop.
+
+    e.g. for(int j=1; j<M-1; ++j) with [('j', 'j_block')] becomes
+    for(int j_tile=1; j_tile<M-1; j_tile+=j_block)
+      for(int j=j_tile; j<(j_tile+j_block<M-1 ? j_tile+j_block : M-1); ++j)
+    '''
+    tiled = dict(tiled_loops)
+    block_loops = []
+    loop = floop
+    while loop is not None:
+        index = loop.init.decls[0].name
+        if index in tiled:
+            tile_index = index+'_tile'
+            loop_end = loop.cond.right
+            block_end = c_ast.BinaryOp('+', c_ast.ID(tile_index), c_ast.ID(tiled[index]))
+
+            # for(int j_tile=1; j_tile<M-1; j_tile+=j_block)
+            init = c_ast.DeclList([
+                c_ast.Decl(
+                    tile_index, [], [], [], c_ast.TypeDecl(
+                        tile_index, [], c_ast.IdentifierType(['int'])),
+                    loop.init.decls[0].init,
+                    None)],
+                None)
+            cond = c_ast.BinaryOp('<', c_ast.ID(tile_index), deepcopy(loop_end))
+            next_ = c_ast.Assignment('+=', c_ast.ID(tile_index), c_ast.ID(tiled[index]))
+            block_loops.append(c_ast.For(init, cond, next_, None))
+
+            # for(int j=j_tile; j<(j_tile+j_block<M-1 ? j_tile+j_block : M-1); ++j)
+            loop.init.decls[0].init = c_ast.ID(tile_index)
+            loop.cond.right = c_ast.TernaryOp(
+                c_ast.BinaryOp('<', block_end, loop_end), deepcopy(block_end), deepcopy(loop_end))
+        loop = find_inner_loop(loop)
+    assert len(block_loops) == len(tiled), "tiled index is not a loop counter of this loop nest"
+
+    # nest block loops around original loop nest
+    for outer, inner in zip(block_loops, block_loops[1:]+[floop]):
+        outer.stmt = inner
+
+    return block_loops[0] if block_loops else floop
+
+
 # Make sure that functions will return iterable objects:
 def force_iterable(f):
     def wrapper(*args, **kwargs):
@@ -152,6 +284,8 @@ class Kernel(object):
         self._destinations = {}
         self._flops = {}
         self.datatype = None
+        # AffineExpressions per access and per sympy expression (independent of constants)
+        self._affine_accesses = {}
 
         self.clear_state()
 
@@ -170,6 +304,7 @@ class Kernel(object):
             self.constants[name] = value
         else:
             self.constants[sympy.Symbol(name, positive=True)] = value
+        self._subs_consts_cache = {}  # results depend on constants
 
     def set_variable(self, name, type_, size):
         assert type_ in self.datatypes_size, 'only float and double variables are supported'
@@ -184,17 +319,20 @@ class Kernel(object):
         '''Clears changable internal states
         (constants, asm_blocks and asm_block_idx)'''
         self.constants = {}
-        self.subs_consts.clear()  # clear LRU cache of function
+        self._subs_consts_cache = {}
 
-    @lrudecorator(40)
     def subs_consts(self, expr):
         '''
         Substitutes constants in expression unless it is already a number
+
+        Results are cached per kernel (until constants change).
         '''
         if isinstance(expr, numbers.Number):
             return expr
-        else:
-            return expr.subs(self.constants)
+        cache = self._subs_consts_cache
+        if expr not in cache:
+            cache[expr] = expr.subs(self.constants)
+        return cache[expr]
 
     def array_sizes(self, in_bytes=False, subs_consts=False):
         '''Returns a dictionary with all arrays sizes (optunally in bytes, otherwise in elements).
@@ -260,6 +398,28 @@ class Kernel(object):
 
         return expr
 
+    def index_symbols(self):
+        '''Returns list of sympy symbols of loop indices (outer to inner loop)'''
+        return [sympy.Symbol(l[0], positive=True) for l in self._loop_stack]
+
+    def sympy_to_affine(self, expr):
+        '''Transforms a sympy expression (e.g., from access_to_sympy) to an AffineExpression'''
+        if expr not in self._affine_accesses:
+            self._affine_accesses[expr] = AffineExpression.from_sympy(expr, self.index_symbols())
+        return self._affine_accesses[expr]
+
+    def access_to_affine(self, var_name, access, subs_consts=False):
+        '''Transforms a variable access to an AffineExpression (optionally with constants
+        substituted)'''
+        key = (var_name, tuple(access))
+        if key not in self._affine_accesses:
+            self._affine_accesses[key] = self.sympy_to_affine(
+                self.access_to_sympy(var_name, access))
+        expr = self._affine_accesses[key]
+        if subs_consts:
+            return expr.subs(self.constants)
+        return expr
+
     def iteration_length(self, dimension=None):
         '''Returns the number of global loop iterations that are performed
 
@@ -341,12 +501,55 @@ class Kernel(object):
 
         sympy_distances = defaultdict(list)
         for var_name, accesses in sympy_accesses.items():
+            accesses = [self.sympy_to_affine(a) for a in accesses]
             for i in range(1, len(accesses)):
-                sympy_distances[var_name].append((accesses[i-1]-accesses[i]).simplify())
+                sympy_distances[var_name].append((accesses[i-1]-accesses[i]).to_sympy())
 
         return sympy_distances
 
+    def _loop_counter_parameters(self):
+        '''Returns (loop index, start, length, increment, preceding increment, preceding length)
+        tuples, from inner to outer loop, with constants substituted'''
+        parameters = []
+        total_length = 1
+        last_incr = 1
+        for var_name, start, end, incr in reversed(self._loop_stack):
+            start, length, incr = [self.subs_consts(e) for e in [start, end-start, incr]]
+            parameters.append((var_name, start, length, incr, last_incr, total_length))
+            total_length = total_length*length
+            last_incr = incr
+        return parameters
+
     def global_iterator_to_indices(self, git=None):
+        '''Returns functions translating global_iterator to loop indices,
+        or if global_iterator is given, an integer is returned'''
+        parameters = self._loop_counter_parameters()
+        if not all([isinstance(e, (numbers.Integral, sympy.Integer))
+                    for p in parameters for e in p[1:]]):
+            # constants are not (all) known
+            return self._symbolic_global_iterator_to_indices(git)
+
+        # unwind global iteration count into loop counters:
+        def loop_counter(start, length, incr, last_incr, total_length):
+            def counter(global_iterator):
+                # FIXME is incr handled correct here?
+                global_iterator = numpy.asarray(global_iterator, dtype=numpy.int64)
+                return start + (global_iterator*last_incr//total_length*incr) % length
+            return counter
+
+        base_loop_counters = {}
+        for var_name, start, length, incr, last_incr, total_length in parameters:
+            loop_var = sympy.Symbol(var_name, positive=True)
+            counter = loop_counter(
+                *[int(e) for e in (start, length, incr, last_incr, total_length)])
+            if git is not None:
+                base_loop_counters[loop_var] = sympy.Integer(int(counter(int(git))))
+            else:
+                base_loop_counters[loop_var] = counter
+
+        return base_loop_counters
+
+    def _symbolic_global_iterator_to_indices(self, git=None):
         '''Returns sympy expressions translating global_iterator to loop indices,
         or if global_iterator is given, an integer is returned'''
         # unwind global iteration count into loop counters:
@@ -394,6 +597,25 @@ class Kernel(object):
         return self.subs_consts(global_iterator)
 
 
+    def array_base_offsets(self, spacing=0):
+        '''Returns a dictionary with the byte offset of each array on a virtual address space.
+
+        :param spacing: sets a spacing between the arrays, default is 0
+
+        Arrays are layed out linearly in alphabetical order, each aligned to 64 bytes.
+        '''
+        var_sizes = self.array_sizes(in_bytes=True, subs_consts=True)
+        base_offsets = {}
+        base = 0
+        # Always arange arrays in alphabetical order in memory, for reproducability
+        for var_name, var_size in sorted(var_sizes.items(), key=lambda v: v[0]):
+            base_offsets[var_name] = base
+            array_total_size = self.subs_consts(var_size + spacing)
+            # Add bytes to align by 64 byte (typical cacheline size):
+            array_total_size = ((int(array_total_size)+63)& ~63)
+            base += array_total_size
+        return base_offsets
+
     def compile_global_offsets(self, iteration=0, spacing=0):
         '''Returns load and store offsets on a virtual address space.
 
@@ -427,45 +649,27 @@ class Kernel(object):
 
         # Get sizes of arrays and base offsets for each array
         var_sizes = self.array_sizes(in_bytes=True, subs_consts=True)
-        base_offsets = {}
-        base = 0
-        # Always arange arrays in alphabetical order in memory, for reproducability
-        for var_name, var_size in sorted(var_sizes.items(), key=lambda v: v[0]):
-            base_offsets[var_name] = base
-            array_total_size = self.subs_consts(var_size + spacing)
-            # Add bytes to align by 64 byte (typical cacheline size):
-            array_total_size = ((int(array_total_size)+63)& ~63)
-            base += array_total_size
+        base_offsets = self.array_base_offsets(spacing)
 
-        # Gather all read and write accesses to the array:
+        # Gather all read and write accesses to the array, as byte offsets:
         for var_name, var_size in var_sizes.items():
             element_size = self.datatypes_size[self.variables[var_name][0]]
             for r in self._sources.get(var_name, []):
-                offset_expr = self.access_to_sympy(var_name, r)
-                offset = force_iterable(sympy.lambdify(
-                    base_loop_counters.keys(),
-                    self.subs_consts(
-                        offset_expr*element_size
-                        + base_offsets[var_name]), numpy))
                 # TODO possibly differentiate between index order
-                global_load_offsets.append(offset)
+                global_load_offsets.append(
+                    self.access_to_affine(var_name, r, subs_consts=True)*element_size +
+                    base_offsets[var_name])
             for w in self._destinations.get(var_name, []):
-                offset_expr = self.access_to_sympy(var_name, w)
-                offset = force_iterable(sympy.lambdify(
-                    base_loop_counters.keys(),
-                    self.subs_consts(
-                        offset_expr*element_size
-                        + base_offsets[var_name]), numpy))
-                # TODO possibly differentiate between index order
-                global_store_offsets.append(offset)
-                # TODO take element sizes into account, return in bytes
+                global_store_offsets.append(
+                    self.access_to_affine(var_name, w, subs_consts=True)*element_size +
+                    base_offsets[var_name])
 
         # Generate numpy.array for each counter
-        counter_per_it = [v(iteration) for v in base_loop_counters.values()]
+        counter_per_it = {str(k): v(iteration) for k, v in base_loop_counters.items()}
 
         # Data access as they appear with iteration order
-        return zip_longest(zip(*[o(*counter_per_it) for o in global_load_offsets]),
-                           zip(*[o(*counter_per_it) for o in global_store_offsets]),
+        return zip_longest(zip(*evaluate_many(global_load_offsets, counter_per_it).tolist()),
+                           zip(*evaluate_many(global_store_offsets, counter_per_it).tolist()),
                            fillvalue=None)
 
     def print_kernel_info(self, output_file=sys.stdout):
@@ -529,9 +733,7 @@ class KernelCode(Kernel):
 
         self.kernel_code = kernel_code
         self._filename = filename
-        # need to refer to local lextab, otherwise the systemwide lextab would be imported
-        parser = CParser(lextab='kerncraft.pycparser.lextab',
-                         yacctab='kerncraft.pycparser.yacctab')
+        parser = get_c_parser()
         try:
             self.kernel_ast = parser.parse(self._as_function(), filename=filename).ext[0].body
         except plyparser.ParseError as e:
@@ -557,7 +759,27 @@ class KernelCode(Kernel):
         super(KernelCode, self).clear_state()
         self.asm_blocks = {}
         self.asm_block_idx = None
-        self.subs_consts.clear()  # clear LRU cache of function
+        self.tiling = {}
+
+    def set_tiling(self, index, block_size):
+        '''
+        Tiles loop with counter *index* into blocks of *block_size* iterations in generated code
+
+        Block loops are interchanged to the outside of the loop nest, the block size is passed as
+        command line argument (after the constants).
+        '''
+        steps = {l[0]: l[3] for l in self._loop_stack}
+        assert index in steps, "tiled index needs to be a loop counter of the kernel"
+        assert type(block_size) is int and block_size > 0, \
+            "block size needs to be a positive int"
+        assert block_size % steps[index] == 0, \
+            "block size needs to be a multiple of the loop's step size"
+        self.tiling[index] = block_size
+
+    def tiled_loops(self):
+        '''Returns list of (index, block size name, block size) tuples in loop nest order'''
+        return [(index, index+'_block', self.tiling[index])
+                for index, min_, max_, step in self._loop_stack if index in self.tiling]
 
     def _process_code(self):
         assert type(self.kernel_ast) is c_ast.Compound, "Kernel has to be a compound statement"
@@ -788,46 +1010,52 @@ class KernelCode(Kernel):
 
         return sources
 
-    def as_code(self, type_='iaca'):
+    def as_code(self, type_='iaca', openmp=False):
         '''
         generates compilable source code from AST
 
-        *type* can be iaca or likwid.
+        *type* can be iaca or likwid. Loops selected with set_tiling() are tiled.
+
+        if *openmp* is True, the outer loop is shared among OpenMP threads and each thread has its
+        own likwid marker region (only with likwid type). Scalars written in the loop are reduced.
         '''
         assert self.kernel_ast is not None, "AST does not exist, this could be due to running of " \
              "kernel description rather then code."
+        assert not openmp or type_ == 'likwid', "OpenMP is only supported with likwid type"
 
         ast = deepcopy(self.kernel_ast)
         declarations = [d for d in ast.block_items if type(d) is c_ast.Decl]
+        kernel_loop = ast.block_items[-1]
 
         # transform multi-dimensional declarations to one dimensional references
         array_dimensions = dict(list(map(trasform_multidim_to_1d_decl, declarations)))
         # transform to pointer and malloc notation (stack can be too small)
         list(map(transform_array_decl_to_malloc, declarations))
 
-        # add declarations for constants
+        # add declarations for constants, followed by block sizes of tiled loops
         i = 1  # subscript for cli input
-        for k in self.constants:
+        for name in [k.name for k in self.constants] + [b for _, b, _ in self.tiled_loops()]:
             # cont int N = atoi(argv[1])
-            # TODO change subscript of argv depending on constant count
-            type_decl = c_ast.TypeDecl(k.name, ['const'], c_ast.IdentifierType(['int']))
+            type_decl = c_ast.TypeDecl(name, ['const'], c_ast.IdentifierType(['int']))
             init = c_ast.FuncCall(
                 c_ast.ID('atoi'),
                 c_ast.ExprList([c_ast.ArrayRef(c_ast.ID('argv'), c_ast.Constant('int', str(i)))]))
             i += 1
             ast.block_items.insert(0, c_ast.Decl(
-                k.name, ['const'], [], [],
+                name, ['const'], [], [],
                 type_decl, init, None))
 
         if type_ == 'likwid':
             # Call likwid_markerInit()
             ast.block_items.insert(0, c_ast.FuncCall(c_ast.ID('likwid_markerInit'), None))
             # Call likwid_markerThreadInit()
-            ast.block_items.insert(1, c_ast.FuncCall(c_ast.ID('likwid_markerThreadInit'), None))
+            thread_init = c_ast.FuncCall(c_ast.ID('likwid_markerThreadInit'), None)
+            ast.block_items.insert(1, thread_init)
             # Call likwid_markerClose()
             ast.block_items.append(c_ast.FuncCall(c_ast.ID('likwid_markerClose'), None))
 
         # inject array initialization
+        init_loops = []
         for d in declarations:
             i = ast.block_items.index(d)
 
@@ -864,7 +1092,8 @@ class KernelCode(Kernel):
                     c_ast.ArrayRef(c_ast.ID(d.name), c_ast.ID(counter_name)),
                     c_ast.Constant('float', '0.23'))
 
-                ast.block_items.insert(i+1, c_ast.For(init, cond, next_, stmt))
+                init_loops.append(c_ast.For(init, cond, next_, stmt))
+                ast.block_items.insert(i+1, init_loops[-1])
 
                 # inject dummy access to arrays, so compiler does not over-optimize code
                 # with if around it, so code will actually run
@@ -896,11 +1125,17 @@ class KernelCode(Kernel):
         list(map(lambda aref: transform_multidim_to_1d_ref(aref, array_dimensions),
                  find_array_references(ast)))
 
+        # strip-mine and interchange tiled loops
+        if self.tiling:
+            ast.block_items[ast.block_items.index(kernel_loop)] = transform_loop_tiling(
+                kernel_loop, [(index, b) for index, b, _ in self.tiled_loops()])
+
         if type_ == 'likwid':
             # Instrument the outer for-loop with likwid
-            ast.block_items.insert(-2, c_ast.FuncCall(
+            start_region = c_ast.FuncCall(
                 c_ast.ID('likwid_markerStartRegion'),
-                c_ast.ExprList([c_ast.Constant('string', '"loop"')])))
+                c_ast.ExprList([c_ast.Constant('string', '"loop"')]))
+            ast.block_items.insert(-2, start_region)
 
             dummies = []
             # Make sure nothing gets removed by inserting dummy calls
@@ -928,20 +1163,55 @@ class KernelCode(Kernel):
             init = c_ast.FuncCall(
                 c_ast.ID('atoi'),
                 c_ast.ExprList([c_ast.ArrayRef(
-                    c_ast.ID('argv'), c_ast.Constant('int', str(len(self.constants)+1)))]))
-            ast.block_items.insert(-3, c_ast.Decl(
-                'repeat', ['const'], [], [],
-                type_decl, init, None))
+                    c_ast.ID('argv'),
+                    c_ast.Constant('int', str(len(self.constants)+len(self.tiling)+1)))]))
+            repeat_decl = c_ast.Decl('repeat', ['const'], [], [], type_decl, init, None)
+            ast.block_items.insert(-3, repeat_decl)
             # for(; repeat > 0; repeat--) {...}
             cond = c_ast.BinaryOp( '>', c_ast.ID('repeat'), c_ast.Constant('int', '0'))
             next_ = c_ast.UnaryOp('--', c_ast.ID('repeat'))
             stmt = c_ast.Compound([ast.block_items.pop(-2)]+dummies)
 
-            ast.block_items.insert(-1, c_ast.For(None, cond, next_, stmt))
+            repeat_loop = c_ast.For(None, cond, next_, stmt)
+            ast.block_items.insert(-1, repeat_loop)
 
-            ast.block_items.insert(-1, c_ast.FuncCall(
+            stop_region = c_ast.FuncCall(
                 c_ast.ID('likwid_markerStopRegion'),
-                c_ast.ExprList([c_ast.Constant('string', '"loop"')])))
+                c_ast.ExprList([c_ast.Constant('string', '"loop"')]))
+            ast.block_items.insert(-1, stop_region)
+
+            if openmp:
+                # #pragma omp parallel
+                # { likwid_markerThreadInit(); }
+                i = ast.block_items.index(thread_init)
+                ast.block_items[i:i+1] = [
+                    c_ast.Pragma('omp parallel'), c_ast.Compound([thread_init])]
+
+                # Share outer loop among threads, scalar destinations are reductions
+                omp_for = 'omp for'
+                reductions = sorted([name for name in self._destinations
+                                     if self.variables[name][1] is None])
+                if reductions:
+                    omp_for += ' reduction(+:{})'.format(','.join(reductions))
+                assert type(repeat_loop.stmt.block_items[0]) is c_ast.For, \
+                    "Outer kernel loop not found in repeat loop."
+                repeat_loop.stmt.block_items.insert(0, c_ast.Pragma(omp_for))
+
+                # Each thread repeats and measures on its own:
+                # #pragma omp parallel
+                # { int repeat = ...; likwid_markerStartRegion(...); for(...) {...} ...Stop...}
+                start = ast.block_items.index(repeat_decl)
+                end = ast.block_items.index(stop_region) + 1
+                measured = ast.block_items[start:end]
+                assert measured == [repeat_decl, start_region, repeat_loop, stop_region], \
+                    "Unexpected statements in measured region."
+                ast.block_items[start:end] = [
+                    c_ast.Pragma('omp parallel'), c_ast.Compound(measured)]
+
+                # Array initializations run in parallel for first touch
+                for init_loop in init_loops:
+                    ast.block_items.insert(ast.block_items.index(init_loop),
+                                           c_ast.Pragma('omp parallel for'))
 
         # embedd Compound into main FuncDecl
         decl = c_ast.Decl('main', [], [], [], c_ast.FuncDecl(c_ast.ParamList([
@@ -982,8 +1252,41 @@ class KernelCode(Kernel):
 
         return code
 
+    def select_asm_block(self, in_filename, asm_block='auto', asm_increment=0):
+        '''
+        Selects the assembly block of the kernel loop in *in_filename* and stores it in asm_block.
+
+        *asm_block* and *asm_increment* are used as in assemble().
+
+        Returns the lines of *in_filename*.
+        '''
+        with open(in_filename, 'r') as in_file:
+            lines = in_file.readlines()
+        blocks = iaca.find_asm_blocks(lines)
+
+        # Choose best default block:
+        block_idx = iaca.select_best_block(blocks)
+        if asm_block == 'manual':
+            block_idx = iaca.userselect_block(blocks, default=block_idx)
+        elif asm_block != 'auto':
+            block_idx = asm_block
+
+        self.asm_block = blocks[block_idx][1]
+
+        # Use userinput for pointer_increment, if given
+        if asm_increment != 0:
+            self.asm_block['pointer_increment'] = asm_increment
+
+        # If block's pointer_increment is None, let user choose
+        if self.asm_block['pointer_increment'] is None:
+            iaca.userselect_increment(self.asm_block)
+
+        return lines
+
+    @profiling.profiled('assemble')
     def assemble(self, compiler, in_filename,
-                 out_filename=None, iaca_markers=True, asm_block='auto', asm_increment=0):
+                 out_filename=None, iaca_markers=True, asm_block='auto', asm_increment=0,
+                 timeout=None):
         '''
         Assembles *in_filename* to *out_filename*.
 
@@ -1001,6 +1304,8 @@ class KernelCode(Kernel):
         if it is 0 (default), automatic detection will be use and might lead to an interactive user
         interface.
 
+        *timeout* (optional) limits the run time of the assembler in seconds.
+
         Returns two-tuple (filepointer, filename) to temp binary file.
         '''
         if not out_filename:
@@ -1010,33 +1315,15 @@ class KernelCode(Kernel):
             if self._filename:
                 out_filename = os.path.abspath(os.path.splitext(self._filename)[0]+suffix)
             else:
-                out_filename = tempfile.mkstemp(suffix=suffix)
+                fd, out_filename = tempfile.mkstemp(suffix=suffix)
+                os.close(fd)
 
         # insert iaca markers
         if iaca_markers:
-            with open(in_filename, 'r') as in_file:
-                lines = in_file.readlines()
-            blocks = iaca.find_asm_blocks(lines)
+            lines = self.select_asm_block(in_filename, asm_block, asm_increment)
 
             # TODO check for already present markers
 
-            # Choose best default block:
-            block_idx = iaca.select_best_block(blocks)
-            if asm_block == 'manual':
-                block_idx = iaca.userselect_block(blocks, default=block_idx)
-            elif asm_block != 'auto':
-                block_idx = asm_block
-
-            self.asm_block = blocks[block_idx][1]
-
-            # Use userinput for pointer_increment, if given
-            if asm_increment != 0:
-                self.asm_block['pointer_increment'] = asm_increment
-
-            # If block's pointer_increment is None, let user choose
-            if self.asm_block['pointer_increment'] is None:
-                iaca.userselect_increment(self.asm_block)
-
             # Insert markers:
             lines = iaca.insert_markers(
                 lines, self.asm_block['first_line'], self.asm_block['last_line'])
@@ -1047,9 +1334,9 @@ class KernelCode(Kernel):
 
         try:
             # Assamble all to a binary
-            subprocess.check_output(
+            check_output(
                 [compiler, os.path.basename(in_file.name), 'dummy.s', '-o', out_filename],
-                cwd=os.path.dirname(os.path.realpath(in_file.name)))
+                timeout=timeout, cwd=os.path.dirname(os.path.realpath(in_file.name)))
         except subprocess.CalledProcessError as e:
             print(u"Assemblation failed:", e, file=sys.stderr)
             sys.exit(1)
@@ -1058,10 +1345,13 @@ class KernelCode(Kernel):
 
         return out_filename
 
-    def compile(self, compiler, compiler_args=None):
+    @profiling.profiled('compile')
+    def compile(self, compiler, compiler_args=None, timeout=None):
         '''
         Compiles source (from as_code(type_)) to assembly.
 
+        *timeout* (optional) limits the run time of each compiler call in seconds.
+
         Returns two-tuple (filepointer, filename) to assembly file.
 
         Output can be used with Kernel.assemble()
@@ -1084,22 +1374,22 @@ class KernelCode(Kernel):
 
         if compiler_args is None:
             compiler_args = []
-        compiler_args += ['-std=c99']
+        compiler_args = compiler_args + ['-std=c99']
 
         try:
-            subprocess.check_output(
+            check_output(
                 [compiler] +
                 compiler_args +
                 [os.path.basename(in_file.name),
                  '-S',
                  '-I'+os.path.abspath(os.path.dirname(os.path.realpath(__file__)))+'/headers/'],
-                cwd=os.path.dirname(os.path.realpath(in_file.name)))
+                timeout=timeout, cwd=os.path.dirname(os.path.realpath(in_file.name)))
 
-            subprocess.check_output(
+            check_output(
                 [compiler] + compiler_args + [
                     os.path.abspath(os.path.dirname(os.path.realpath(__file__))+'/headers/dummy.c'),
                     '-S'],
-                cwd=os.path.dirname(os.path.realpath(in_file.name)))
+                timeout=timeout, cwd=os.path.dirname(os.path.realpath(in_file.name)))
         except subprocess.CalledProcessError as e:
             print(u"Compilation failed:", e, file=sys.stderr)
             sys.exit(1)
@@ -1109,10 +1399,13 @@ class KernelCode(Kernel):
         # Let's return the out_file name
         return os.path.splitext(in_file.name)[0]+'.s'
 
-    def build(self, compiler, cflags=None, lflags=None, verbose=False):
+    @profiling.profiled('build')
+    def build(self, compiler, cflags=None, lflags=None, verbose=False, openmp=False):
         '''
         compiles source to executable with likwid capabilities
 
+        if *openmp* is True, the executable is OpenMP parallel (see as_code())
+
         returns the executable name
         '''
         if not (('LIKWID_INCLUDE' in os.environ or 'LIKWID_INC' in os.environ) and
@@ -1129,12 +1422,15 @@ class KernelCode(Kernel):
 
         if cflags is None:
             cflags = []
-        cflags += ['-std=c99',
+        cflags = cflags + ['-std=c99',
                    '-I'+os.path.abspath(os.path.dirname(os.path.realpath(__file__)))+'/headers/',
                    os.environ.get('LIKWID_INCLUDE', ''),
                    os.environ.get('LIKWID_INC', ''),
                    '-llikwid']
 
+        if openmp:
+            cflags.append('-fopenmp')
+
         if lflags is None:
             lflags = []
         lflags += os.environ['LIKWID_LIB'].split(' ') + ['-pthread']
@@ -1146,7 +1442,7 @@ class KernelCode(Kernel):
         else:
             source_file = open(self._filename+"_compilable.c", 'w')
 
-        source_file.write(self.as_code(type_='likwid'))
+        source_file.write(self.as_code(type_='likwid', openmp=openmp))
         source_file.flush()
 
         infiles = [os.path.abspath(os.path.dirname(os.path.realpath(__file__)))+'/headers/dummy.c',
@@ -1154,7 +1450,8 @@ class KernelCode(Kernel):
         if self._filename:
             outfile = os.path.abspath(os.path.splitext(self._filename)[0]+'.likwid_marked')
         else:
-            outfile = tempfile.mkstemp(suffix='.likwid_marked')
+            fd, outfile = tempfile.mkstemp(suffix='.likwid_marked')
+            os.close(fd)
         cmd = [compiler] + infiles + cflags + lflags + ['-o', outfile]
         # remove empty arguments
         cmd = list(filter(bool, cmd))
@@ -11,10 +11,19 @@ if sys.version_info[0] == 2 and sys.version_info < (2, 6) or \
 
 import subprocess
 import re
+import os
+import os.path
+import shutil
+import argparse
+import glob
+import multiprocessing
+import timeit
 from copy import copy
 from pprint import pprint
+from distutils.spawn import find_executable
 
 from ruamel import yaml
+import numpy
 
 from .prefixedunit import PrefixedUnit
 from six.moves import range
@@ -27,19 +36,15 @@ def get_match_or_break(regex, haystack, flags=re.MULTILINE):
     return m.groups()
 
 
-def get_machine_topology():
-    try:
-        topo = subprocess.Popen(['likwid-topology'], stdout=subprocess.PIPE).communicate()[0].decode("utf-8")
-    except OSError as e:
-        print('likwid-topology execution failed, is it installed and loaded?', file=sys.stderr)
-        sys.exit(1)
-    cpuinfo = open('/proc/cpuinfo', 'r').read()
-    machine = {
-        'model type': get_match_or_break(r'^CPU type:\s+(.+?)\s*$', topo)[0],
-        'model name': get_match_or_break(r'^model name\s+:\s+(.+?)\s*$', cpuinfo)[0],
-        'sockets': int(get_match_or_break(r'^Sockets:\s+([0-9]+)\s*$', topo)[0]),
-        'cores per socket': int(get_match_or_break(r'^Cores per socket:\s+([0-9]+)\s*$', topo)[0]),
-        'threads per core': int(get_match_or_break(r'^Threads per core:\s+([0-9]+)\s*$', topo)[0]),
+def machine_template(model_type, model_name, sockets, cores_per_socket, threads_per_core):
+    '''Returns machine description with all information that can not be gathered automatically
+    marked as required'''
+    return {
+        'model type': model_type,
+        'model name': model_name,
+        'sockets': sockets,
+        'cores per socket': cores_per_socket,
+        'threads per core': threads_per_core,
         'clock': 'INFORMATION_REQUIRED (e.g., 2.7 GHz)',
         'FLOPs per cycle': {'SP': {'total': 'INFORMATION_REQUIRED',
                                    'FMA': 'INFORMATION_REQUIRED',
@@ -58,6 +63,118 @@ def get_machine_topology():
         'non-overlapping ports': 'INFORMATION_REQUIRED (like overlapping ports)',
     }
 
+
+def append_main_memory(machine):
+    '''Appends main memory to memory hierarchy of *machine*, last cache is connected to it'''
+    # Remove last caches load_from and store_to:
+    del machine['memory hierarchy'][-1]['cache per group']['load_from']
+    del machine['memory hierarchy'][-1]['cache per group']['store_to']
+
+    machine['memory hierarchy'].append({
+        'level': 'MEM',
+        'cores per group': machine['cores per socket'],
+        'threads per group': machine['threads per core'] * machine['cores per socket'],
+        'cycles per cacheline transfer': None,
+        'penalty cycles per read stream': 0,
+        'size per group': None
+    })
+
+
+def read_sysfs(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def get_cpu_layout():
+    '''Returns dictionary of sockets, each with a dictionary of cores and list of their hardware
+    threads (read from /sys/devices/system/cpu)'''
+    layout = {}
+    for cpu_path in glob.glob('/sys/devices/system/cpu/cpu[0-9]*'):
+        if not os.path.exists(os.path.join(cpu_path, 'topology')):
+            # offline cpu
+            continue
+        cpu = int(os.path.basename(cpu_path)[3:])
+        socket = int(read_sysfs(os.path.join(cpu_path, 'topology/physical_package_id')))
+        core = int(read_sysfs(os.path.join(cpu_path, 'topology/core_id')))
+        layout.setdefault(socket, {}).setdefault(core, []).append(cpu)
+    for cores in layout.values():
+        for threads in cores.values():
+            threads.sort()
+    return layout
+
+
+def get_machine_topology_sysfs():
+    '''Same as get_machine_topology, but based on /proc/cpuinfo and /sys/devices/system/cpu
+    instead of likwid-topology'''
+    cpuinfo = open('/proc/cpuinfo', 'r').read()
+    layout = get_cpu_layout()
+    first_socket = layout[min(layout)]
+    machine = machine_template(
+        model_type='INFORMATION_REQUIRED (e.g., Intel Core Haswell processor)',
+        model_name=get_match_or_break(r'^model name\s+:\s+(.+?)\s*$', cpuinfo)[0],
+        sockets=len(layout),
+        cores_per_socket=len(first_socket),
+        threads_per_core=len(first_socket[min(first_socket)]))
+
+    cache_paths = []
+    for cache_path in glob.glob('/sys/devices/system/cpu/cpu0/cache/index[0-9]*'):
+        if read_sysfs(os.path.join(cache_path, 'type')) == 'Instruction':
+            continue
+        cache_paths.append(
+            (int(read_sysfs(os.path.join(cache_path, 'level'))), os.path.basename(cache_path)))
+
+    machine['memory hierarchy'] = []
+    for level, index in sorted(cache_paths):
+        cache_path = os.path.join('/sys/devices/system/cpu/cpu0/cache', index)
+        sets = int(read_sysfs(os.path.join(cache_path, 'number_of_sets')))
+        ways = int(read_sysfs(os.path.join(cache_path, 'ways_of_associativity')))
+        cl_size = int(read_sysfs(os.path.join(cache_path, 'coherency_line_size')))
+        # one group per distinct set of cpus sharing this cache
+        groups = set([read_sysfs(os.path.join(p, 'shared_cpu_list')) for p in glob.glob(
+            '/sys/devices/system/cpu/cpu[0-9]*/cache/'+index)])
+        if level == 1:
+            machine['cacheline size'] = PrefixedUnit(cl_size, 'B')
+        mem_level = {
+            'level': 'L'+str(level),
+            'cache per group': {
+                'sets': sets,
+                'ways': ways,
+                'cl_size': cl_size,
+                'replacement_policy': 'INFORMATION_REQUIRED (options: LRU, FIFO, MRU, RR)',
+                'write_allocate': 'INFORMATION_REQUIRED (True/False)',
+                'write_back': 'INFORMATION_REQUIRED (True/False)',
+                'load_from': 'L'+str(level+1),
+                'store_to': 'L'+str(level+1)},
+            'size per group': PrefixedUnit(sets*ways*cl_size, 'B'),
+            'groups': len(groups),
+            'cores per group':
+                (machine['cores per socket'] * machine['sockets']) / len(groups),
+            'cycles per cacheline transfer': 'INFORMATION_REQUIRED'}
+        mem_level['threads per group'] = \
+            mem_level['cores per group'] * machine['threads per core']
+        machine['memory hierarchy'].append(mem_level)
+
+    append_main_memory(machine)
+
+    return machine
+
+
+def get_machine_topology():
+    try:
+        topo = subprocess.Popen(['likwid-topology'], stdout=subprocess.PIPE).communicate()[0].decode("utf-8")
+    except OSError as e:
+        print('likwid-topology execution failed, is it installed and loaded?', file=sys.stderr)
+        sys.exit(1)
+    cpuinfo = open('/proc/cpuinfo', 'r').read()
+    machine = machine_template(
+        model_type=get_match_or_break(r'^CPU type:\s+(.+?)\s*$', topo)[0],
+        model_name=get_match_or_break(r'^model name\s+:\s+(.+?)\s*$', cpuinfo)[0],
+        sockets=int(get_match_or_break(r'^Sockets:\s+([0-9]+)\s*$', topo)[0]),
+        cores_per_socket=int(
+            get_match_or_break(r'^Cores per socket:\s+([0-9]+)\s*$', topo)[0]),
+        threads_per_core=int(
+            get_match_or_break(r'^Threads per core:\s+([0-9]+)\s*$', topo)[0]))
+
     threads_start = topo.find('HWThread')
     threads_end = topo.find('Cache Topology')
     threads = {}
@@ -95,18 +212,7 @@ def get_machine_topology():
                 mem_level['cores per group'] * machine['threads per core']
         mem_level['cycles per cacheline transfer'] = 'INFORMATION_REQUIRED'
 
-    # Remove last caches load_from and store_to:
-    del machine['memory hierarchy'][-1]['cache per group']['load_from']
-    del machine['memory hierarchy'][-1]['cache per group']['store_to']
-
-    machine['memory hierarchy'].append({
-        'level': 'MEM',
-        'cores per group': machine['cores per socket'],
-        'threads per group': machine['threads per core'] * machine['cores per socket'],
-        'cycles per cacheline transfer': None,
-        'penalty cycles per read stream': 0,
-        'size per group': None
-    })
+    append_main_memory(machine)
 
     return machine
 
@@ -134,66 +240,183 @@ def measure_bw(type_, total_size, threads_per_core, max_threads_per_core, cores_
     return PrefixedUnit(bw, 'MB/s')
 
 
-def cli():
-    # TODO support everything described here
-    if '-h' in sys.argv[1:] or '--help' in sys.argv[1:]:
-        print('''Usage:', sys.argv[0], '[-h] {collect|measure} [machinefile] | upgrade machinefile
-
-        collect will retriev as much hardware information as possible, without benchmarking
-        measure will do the same as collect, but also include memory benchmarks
-
-        If machinefile already exists the CPU name will be compared. If they matche, measurements
-        will proceed and the file is updated accordingly. All other information in the file
-        (typically manually inserted) will be left alone.
-
-        If no machinefile is given, the information will be printed to stdout.
-
-        updgrade will transform machinefile to the most up-to-date machine file version.
-        ''')
-
-
-def main():
-    machine = get_machine_topology()
-    pprint(machine)
-
-    benchmarks = {'kernels': {}, 'measurements': {}}
-    machine['benchmarks'] = benchmarks
-    benchmarks['kernels'] = {
-        'load': {
-            'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
-            'write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
-            'FLOPs per iteration': 0},
-        'copy': {
-            'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
-            'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'FLOPs per iteration': 0},
-        'update': {
-            'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'read+write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'FLOPs per iteration': 0},
-        'triad': {
-            'read streams': {'streams': 3, 'bytes': PrefixedUnit(24, 'B')},
-            'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
-            'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'FLOPs per iteration': 2},
-        'daxpy': {
-            'read streams': {'streams': 2, 'bytes': PrefixedUnit(16, 'B')},
-            'read+write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
-            'FLOPs per iteration': 2}, }
-
-    USAGE_FACTOR = 0.66
-    MEM_FACTOR = 15.0
+# NumPy stand-ins for likwid-bench kernels:
+# name: (number of arrays, bytes transferred per element, function)
+# triad has to be split into two passes (a = c*d; a += b) and therefore transfers more data
+NUMPY_KERNELS = {
+    'load': (1, 8, lambda a: a.sum()),
+    'copy': (2, 16, lambda a, b: numpy.copyto(a, b)),
+    'update': (1, 16, lambda a: numpy.multiply(a, 1.0, out=a)),
+    'triad': (4, 48, lambda a, b, c, d: numpy.add(numpy.multiply(c, d, out=a), b, out=a)),
+    'daxpy': (2, 24, lambda a, b: numpy.add(a, b, out=a)), }
+
+
+def _numpy_bw_worker(type_, elements, cpu, start, duration, queue):
+    '''Runs NumPy kernel *type_* pinned to *cpu* for at least *duration* seconds after *start*
+    was set and puts bandwidth in B/s into *queue*'''
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, [cpu])
+        except OSError:
+            pass
+    array_count, bytes_per_element, kernel = NUMPY_KERNELS[type_]
+    arrays = [numpy.full(elements, 0.5) for i in range(array_count)]
+    # first touch and warm up
+    kernel(*arrays)
+    queue.put(None)
+
+    start.wait()
+    iterations = 0
+    begin = timeit.default_timer()
+    while True:
+        kernel(*arrays)
+        iterations += 1
+        runtime = timeit.default_timer() - begin
+        if runtime >= duration:
+            break
+    queue.put(iterations*elements*bytes_per_element/runtime)
+
+
+def measure_bw_numpy(type_, total_size, threads_per_core, max_threads_per_core, cores_per_socket,
+                     sockets, duration=0.5):
+    """
+    Same as measure_bw, but with NumPy kernels in one process per hardware thread
+
+    *size* is given in kilo bytes
+    """
+    layout = get_cpu_layout()
+    cpus = []
+    for s in sorted(layout)[:sockets]:
+        for core in sorted(layout[s])[:cores_per_socket]:
+            cpus += layout[s][core][:threads_per_core]
+    # unknown or unavailable cpus are not pinned
+    cpus += [None]*(threads_per_core*cores_per_socket*sockets - len(cpus))
+
+    array_count = NUMPY_KERNELS[type_][0]
+    elements = max(int(total_size*1000/len(cpus)/8/array_count), 1)
+    sys.stderr.write('numpy {} {}kB on cpus {}'.format(
+        type_, total_size, ','.join(['?' if c is None else str(c) for c in cpus])))
+
+    start = multiprocessing.Event()
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(
+        target=_numpy_bw_worker, args=(type_, elements, cpu, start, duration, queue))
+        for cpu in cpus]
+    for p in processes:
+        p.start()
+    # wait for all processes to be initialized
+    for p in processes:
+        queue.get()
+    start.set()
+    bw = sum([queue.get() for p in processes])
+    for p in processes:
+        p.join()
+
+    print(' ', PrefixedUnit(bw/1e6, 'MB/s'), file=sys.stderr)
+    return PrefixedUnit(bw/1e6, 'MB/s')
+
+
+BENCHMARK_KERNELS = {
+    'load': {
+        'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
+        'write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
+        'FLOPs per iteration': 0},
+    'copy': {
+        'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
+        'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'FLOPs per iteration': 0},
+    'update': {
+        'read streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'read+write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'FLOPs per iteration': 0},
+    'triad': {
+        'read streams': {'streams': 3, 'bytes': PrefixedUnit(24, 'B')},
+        'read+write streams': {'streams': 0, 'bytes': PrefixedUnit(0, 'B')},
+        'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'FLOPs per iteration': 2},
+    'daxpy': {
+        'read streams': {'streams': 2, 'bytes': PrefixedUnit(16, 'B')},
+        'read+write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'write streams': {'streams': 1, 'bytes': PrefixedUnit(8, 'B')},
+        'FLOPs per iteration': 2}, }
+
+USAGE_FACTOR = 0.66
+MEM_FACTOR = 15.0
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description='Gathers machine information with likwid-topology and measures bandwidths '
+                    'with likwid-bench.')
+    parser.add_argument('machine_file', metavar='MACHINEFILE', nargs='?',
+                        help='Machine file to create or update. Each measurement is written to it '
+                             'immediately, measurements already present are skipped, all other '
+                             'information in the file is left alone. If not given, the machine '
+                             'file is printed to stdout at the end.')
+    parser.add_argument('--levels', nargs='+', metavar='LEVEL',
+                        help='Memory levels to benchmark (e.g., L1 MEM). Default: all')
+    parser.add_argument('--kernels', nargs='+', metavar='KERNEL',
+                        choices=sorted(BENCHMARK_KERNELS.keys()),
+                        help='Benchmark kernels to run. Default: all')
+    parser.add_argument('--cores', nargs='+', metavar='CORES', type=int,
+                        help='Core counts to benchmark. Default: 1 to cores per socket')
+    parser.add_argument('--threads-per-core', nargs='+', metavar='THREADS', type=int,
+                        help='SMT levels to benchmark. Default: 1 to threads per core')
+    parser.add_argument('--engine', choices=['likwid', 'numpy'],
+                        help='Use likwid-topology and likwid-bench or a NumPy fallback (based '
+                             'on /proc/cpuinfo and /sys/devices/system/cpu) for approximate '
+                             'measurements. Default: likwid if available, numpy otherwise')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Measure only selected core counts until bandwidth saturates and '
+                             'interpolate the others (marked as not measured in machine file).')
+    parser.add_argument('--tolerance', metavar='FRACTION', type=float, default=0.05,
+                        help='Relative bandwidth change regarded as significant by --adaptive. '
+                             'Default: 0.05')
+    return parser
+
+
+def load_machine(machine_file, get_topology=get_machine_topology):
+    '''Returns machine description from *machine_file* if it exists and matches this machine,
+    otherwise gathers it with *get_topology*'''
+    machine = get_topology()
+    if machine_file and os.path.exists(machine_file):
+        with open(machine_file) as f:
+            stored_machine = yaml.load(f, Loader=yaml.Loader)
+        if stored_machine['model name'] != machine['model name']:
+            print("Machine file model name ({}) does not match this machine ({}).".format(
+                stored_machine['model name'], machine['model name']), file=sys.stderr)
+            sys.exit(1)
+        machine = stored_machine
+    return machine
+
+
+def store_machine(machine, machine_file):
+    '''Atomically (over)writes *machine_file* with *machine*'''
+    tempname = machine_file + '.tmp'
+    with open(tempname, 'w') as f:
+        f.write(yaml.dump(machine))
+    shutil.move(tempname, machine_file)
+
+
+def prepare_measurements(machine):
+    '''Adds benchmark kernels and measurement sizes (without results) that are not yet present
+    in *machine*'''
+    benchmarks = machine.setdefault('benchmarks', {})
+    benchmarks.setdefault('kernels', {})
+    for kernel, kernel_info in BENCHMARK_KERNELS.items():
+        benchmarks['kernels'].setdefault(kernel, kernel_info)
+    measurements = benchmarks.setdefault('measurements', {})
 
     cores = list(range(1, machine['cores per socket']+1))
     for mem in machine['memory hierarchy']:
-        measurement = {}
-        machine['benchmarks']['measurements'][mem['level']] = measurement
+        measurement = measurements.setdefault(mem['level'], {})
 
         for threads_per_core in range(1, machine['threads per core']+1):
+            if threads_per_core in measurement:
+                continue
             threads = [c*threads_per_core for c in cores]
             if mem['size per group'] is not None:
                 total_sizes = [
@@ -214,27 +437,144 @@ def main():
                 'size per thread': sizes_per_thread,
                 'total size': total_sizes,
                 'results': {}, }
+
+
+def adaptive_core_counts(measure, cores, tolerance=0.05):
+    '''
+    Measures bandwidths for a subset of *cores* (sorted list of core counts) and interpolates all
+    others
+
+    *measure* is called with a core count and returns the bandwidth. Core counts are doubled until
+    bandwidth increases by less than *tolerance* (saturation), larger core counts are assumed to
+    reach the saturated bandwidth. Between measured core counts, the middle one is measured as long
+    as it deviates by more than *tolerance* from linear interpolation.
+
+    Returns a list of (bandwidth, measured) tuples for all *cores*, bandwidths in MB/s (like
+    measure_bw()).
+    '''
+    measured = {}
+
+    def bw(i):
+        if i not in measured:
+            measured[i] = measure(cores[i])
+        return float(measured[i])
+
+    # Double core count until saturation
+    last = 0
+    bw(last)
+    while last < len(cores)-1:
+        next_ = min([j for j in range(last+1, len(cores)) if cores[j] >= 2*cores[last]] +
+                    [len(cores)-1])
+        if bw(next_) < (1+tolerance)*bw(last):
+            last = next_
+            break
+        last = next_
+
+    # Refine where linear interpolation is not good enough
+    intervals = list(zip(sorted(measured)[:-1], sorted(measured)[1:]))
+    while intervals:
+        a, b = intervals.pop()
+        if b-a < 2:
+            continue
+        middle = (a+b)//2
+        interpolated = bw(a) + (bw(b)-bw(a))*(cores[middle]-cores[a])/(cores[b]-cores[a])
+        if abs(bw(middle)-interpolated) > tolerance*bw(middle):
+            intervals += [(a, middle), (middle, b)]
+
+    results = []
+    points = sorted(measured)
+    for i in range(len(cores)):
+        if i in measured:
+            results.append((measured[i], True))
+        elif i > points[-1]:
+            # saturated
+            results.append((PrefixedUnit(bw(points[-1])/1e6, 'MB/s'), False))
+        else:
+            a = max([p for p in points if p < i])
+            b = min([p for p in points if p > i])
+            results.append((PrefixedUnit(
+                (bw(a) + (bw(b)-bw(a))*(cores[i]-cores[a])/(cores[b]-cores[a]))/1e6, 'MB/s'),
+                False))
+    return results
+
+
+def main(argv=None):
+    parser = create_parser()
+    args = parser.parse_args(argv)
+
+    engine = args.engine
+    if engine is None:
+        if find_executable('likwid-topology') and find_executable('likwid-bench'):
+            engine = 'likwid'
+        else:
+            print('likwid not found, using NumPy fallback for approximate measurements.',
+                  file=sys.stderr)
+            engine = 'numpy'
+    if engine == 'likwid':
+        get_topology, measure_bw_function = get_machine_topology, measure_bw
+    else:
+        get_topology, measure_bw_function = get_machine_topology_sysfs, measure_bw_numpy
+
+    machine = load_machine(args.machine_file, get_topology)
+    prepare_measurements(machine)
+
     print('Progress: ', end='', file=sys.stderr)
     sys.stderr.flush()
-    for mem_level in list(machine['benchmarks']['measurements'].keys()):
-        for threads_per_core in list(machine['benchmarks']['measurements'][mem_level].keys()):
-            measurement = machine['benchmarks']['measurements'][mem_level][threads_per_core]
-            measurement['results'] = {}
-            for kernel in list(machine['benchmarks']['kernels'].keys()):
-                measurement['results'][kernel] = []
-                for i, total_size in enumerate(measurement['total size']):
-                    measurement['results'][kernel].append(measure_bw(
+    measurements = machine['benchmarks']['measurements']
+    for mem_level in sorted(measurements.keys()):
+        if args.levels and mem_level not in args.levels:
+            continue
+        for threads_per_core in sorted(measurements[mem_level].keys()):
+            if args.threads_per_core and threads_per_core not in args.threads_per_core:
+                continue
+            measurement = measurements[mem_level][threads_per_core]
+            for kernel in sorted(machine['benchmarks']['kernels'].keys()):
+                if args.kernels and kernel not in args.kernels:
+                    continue
+                # Missing results are None, interpolated results are marked as not measured
+                results = measurement['results'].setdefault(
+                    kernel, [None]*len(measurement['total size']))
+                measured = measurement.setdefault('measured', {}).setdefault(
+                    kernel, [r is not None for r in results])
+
+                def measure(cores):
+                    i = measurement['cores'].index(cores)
+                    if measured[i]:
+                        # measured in a previous run
+                        return results[i]
+                    results[i] = measure_bw_function(
                         kernel,
-                        int(float(total_size)/1000),
+                        int(float(measurement['total size'][i])/1000),
                         threads_per_core,
                         machine['threads per core'],
-                        measurement['cores'][i],
-                        sockets=1))
+                        cores,
+                        sockets=1)
+                    measured[i] = True
+                    if args.machine_file:
+                        store_machine(machine, args.machine_file)
 
                     print('.', end='', file=sys.stderr)
                     sys.stderr.flush()
+                    return results[i]
+
+                cores = [c for c in measurement['cores'] if not args.cores or c in args.cores]
+                if not cores:
+                    continue
+                if args.adaptive:
+                    for c, (bw, is_measured) in zip(
+                            cores, adaptive_core_counts(measure, cores, args.tolerance)):
+                        i = measurement['cores'].index(c)
+                        if not measured[i]:
+                            results[i] = bw
+                else:
+                    for c in cores:
+                        measure(c)
+    print('', file=sys.stderr)
 
-    print(yaml.dump(machine))
+    if args.machine_file:
+        store_machine(machine, args.machine_file)
+    else:
+        print(yaml.dump(machine))
 
 if __name__ == '__main__':
     main()
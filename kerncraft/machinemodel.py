@@ -2,8 +2,20 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import copy
+from collections import OrderedDict
+
 import ruamel
 import cachesim
+import six
+
+from .prefixedunit import PrefixedUnit
+
+
+# Machine parameters which are only used by the cycle models (not by cache predictors). Given
+# per memory level (e.g., MEM.bandwidth) or as top level keys (e.g., clock).
+CYCLE_MODEL_KEYS = ['clock', 'cycles per cacheline transfer', 'penalty cycles per read stream',
+                    'bandwidth', 'benchmarks', 'FLOPs per cycle']
 
 class MachineModel(object):
     def __init__(self, path_to_yaml=None, machine_yaml=None):
@@ -17,6 +29,13 @@ class MachineModel(object):
             with open(path_to_yaml, 'r') as f:
                 # Ignore ruamel unsafe loading warning, by supplying Loader parameter
                 self._data = ruamel.yaml.load(f, Loader=ruamel.yaml.Loader)
+        # memoized results of get_bandwidth()
+        self._bandwidths = {}
+        # cache predictors in least recently used order, shared with what-if variants of the same
+        # cache configuration (see cacheprediction.get_predictor())
+        self.predictions = OrderedDict()
+        # what-if variants by cache relevant overrides (see what_if())
+        self._variants = {}
 
     def __getitem__(self, index):
         return self._data[index]
@@ -27,6 +46,106 @@ class MachineModel(object):
             repr(self._path or self._data['model name']),
         )
 
+    def what_if(self, overrides):
+        '''Returns a copy of this machine with parameters changed according to *overrides*
+
+        *overrides* is a sequence of (key, value) pairs. Keys are paths separated by dots, starting
+        at the top level (e.g., "clock") or at a memory level (e.g., "L2.cycles per cacheline
+        transfer" or "L3.cache per group.ways"). Two keys per memory level are derived: "size"
+        sets the number of cache sets (prefixes are binary, 1 kB = 1024 B) and "bandwidth"
+        replaces all measured bandwidths. Values are strings in YAML notation (e.g., "3 GHz"),
+        values starting with "*" scale the current value (e.g., "*1.3").
+
+        Cache predictions are shared with this machine, unless cache parameters are changed.
+        '''
+        overrides = [(six.text_type(k), six.text_type(v)) for k, v in overrides]
+        cache_overrides = tuple(o for o in overrides if not self.is_cycle_model_key(o[0]))
+        if cache_overrides not in self._variants:
+            if cache_overrides:
+                base = MachineModel(machine_yaml=copy.deepcopy(self._data))
+                base._path = self._path
+                for key, value in cache_overrides:
+                    base._override(key, value)
+            else:
+                base = self
+            self._variants[cache_overrides] = base
+        base = self._variants[cache_overrides]
+
+        variant = MachineModel(machine_yaml=copy.deepcopy(base._data))
+        variant._path = base._path
+        variant.predictions = base.predictions
+        for key, value in overrides:
+            if self.is_cycle_model_key(key):
+                variant._override(key, value)
+        return variant
+
+    def is_cycle_model_key(self, key):
+        '''Returns True if what-if *key* does not influence cache predictions'''
+        path = key.split('.')
+        if path[0] in [l['level'] for l in self['memory hierarchy']]:
+            path = path[1:]
+        return bool(path) and path[0] in CYCLE_MODEL_KEYS
+
+    def _override(self, key, value):
+        '''Sets parameter *key* to *value* (see what_if())'''
+        path = key.split('.')
+        levels = {l['level']: l for l in self['memory hierarchy']}
+        data = self._data
+        level = None
+        if path[0] in levels:
+            level = path.pop(0)
+            data = levels[level]
+        if not path:
+            raise ValueError('what-if key {!r} needs a parameter name'.format(key))
+
+        if level and path == ['bandwidth']:
+            if level not in self['benchmarks']['measurements']:
+                raise ValueError('no bandwidth measurements for {}'.format(level))
+            for measurements in self['benchmarks']['measurements'][level].values():
+                for results in measurements['results'].values():
+                    results[:] = [self._override_value(bw, value) if bw is not None else None
+                                  for bw in results]
+        elif level and path == ['size']:
+            if 'cache per group' not in data:
+                raise ValueError('{} is not a cache'.format(level))
+            cache = data['cache per group']
+            line_size = cache['ways']*cache['cl_size']
+            if value.startswith('*'):
+                size = cache['sets']*line_size*float(value[1:])
+            else:
+                size = self._override_value(None, value)
+                if isinstance(size, PrefixedUnit):
+                    # cache sizes are given with binary prefixes (1 kB = 1024 B)
+                    size = size.value*1024**' kMGTP'.index(size.prefix or ' ')
+            if size < line_size or size % line_size:
+                raise ValueError('{} size has to be a multiple of ways times cache line size '
+                                 '({} B)'.format(level, line_size))
+            size = int(size)
+            cache['sets'] = size // line_size
+            if 'size per group' in data:
+                data['size per group'] = PrefixedUnit(size, 'B')
+        else:
+            for name in path[:-1]:
+                if not isinstance(data, dict) or name not in data:
+                    raise ValueError('unknown what-if key {!r}'.format(key))
+                data = data[name]
+            if not isinstance(data, dict) or path[-1] not in data:
+                raise ValueError('unknown what-if key {!r}'.format(key))
+            data[path[-1]] = self._override_value(data[path[-1]], value)
+        self._bandwidths.clear()
+
+    @staticmethod
+    def _override_value(old, value):
+        '''Returns *old* replaced or scaled (if *value* starts with "*") by *value*'''
+        if value.startswith('*'):
+            factor = float(value[1:])
+            if isinstance(old, PrefixedUnit):
+                return PrefixedUnit(float(old)*factor, '', old.unit).reduced()
+            if isinstance(old, int) and float(old*factor).is_integer():
+                return int(old*factor)
+            return old*factor
+        return ruamel.yaml.load(value, Loader=ruamel.yaml.Loader)
+
     def get_cachesim(self, cores=1):
         '''Returns a cachesim.CacheSimulator object based on the machine description
         and used core count'''
@@ -45,7 +164,27 @@ class MachineModel(object):
         '''Returns best fitting bandwidth according to parameters
 
         :param cores: if not given, will choose maximum bandwidth
+
+        Results are memoized per argument combination.
         '''
+        key = (cache_level, read_streams, write_streams, threads_per_core, cores)
+        if key not in self._bandwidths:
+            self._bandwidths[key] = self._get_bandwidth(*key)
+        return self._bandwidths[key]
+
+    def get_bandwidths(self, cache_level, read_streams, write_streams, threads_per_core,
+                       cores=None):
+        '''Returns lists of bandwidths and measurement kernels for sequences of stream counts
+
+        Selection is done once per distinct pair of read and write stream counts (see
+        get_bandwidth()).
+        '''
+        pairs = list(zip(read_streams, write_streams))
+        selected = {p: self.get_bandwidth(cache_level, p[0], p[1], threads_per_core, cores)
+                    for p in set(pairs)}
+        return [selected[p][0] for p in pairs], [selected[p][1] for p in pairs]
+
+    def _get_bandwidth(self, cache_level, read_streams, write_streams, threads_per_core, cores):
         # try to find best fitting kernel (closest to stream seen stream counts):
         # write allocate has to be handled in kernel information (all writes are also reads)
         # TODO support for non-write-allocate architectures
@@ -74,9 +213,17 @@ class MachineModel(object):
             # Used by Roofline model
             run_index = bw_measurements['cores'].index(cores)
             bw = bw_measurements['results'][measurement_kernel][run_index]
+            assert bw is not None, 'bandwidth of {} with {} cores was not measured.'.format(
+                bw_level, cores)
         else:
-            # Used by ECM model
-            bw = max(bw_measurements['results'][measurement_kernel])
+            # Used by ECM model, partial measurements may contain missing (None) results
+            measured = [b for b in bw_measurements['results'].get(measurement_kernel, [])
+                        if b is not None]
+            if not measured:
+                raise ValueError('bandwidth of {} with {} kernel was not measured (rerun '
+                                 'likwid_bench_auto with this machine file to complete the '
+                                 'measurements)'.format(bw_level, measurement_kernel))
+            bw = max(measured)
 
         # Correct bandwidth due to miss-measurement of write allocation
         # TODO support non-temporal stores and non-write-allocate architectures
@@ -7,13 +7,43 @@ import subprocess
 from functools import reduce
 import operator
 import sys
+import os
 from distutils.spawn import find_executable
 from pprint import pprint
 import re
 
 import six
+import numpy
 
 from kerncraft.kernel import KernelCode
+from kerncraft import profiling
+
+
+# Two-sided 95% quantiles of Student's t-distribution for 1 to 30 degrees of freedom
+T_DISTRIBUTION_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+                     2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+                     2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def reject_outliers(samples):
+    '''
+    Returns two lists (kept, rejected) of *samples* using Tukey's fences (1.5 interquartile ranges
+    below first or above third quartile)
+    '''
+    q1, q3 = numpy.percentile(samples, [25, 75])
+    lower, upper = q1-1.5*(q3-q1), q3+1.5*(q3-q1)
+    kept = [s for s in samples if lower <= s <= upper]
+    rejected = [s for s in samples if not lower <= s <= upper]
+    return kept, rejected
+
+
+def confidence_interval(samples):
+    '''Returns half width of the 95% confidence interval of the mean of *samples*'''
+    if len(samples) < 2:
+        return float('inf')
+    dof = len(samples)-1
+    t = T_DISTRIBUTION_95[dof-1] if dof <= len(T_DISTRIBUTION_95) else 1.960
+    return t*numpy.std(samples, ddof=1)/numpy.sqrt(len(samples))
 
 
 class Benchmark(object):
@@ -25,7 +55,15 @@ class Benchmark(object):
 
     @classmethod
     def configure_arggroup(cls, parser):
-        pass
+        parser.add_argument('--sample-time', metavar='SECONDS', type=float, default=0.2,
+                            help='Targeted runtime of a single benchmark sample. (default: 0.2)')
+        parser.add_argument('--min-samples', metavar='N', type=int, default=3,
+                            help='Minimal number of benchmark samples. (default: 3)')
+        parser.add_argument('--max-samples', metavar='N', type=int, default=20,
+                            help='Maximal number of benchmark samples. (default: 20)')
+        parser.add_argument('--ci-threshold', metavar='FRACTION', type=float, default=0.01,
+                            help='Stop sampling once the 95%% confidence interval of the runtime '
+                                 'is within FRACTION of the mean. (default: 0.01)')
 
     def __init__(self, kernel, machine, args=None, parser=None):
         """
@@ -43,14 +81,25 @@ class Benchmark(object):
 
         if args:
             # handle CLI info
-            pass
+            self.cores = args.cores
+        else:
+            self.cores = 1
 
-    def perfctr(self, cmd, group='MEM', cpu='S0:0', code_markers=True, pin=True):
+    def cpu_list(self):
+        '''Returns likwid cpu expression for the first *cores* cores, filling up socket 0 first'''
+        if self.cores <= self.machine['cores per socket']:
+            return 'S0:0-{}'.format(self.cores-1) if self.cores > 1 else 'S0:0'
+        else:
+            return 'N:0-{}'.format(self.cores-1)
+
+    @profiling.profiled('benchmark run')
+    def perfctr(self, cmd, group='MEM', cpu='S0:0', code_markers=True, pin=True, env=None):
         '''
         runs *cmd* with likwid-perfctr and returns result as dict
-        
+
         *group* may be a performance group known to likwid-perfctr or an event string.
-        Only works with single core!
+        Metrics are returned as lists with one value per core, event counters are summed over
+        all cores. *env* is the environment to run in (default: current environment).
         '''
 
         # Making sure iaca.sh is available:
@@ -59,7 +108,6 @@ class Benchmark(object):
                   file=sys.stderr)
             sys.exit(1)
 
-        # FIXME currently only single core measurements support!
         perf_cmd = ['likwid-perfctr', '-f', '-O', '-g', group]
 
         if pin:
@@ -74,7 +122,7 @@ class Benchmark(object):
         if self._args.verbose > 1:
             print(' '.join(perf_cmd))
         try:
-            output = subprocess.check_output(perf_cmd).decode('utf-8').split('\n')
+            output = subprocess.check_output(perf_cmd, env=env).decode('utf-8').split('\n')
         except subprocess.CalledProcessError as e:
             print("Executing benchmark failed: {!s}".format(e), file=sys.stderr)
             sys.exit(1)
@@ -84,14 +132,14 @@ class Benchmark(object):
         for l in output:
             l = l.split(',')
             try:
-                # Metrics
-                results[l[0]] = float(l[1])
+                # Metrics (one column per core)
+                results[l[0]] = [float(v) for v in l[1:] if v]
             except:
                 pass
             try:
-                # Event counters
-                counter_value = int(l[2])
-                if re.fullmatch(r'[A-Z_]+', l[0]) and re.fullmatch(r'[A-Z0-9]+', l[1]):
+                # Event counters (one column per core)
+                counter_value = sum([int(float(v)) for v in l[2:] if v])
+                if l[2] and re.fullmatch(r'[A-Z_]+', l[0]) and re.fullmatch(r'[A-Z0-9]+', l[1]):
                     results.setdefault(l[0], {})
                     results[l[0]][l[1]] = counter_value
             except (IndexError, ValueError):
@@ -102,28 +150,58 @@ class Benchmark(object):
     def analyze(self):
         bench = self.kernel.build(self.machine['compiler'],
                                   cflags=self.machine['compiler flags'],
-                                  verbose=self._args.verbose > 1)
+                                  verbose=self._args.verbose > 1,
+                                  openmp=self.cores > 1)
+        env = dict(os.environ, OMP_NUM_THREADS=six.text_type(self.cores))
 
         # Build arguments to pass to command:
-        args = [bench] + [six.text_type(s) for s in list(self.kernel.constants.values())]
+        args = [bench] + [six.text_type(s) for s in list(self.kernel.constants.values())] + \
+            [six.text_type(b) for i, n, b in self.kernel.tiled_loops()]
 
-        # Determan base runtime with 100 iterations
-        runtime = 0.0
-        time_per_repetition = 0.2/10.0
+        def measure(repetitions):
+            result = self.perfctr(args+[six.text_type(repetitions)], cpu=self.cpu_list(), env=env)
+            # threads are synchronized at the end of the loop, the slowest one is the runtime
+            return max(result['Runtime (RDTSC) [s]']), result
 
-        while runtime < 0.15:
-            # Interpolate to a 0.2s run
-            if time_per_repetition != 0.0:
-                repetitions = 0.2//time_per_repetition
+        # Calibration: extrapolate number of repetitions to targeted sample time
+        sample_time = self._args.sample_time
+        repetitions = 10
+        runtime, result = measure(repetitions)
+        while runtime < 0.75*sample_time:
+            if runtime > 0.0:
+                # Never more than 10 times as much, short runs are not trustworthy
+                repetitions = int(min(repetitions*sample_time/runtime, repetitions*10))
             else:
                 repetitions *= 10
+            runtime, result = measure(repetitions)
+        if self._args.verbose > 1:
+            print('Calibrated to {} repetitions ({:.3f} s)'.format(repetitions, runtime))
+
+        # Sampling: until confidence interval is narrow enough or max. number of samples reached
+        samples = []
+        while len(samples) < max(self._args.max_samples, 1):
+            samples.append(measure(repetitions))
+            if len(samples) < self._args.min_samples:
+                continue
+            kept, rejected = reject_outliers([rt for rt, r in samples])
+            if confidence_interval(kept) <= self._args.ci_threshold*numpy.mean(kept):
+                break
+        kept, rejected = reject_outliers([rt for rt, r in samples])
 
-            result = self.perfctr(args+[six.text_type(repetitions)])
-            runtime = result['Runtime (RDTSC) [s]']
-            time_per_repetition = runtime/float(repetitions)
+        # Counters are taken from sample closest to median runtime
+        median = float(numpy.median(kept))
+        runtime, result = min(samples, key=lambda s: abs(s[0]-median))
+        time_per_repetition = median/float(repetitions)
 
         self.results = {'raw output': result}
 
+        self.results['Repetitions'] = repetitions
+        self.results['Samples'] = len(samples)
+        self.results['Outliers'] = len(rejected)
+        self.results['Runtime samples [s]'] = [rt for rt, r in samples]
+        self.results['Runtime min (per repetition) [s]'] = min(kept)/float(repetitions)
+        self.results['Runtime CI (per repetition) [s]'] = \
+            confidence_interval(kept)/float(repetitions)
         self.results['Runtime (per repetition) [s]'] = time_per_repetition
         # TODO make more generic to support other (and multiple) constantnames
         # TODO support SP (devide by 4 instead of 8.0)
@@ -137,21 +215,32 @@ class Benchmark(object):
         cys_per_repetition = time_per_repetition*float(self.machine['clock'])
         self.results['Runtime (per cacheline update) [cy/CL]'] = \
             (cys_per_repetition/iterations_per_repetition)*iterations_per_cacheline
+        # memory counters are per socket, summing over cores adds up all sockets
         self.results['MEM volume (per repetition) [B]'] = \
-            result['Memory data volume [GBytes]']*1e9/repetitions
+            sum(result['Memory data volume [GBytes]'])*1e9/repetitions
         self.results['Performance [MFLOP/s]'] = \
             sum(self.kernel._flops.values())/(time_per_repetition/iterations_per_repetition)/1e6
         if 'Memory bandwidth [MBytes/s]' in result:
-            self.results['MEM BW [MByte/s]'] = result['Memory bandwidth [MBytes/s]']
+            self.results['MEM BW [MByte/s]'] = sum(result['Memory bandwidth [MBytes/s]'])
         else:
-            self.results['MEM BW [MByte/s]'] = result['Memory BW [MBytes/s]']
+            self.results['MEM BW [MByte/s]'] = sum(result['Memory BW [MBytes/s]'])
         self.results['Performance [MLUP/s]'] = (iterations_per_repetition/time_per_repetition)/1e6
         self.results['Performance [MIt/s]'] = (iterations_per_repetition/time_per_repetition)/1e6
+        self.results['Cores'] = self.cores
+        self.results['Performance per core [MLUP/s]'] = \
+            self.results['Performance [MLUP/s]']/self.cores
 
     def report(self, output_file=sys.stdout):
         if self._args.verbose > 0:
-            print('Runtime (per repetition): {:.2g} s'.format(
-                      self.results['Runtime (per repetition) [s]']),
+            print('Runtime (per repetition): {:.2g} s (median), {:.2g} s (min), '
+                  '+/-{:.2g} s (95% CI)'.format(
+                      self.results['Runtime (per repetition) [s]'],
+                      self.results['Runtime min (per repetition) [s]'],
+                      self.results['Runtime CI (per repetition) [s]']),
+                  file=output_file)
+            print('Samples: {} with {} repetitions ({} outliers rejected)'.format(
+                      self.results['Samples'], self.results['Repetitions'],
+                      self.results['Outliers']),
                   file=output_file)
         if self._args.verbose > 0:
             print('Iterations per repetition: {!s}'.format(
@@ -169,7 +258,11 @@ class Benchmark(object):
               file=output_file)
         print('Performance: {:.2f} It/s'.format(self.results['Performance [MIt/s]']),
               file=output_file)
-        if self._args.verbose > 0:
+        if self.cores > 1:
+            print('Performance per core ({} cores): {:.2f} MLUP/s'.format(
+                      self.cores, self.results['Performance per core [MLUP/s]']),
+                  file=output_file)
+        if self._args.verbose > 0 or self.cores > 1:
             print('MEM bandwidth: {:.2f} MByte/s'.format(self.results['MEM BW [MByte/s]']),
                   file=output_file)
         print('', file=output_file)
@@ -6,11 +6,8 @@ from __future__ import division
 
 import copy
 import sys
-import subprocess
-import re
 import math
 from pprint import pprint, pformat
-from distutils.spawn import find_executable
 from itertools import chain
 from copy import deepcopy
 
@@ -23,10 +20,12 @@ try:
 except ImportError:
     plot_support = False
 import sympy
+import numpy
 
 from kerncraft.prefixedunit import PrefixedUnit
 from kerncraft.kernel import KernelCode
-from kerncraft.cacheprediction import LayerConditionPredictor, CacheSimulationPredictor
+from kerncraft import incore_model
+from kerncraft.cacheprediction import get_predictor
 
 
 def round_to_next(x, base):
@@ -85,68 +84,84 @@ class ECMData(object):
             pass
 
     def calculate_cache_access(self):
-        if self._args.cache_predictor == 'SIM':
-            self.predictor = CacheSimulationPredictor(self.kernel, self.machine)
-        elif self._args.cache_predictor == 'LC':
-            self.predictor = LayerConditionPredictor(self.kernel, self.machine)
-        else:
-            raise NotImplementedError("Unknown cache predictor, only LC (layer condition) and "
-                                      "SIM (cache simulation with pycachesim) is supported.")
+        self.predictor = get_predictor(self._args.cache_predictor, self.kernel, self.machine)
         self.results = {'cycles': [],  # will be filled by caclculate_cycles()
                         'misses': self.predictor.get_misses(),
                         'hits': self.predictor.get_hits(),
                         'evicts': self.predictor.get_evicts(),
                         'verbose infos': self.predictor.get_infos()}  # only for verbose outputs
 
-    def calculate_cycles(self):
-        element_size = self.kernel.datatypes_size[self.kernel.datatype]
-        elements_per_cacheline = float(self.machine['cacheline size']) // element_size
-        
-        misses, evicts = (self.predictor.get_misses(), self.predictor.get_evicts())
-
-        for cache_level, cache_info in list(enumerate(self.machine['memory hierarchy']))[:-1]:
+    @classmethod
+    def calculate_cycles_batch(cls, kernel, machine, misses, evicts):
+        '''
+        Returns data transfer cycles for many predictions at once
+
+        *misses* and *evicts* are arrays of cache lines per cache level (columns), one row per
+        prediction (e.g., sweep point). Returned is a dictionary with "cycles" (array of same
+        shape), "levels" (transfer names, e.g. L1-L2), and per row "memory bandwidth" and
+        "memory bandwidth kernel" (None if no level is bandwidth based).
+        '''
+        element_size = kernel.datatypes_size[kernel.datatype]
+        elements_per_cacheline = float(machine['cacheline size']) // element_size
+        clock = float(machine['clock'])
+
+        misses = numpy.array(misses, dtype=float, ndmin=2)
+        evicts = numpy.array(evicts, dtype=float, ndmin=2)
+        cycles = numpy.zeros(misses.shape)
+        results = {'cycles': cycles,
+                   'levels': [],
+                   'memory bandwidth': [None]*len(misses),
+                   'memory bandwidth kernel': [None]*len(misses)}
+
+        for cache_level, cache_info in list(enumerate(machine['memory hierarchy']))[:-1]:
+            results['levels'].append('{}-{}'.format(
+                cache_info['level'], machine['memory hierarchy'][cache_level+1]['level']))
             cache_cycles = cache_info['cycles per cacheline transfer']
+            level_misses, level_evicts = misses[:, cache_level], evicts[:, cache_level]
 
             if cache_cycles is not None:
                 # only cache cycles count
-                cycles = (misses[cache_level] + evicts[cache_level]) * cache_cycles
+                cycles[:, cache_level] = (level_misses + level_evicts) * cache_cycles
             else:
                 # Memory transfer
                 # we use bandwidth to calculate cycles and then add panalty cycles (if given)
 
-                # choose bw according to cache level and problem
-                # first, compile stream counts at current cache level
+                # choose bw according to cache level and problem, once per distinct stream counts
                 # write-allocate is allready resolved above
-                read_streams = misses[cache_level]
-                write_streams = evicts[cache_level]
-                # second, try to find best fitting kernel (closest to stream seen stream counts):
                 threads_per_core = 1
-                bw, measurement_kernel = self.machine.get_bandwidth(
-                    cache_level+1, read_streams, write_streams, threads_per_core)
+                bws, measurement_kernels = machine.get_bandwidths(
+                    cache_level+1, level_misses.tolist(), level_evicts.tolist(),
+                    threads_per_core)
 
                 # calculate cycles
-                cycles = float(misses[cache_level] + evicts[cache_level]) * \
-                    float(elements_per_cacheline) * float(element_size) * \
-                    float(self.machine['clock']) / float(bw)
+                cycles[:, cache_level] = (level_misses + level_evicts) * \
+                    elements_per_cacheline * element_size * clock / \
+                    numpy.array([float(bw) for bw in bws])
                 # add penalty cycles for each read stream
                 if 'penalty cycles per read stream' in cache_info:
-                    cycles += misses[cache_level] * \
-                              cache_info['penalty cycles per read stream']
+                    cycles[:, cache_level] += \
+                        level_misses * cache_info['penalty cycles per read stream']
 
-            if cache_cycles is None:
-                self.results.update({
-                    'memory bandwidth kernel': measurement_kernel,
-                    'memory bandwidth': bw})
+                results['memory bandwidth'] = bws
+                results['memory bandwidth kernel'] = measurement_kernels
 
-            self.results['cycles'].append((
-                '{}-{}'.format(
-                    cache_info['level'], self.machine['memory hierarchy'][cache_level+1]['level']),
-                cycles))
+        return results
+
+    def calculate_cycles(self):
+        batch = self.calculate_cycles_batch(
+            self.kernel, self.machine,
+            [self.predictor.get_misses()], [self.predictor.get_evicts()])
+
+        if batch['memory bandwidth'][0] is not None:
+            self.results.update({
+                'memory bandwidth kernel': batch['memory bandwidth kernel'][0],
+                'memory bandwidth': batch['memory bandwidth'][0]})
+
+        for level, cycles in zip(batch['levels'], batch['cycles'][0].tolist()):
+            self.results['cycles'].append((level, cycles))
 
             # TODO remove the following by makeing testcases more versatile:
-            self.results['{}-{}'.format(
-                cache_info['level'], self.machine['memory hierarchy'][cache_level+1]['level'])
-                ] = cycles
+            self.results[level] = cycles
 
         return self.results
 
@@ -226,59 +241,23 @@ class ECMCPU(object):
                     self._args.asm_block = int(args.asm_block)
                 except ValueError:
                     parser.error('--asm-block can only be "auto", "manual" or an integer')
+        self._incore_analysis = None
 
-    def analyze(self):
-        # For the IACA/CPU analysis we need to compile and assemble
-        asm_name = self.kernel.compile(
-            self.machine['compiler'], compiler_args=self.machine['compiler flags'])
-        bin_name = self.kernel.assemble(
-            self.machine['compiler'], asm_name, iaca_markers=True, asm_block=self._args.asm_block,
-            asm_increment=self._args.asm_increment)
-
-        # Making sure iaca.sh is available:
-        if find_executable('iaca.sh') is None:
-            print("iaca.sh was not found. Make sure it is found in PATH.", file=sys.stderr)
-            sys.exit(1)
+    def start_analysis(self):
+        '''starts the in-core analysis in the background, analyze() waits for its result'''
+        self._incore_analysis = incore_model.analyze_kernel_async(
+            self.kernel, self.machine, **incore_model.analysis_options(self._args))
 
-        try:
-            cmd = ['iaca.sh', '-64', '-arch', self.machine['micro-architecture'], bin_name]
-            if self._args.verbose >= 3:
-                print('Executing:', ' '.join(cmd))
-            iaca_output = subprocess.check_output(cmd).decode('utf-8')
-        except OSError as e:
-            print("IACA execution failed:", ' '.join(cmd), file=sys.stderr)
-            print(e, file=sys.stderr)
-            sys.exit(1)
-        except subprocess.CalledProcessError as e:
-            print("IACA throughput analysis failed:", e, file=sys.stderr)
-            sys.exit(1)
-
-        # Get total cycles per loop iteration
-        match = re.search(
-            r'^Block Throughput: ([0-9\.]+) Cycles', iaca_output, re.MULTILINE)
-        assert match, "Could not find Block Throughput in IACA output."
-        block_throughput = float(match.groups()[0])
-
-        # Find ports and cyles per port
-        ports = [l for l in iaca_output.split('\n') if l.startswith('|  Port  |')]
-        cycles = [l for l in iaca_output.split('\n') if l.startswith('| Cycles |')]
-        assert ports and cycles, "Could not find ports/cylces lines in IACA output."
-        ports = [p.strip() for p in ports[0].split('|')][2:]
-        cycles = [c.strip() for c in cycles[0].split('|')][2:]
-        port_cycles = []
-        for i in range(len(ports)):
-            if '-' in ports[i] and ' ' in cycles[i]:
-                subports = [p.strip() for p in ports[i].split('-')]
-                subcycles = [c for c in cycles[i].split(' ') if bool(c)]
-                port_cycles.append((subports[0], float(subcycles[0])))
-                port_cycles.append((subports[0]+subports[1], float(subcycles[1])))
-            elif ports[i] and cycles[i]:
-                port_cycles.append((ports[i], float(cycles[i])))
-        port_cycles = dict(port_cycles)
-
-        match = re.search(r'^Total Num Of Uops: ([0-9]+)', iaca_output, re.MULTILINE)
-        assert match, "Could not find Uops in IACA output."
-        uops = float(match.groups()[0])
+    def analyze(self):
+        if self._incore_analysis is not None:
+            incore_analysis = self._incore_analysis.get()
+            self._incore_analysis = None
+        else:
+            incore_analysis = incore_model.analyze_kernel(
+                self.kernel, self.machine, **incore_model.analysis_options(self._args))
+        block_throughput = incore_analysis['throughput']
+        port_cycles = incore_analysis['port cycles']
+        uops = incore_analysis['uops']
 
         # Normalize to cycles per cacheline
         elements_per_block = abs(self.kernel.asm_block['pointer_increment']
@@ -304,6 +283,15 @@ class ECMCPU(object):
         if T_nOL < cl_throughput:
             T_OL = cl_throughput
 
+        # Loop-carried dependencies may be slower than the throughput bound
+        lcd = None
+        incore_bound = 'throughput'
+        if incore_analysis['latency'] is not None:
+            lcd = incore_analysis['latency']*block_to_cl_ratio
+            if lcd > T_OL:
+                T_OL = lcd
+                incore_bound = 'latency'
+
         # Create result dictionary
         self.results = {
             'port cycles': port_cycles,
@@ -311,7 +299,11 @@ class ECMCPU(object):
             'uops': uops,
             'T_nOL': T_nOL,
             'T_OL': T_OL,
-            'IACA output': iaca_output}
+            'loop-carried latency': lcd,
+            'dependency chain': incore_analysis['dependency chain'],
+            'in-core bound': incore_bound,
+            'in-core model': self._args.incore_model,
+            self._args.incore_model+' output': incore_analysis['output']}
 
 
     def conv_cy(self, cy_cl, unit, default='cy/CL'):
@@ -339,8 +331,8 @@ class ECMCPU(object):
 
     def report(self, output_file=sys.stdout):
         if self._args and self._args.verbose > 2:
-            print("IACA Output:", file=output_file)
-            print(self.results['IACA output'], file=output_file)
+            print("{} Output:".format(self.results['in-core model']), file=output_file)
+            print(self.results[self.results['in-core model']+' output'], file=output_file)
             print('', file=output_file)
 
         if self._args and self._args.verbose > 1:
@@ -350,9 +342,18 @@ class ECMCPU(object):
             print('Throughput: {}'.format(
                       self.conv_cy(self.results['cl throughput'], self._args.unit)),
                   file=output_file)
+            if self.results['loop-carried latency'] is not None:
+                print('Loop-carried latency: {}'.format(
+                          self.conv_cy(self.results['loop-carried latency'], self._args.unit)),
+                      file=output_file)
+                print('Dependency chain:', file=output_file)
+                for line in self.results['dependency chain']:
+                    print('    '+line, file=output_file)
 
         print('T_nOL = {:.1f} cy/CL'.format(self.results['T_nOL']), file=output_file)
-        print('T_OL = {:.1f} cy/CL'.format(self.results['T_OL']), file=output_file)
+        print('T_OL = {:.1f} cy/CL ({} bound)'.format(
+                  self.results['T_OL'], self.results['in-core bound']),
+              file=output_file)
 
 
 class ECM(object):
@@ -392,8 +393,10 @@ class ECM(object):
         self._data = ECMData(kernel, machine, args, parser)
 
     def analyze(self):
-        self._CPU.analyze()
+        # compiler and in-core analyzer run while cache misses are predicted
+        self._CPU.start_analysis()
         self._data.analyze()
+        self._CPU.analyze()
         self.results = copy.deepcopy(self._CPU.results)
         self.results.update(copy.deepcopy(self._data.results))
 
@@ -413,8 +416,8 @@ class ECM(object):
     def report(self, output_file=sys.stdout):
         report = ''
         if self._args and self._args.verbose > 1:
-            self._CPU.report()
-            self._data.report()
+            self._CPU.report(output_file=output_file)
+            self._data.report(output_file=output_file)
 
         total_cycles = max(
             self.results['T_OL'],
@@ -436,6 +439,10 @@ class ECM(object):
 
         report += '\nsaturating at {} cores'.format(self.results['scaling cores'])
 
+        if self.results['in-core bound'] == 'latency':
+            report += '\nT_OL is bound by loop-carried dependencies ({:.1f} cy/CL)'.format(
+                self.results['loop-carried latency'])
+
         print(report, file=output_file)
 
         if self._args and self._args.ecm_plot:
@@ -123,8 +123,9 @@ class LC(object):
             
             slices_distances = defaultdict(list)
             for k,v in slices_accesses.items():
+                v = [self.kernel.sympy_to_affine(a) for a in v]
                 for i in range(1, len(v)):
-                    slices_distances[k].append((v[i-1] - v[i]).simplify())
+                    slices_distances[k].append((v[i-1] - v[i]).to_sympy())
             results['dimensions'][dimension]['slices_distances'] = slices_distances
             
             # Check that distances contain only free_symbols based on constants
@@ -7,17 +7,16 @@ from __future__ import division
 
 from functools import reduce
 import operator
-import subprocess
-import re
 import sys
 from pprint import pformat  # Do not use pprint, breaks in combination with --store and StringIO
-from distutils.spawn import find_executable
 
 import sympy
+import numpy
 
 from kerncraft.prefixedunit import PrefixedUnit
 from kerncraft.kernel import KernelCode
-from kerncraft.cacheprediction import LayerConditionPredictor, CacheSimulationPredictor
+from kerncraft import incore_model
+from kerncraft.cacheprediction import get_predictor
 
 
 class Roofline(object):
@@ -52,13 +51,7 @@ class Roofline(object):
             raise ValueError("The Roofline model requires that the sum of FLOPs is non-zero.")
 
     def calculate_cache_access(self):
-        if self._args.cache_predictor == 'SIM':
-            self.predictor = CacheSimulationPredictor(self.kernel, self.machine)
-        elif self._args.cache_predictor == 'LC':
-            self.predictor = LayerConditionPredictor(self.kernel, self.machine)
-        else:
-            raise NotImplementedError("Unknown cache predictor, only LC (layer condition) and "
-                                      "SIM (cache simulation with pycachesim) is supported.")
+        self.predictor = get_predictor(self._args.cache_predictor, self.kernel, self.machine)
         self.results = {'misses': self.predictor.get_misses(),
                         'hits': self.predictor.get_hits(),
                         'evicts': self.predictor.get_evicts(),
@@ -67,13 +60,7 @@ class Roofline(object):
                         'mem bottlenecks': []}
         
         element_size = self.kernel.datatypes_size[self.kernel.datatype]
-        cacheline_size = float(self.machine['cacheline size'])
-        elements_per_cacheline = int(cacheline_size // element_size)
-
-        total_flops = sum(self.kernel._flops.values())*elements_per_cacheline
-
-        # TODO let user choose threads_per_core:
-        threads_per_core = 1
+        elements_per_cacheline = int(float(self.machine['cacheline size']) // element_size)
 
         # Compile relevant information
 
@@ -83,77 +70,102 @@ class Roofline(object):
             iteration=range(0, elements_per_cacheline))))
         read_offsets = set([item for sublist in read_offsets for item in sublist])
         write_offsets = set([item for sublist in write_offsets for item in sublist])
-        
+
         write_streams = len(write_offsets)
         read_streams = len(read_offsets) + write_streams # write-allocate
-        total_loads = read_streams * element_size
-        total_evicts = write_streams * element_size
-        bw, measurement_kernel = self.machine.get_bandwidth(
-            0, read_streams, write_streams,
-            threads_per_core, cores=self._args.cores)
 
-        # Calculate performance (arithmetic intensity * bandwidth with
-        # arithmetic intensity = flops / bytes loaded )
-        if total_loads == 0:
-            # This happens in case of full-caching
-            arith_intens = None
-            performance = None
-        else:
-            arith_intens = float(total_flops)/total_loads
-            performance = arith_intens * float(bw)
-
-        self.results['mem bottlenecks'].append({
-            'performance': PrefixedUnit(performance, 'FLOP/s'),
-            'level': self.machine['memory hierarchy'][0]['level'],
-            'arithmetic intensity': arith_intens,
-            'bw kernel': measurement_kernel,
-            'bandwidth': bw,
-            'bytes transfered': total_loads})
-        if performance <= self.results.get('min performance', performance):
-            self.results['bottleneck level'] = len(self.results['mem bottlenecks'])-1
-            self.results['min performance'] = performance
-
-        # for other cache and memory levels:
-        for cache_level, cache_info in list(enumerate(self.machine['memory hierarchy']))[:-1]:
-            # Compiling stats (in bytes!)
-            total_misses = self.results['misses'][cache_level]*cacheline_size
-            total_evicts = self.results['evicts'][cache_level]*cacheline_size
-
-            # choose bw according to cache level and problem
-            # first, compile stream counts at current cache level
-            # write-allocate is allready resolved above
-            read_streams = self.results['misses'][cache_level]
-            write_streams = self.results['evicts'][cache_level]
-            # second, try to find best fitting kernel (closest to stream seen stream counts):
-            bw, measurement_kernel = self.machine.get_bandwidth(
-                cache_level+1, read_streams, write_streams, threads_per_core,
-                cores=self._args.cores)
-
-            # Calculate performance (arithmetic intensity * bandwidth with
-            # arithmetic intensity = flops / bytes transfered)
-            bytes_transfered = total_misses + total_evicts
-
-            if bytes_transfered == 0:
-                # This happens in case of full-caching
-                arith_intens = float('inf')
-                performance = float('inf')
-            else:
-                arith_intens = float(total_flops)/bytes_transfered
-                performance = arith_intens * float(bw)
+        batch = self.calculate_bottlenecks_batch(
+            self.kernel, self.machine, [read_streams], [write_streams],
+            [self.results['misses']], [self.results['evicts']], self._args.cores)
 
+        for level in range(len(batch['levels'])):
+            performance = batch['performance'][0][level]
+            if level == 0 and batch['bytes transfered'][0][level] == 0:
+                # This happens in case of full-caching
+                performance = None
             self.results['mem bottlenecks'].append({
                 'performance': PrefixedUnit(performance, 'FLOP/s'),
-                'level': (self.machine['memory hierarchy'][cache_level+1]['level']),
-                'arithmetic intensity': arith_intens,
-                'bw kernel': measurement_kernel,
-                'bandwidth': bw,
-                'bytes transfered': bytes_transfered})
-            if performance < self.results.get('min performance', performance):
-                self.results['bottleneck level'] = len(self.results['mem bottlenecks'])-1
-                self.results['min performance'] = performance
-        
+                'level': batch['levels'][level],
+                'arithmetic intensity': batch['arithmetic intensity'][0][level],
+                'bw kernel': batch['bw kernel'][0][level],
+                'bandwidth': batch['bandwidth'][0][level],
+                'bytes transfered': batch['bytes transfered'][0][level]})
+        self.results['bottleneck level'] = batch['bottleneck level'][0]
+        self.results['min performance'] = batch['min performance'][0]
+
         return self.results
 
+    @classmethod
+    def calculate_bottlenecks_batch(cls, kernel, machine, read_streams, write_streams, misses,
+                                    evicts, cores=1):
+        '''
+        Returns performance limits of all memory levels for many predictions at once
+
+        *read_streams* and *write_streams* are the element streams between CPU and L1 (one per
+        prediction), *misses* and *evicts* arrays of cache lines per cache level (columns), one
+        row per prediction (e.g., sweep point).
+
+        Returned is a dictionary with "levels" and, with one row per prediction and one column
+        per level, "performance" (FLOP/s), "arithmetic intensity", "bandwidth", "bw kernel" and
+        "bytes transfered", as well as the "bottleneck level" and "min performance" per row.
+        '''
+        element_size = kernel.datatypes_size[kernel.datatype]
+        cacheline_size = float(machine['cacheline size'])
+        elements_per_cacheline = int(cacheline_size // element_size)
+
+        total_flops = sum(kernel._flops.values())*elements_per_cacheline
+
+        # TODO let user choose threads_per_core:
+        threads_per_core = 1
+
+        misses = numpy.array(misses, dtype=float, ndmin=2)
+        evicts = numpy.array(evicts, dtype=float, ndmin=2)
+        hierarchy = machine['memory hierarchy']
+
+        # Bytes transfered and stream counts per level, CPU-L1 first (in bytes!)
+        bytes_transfered = numpy.column_stack(
+            [numpy.array(read_streams, dtype=float)*element_size] +
+            [(misses[:, l] + evicts[:, l])*cacheline_size for l in range(len(hierarchy)-1)])
+        streams = [(numpy.array(read_streams).tolist(), numpy.array(write_streams).tolist())] + \
+            [(misses[:, l].tolist(), evicts[:, l].tolist()) for l in range(len(hierarchy)-1)]
+
+        # choose bw according to cache level and problem, once per distinct stream counts
+        bandwidths = []
+        measurement_kernels = []
+        for level, (level_read_streams, level_write_streams) in enumerate(streams):
+            bws, kernels = machine.get_bandwidths(
+                level, level_read_streams, level_write_streams, threads_per_core, cores=cores)
+            bandwidths.append(bws)
+            measurement_kernels.append(kernels)
+        bandwidth = numpy.array([[float(bw) for bw in bws] for bws in bandwidths]).T
+
+        # Calculate performance (arithmetic intensity * bandwidth with
+        # arithmetic intensity = flops / bytes transfered)
+        with numpy.errstate(divide='ignore'):
+            # bytes transfered are zero in case of full-caching
+            arith_intens = float(total_flops)/bytes_transfered
+        performance = arith_intens*bandwidth
+
+        # CPU-L1 traffic of zero means no arithmetic intensity and no bottleneck
+        l1_performance = numpy.where(bytes_transfered[:, 0] == 0, numpy.inf, performance[:, 0])
+        bottleneck_level = numpy.argmin(
+            numpy.column_stack([l1_performance, performance[:, 1:]]), axis=1)
+
+        arith_intens = arith_intens.tolist()
+        for row, row_bytes in zip(arith_intens, bytes_transfered.tolist()):
+            if row_bytes[0] == 0:
+                row[0] = None
+
+        return {'levels': [hierarchy[0]['level']] + [l['level'] for l in hierarchy[1:]],
+                'performance': performance.tolist(),
+                'arithmetic intensity': arith_intens,
+                'bandwidth': [list(r) for r in zip(*bandwidths)],
+                'bw kernel': [list(r) for r in zip(*measurement_kernels)],
+                'bytes transfered': bytes_transfered.tolist(),
+                'bottleneck level': bottleneck_level.tolist(),
+                'min performance': performance[numpy.arange(len(performance)),
+                                               bottleneck_level].tolist()}
+
     def analyze(self):
         self.calculate_cache_access()
 
@@ -248,57 +260,22 @@ class RooflineIACA(Roofline):
         Roofline.__init__(self, kernel, machine, args, parser)
 
     def analyze(self):
+        # compiler and in-core analyzer run while cache misses are predicted
+        pending_analysis = incore_model.analyze_kernel_async(
+            self.kernel, self.machine, **incore_model.analysis_options(self._args))
         self.results = self.calculate_cache_access()
-
-        # For the IACA/CPU analysis we need to compile and assemble
-        asm_name = self.kernel.compile(
-            self.machine['compiler'], compiler_args=self.machine['compiler flags'])
-        bin_name = self.kernel.assemble(
-           self.machine['compiler'], asm_name, iaca_markers=True, asm_block=self._args.asm_block,
-           asm_increment=self._args.asm_increment)
-
-        # Making sure iaca.sh is available:
-        if find_executable('iaca.sh') is None:
-            print("iaca.sh was not found. Make sure it is found in PATH.", file=sys.stderr)
-            sys.exit(1)
-
-        # Get total cycles per loop iteration
-        try:
-            cmd = ['iaca.sh', '-64', '-arch', self.machine['micro-architecture'], bin_name]
-            iaca_output = subprocess.check_output(cmd).decode('utf-8')
-        except OSError as e:
-            print("IACA execution failed:", ' '.join(cmd), file=sys.stderr)
-            print(e, file=sys.stderr)
-            sys.exit(1)
-        except subprocess.CalledProcessError as e:
-            print("IACA throughput analysis failed:", e, file=sys.stderr)
-            sys.exit(1)
-
-        match = re.search(
-            r'^Block Throughput: ([0-9\.]+) Cycles', iaca_output, re.MULTILINE)
-        assert match, "Could not find Block Throughput in IACA output."
-        block_throughput = float(match.groups()[0])
-
-        # Find ports and cyles per port
-        ports = [l for l in iaca_output.split('\n') if l.startswith('|  Port  |')]
-        cycles = [l for l in iaca_output.split('\n') if l.startswith('| Cycles |')]
-        assert ports and cycles, "Could not find ports/cylces lines in IACA output."
-        ports = [p.strip() for p in ports[0].split('|')][2:]
-        cycles = [p.strip() for p in cycles[0].split('|')][2:]
-        port_cycles = []
-        for i in range(len(ports)):
-            if '-' in ports[i] and ' ' in cycles[i]:
-                subports = [p.strip() for p in ports[i].split('-')]
-                subcycles = [c for c in cycles[i].split(' ') if bool(c)]
-                port_cycles.append((subports[0], float(subcycles[0])))
-                port_cycles.append((subports[0]+subports[1], float(subcycles[1])))
-            elif ports[i] and cycles[i]:
-                port_cycles.append((ports[i], float(cycles[i])))
-        port_cycles = dict(port_cycles)
-
-        match = re.search(r'^Total Num Of Uops: ([0-9]+)', iaca_output, re.MULTILINE)
-        assert match, "Could not find Uops in IACA output."
-        uops = float(match.groups()[0])
+        incore_analysis = pending_analysis.get()
+        block_throughput = incore_analysis['throughput']
+        port_cycles = incore_analysis['port cycles']
+        uops = incore_analysis['uops']
+
+        # Loop-carried dependencies may be slower than the throughput bound
+        incore_bound = 'throughput'
+        block_cycles = block_throughput
+        if incore_analysis['latency'] is not None and \
+                incore_analysis['latency'] > block_throughput:
+            incore_bound = 'latency'
+            block_cycles = incore_analysis['latency']
 
         # Normalize to cycles per cacheline
         elements_per_block = abs(self.kernel.asm_block['pointer_increment']
@@ -324,10 +301,14 @@ class RooflineIACA(Roofline):
                 'port cycles': port_cycles,
                 'cl throughput': cl_throughput,
                 'uops': uops,
+                'loop-carried latency': (incore_analysis['latency']*block_to_cl_ratio
+                                         if incore_analysis['latency'] is not None else None),
+                'in-core bound': incore_bound,
                 'performance throughput':
-                    self.machine['clock']/block_throughput*elements_per_block*flops_per_element
+                    self.machine['clock']/block_cycles*elements_per_block*flops_per_element
                     *self._args.cores,
-                'IACA output': iaca_output}})
+                'in-core model': self._args.incore_model,
+                self._args.incore_model+' output': incore_analysis['output']}})
         self.results['cpu bottleneck']['performance throughput'].unit = 'FLOP/s'
 
     def report(self, output_file=sys.stdout):
@@ -357,13 +338,15 @@ class RooflineIACA(Roofline):
             print('{!s}'.format(
                 {k: v
                  for k, v in list(self.results['cpu bottleneck'].items())
-                 if k not in['IACA output']}),
+                 if k not in ['IACA output', 'builtin output']}),
                 file=output_file)
 
         if float(self.results['min performance']) > float(cpu_flops):
             # CPU bound
             print('CPU bound with {} core(s)'.format(self._args.cores), file=output_file)
-            print('{!s} due to CPU bottleneck'.format(self.conv_perf(cpu_flops, self._args.unit)),
+            print('{!s} due to CPU bottleneck ({} bound)'.format(
+                      self.conv_perf(cpu_flops, self._args.unit),
+                      self.results['cpu bottleneck']['in-core bound']),
                   file=output_file)
         else:
             # Cache or mem bound
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+'''
+Machine-readable representation of analysis results
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import csv
+import json
+import math
+import numbers
+
+import six
+import sympy
+
+from .prefixedunit import PrefixedUnit
+
+
+def _number(value):
+    '''returns int or float of *value*, non-finite floats as strings ("inf", "-inf" or "nan")'''
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    value = float(value)
+    if math.isinf(value) or math.isnan(value):
+        return six.text_type(value)
+    return value
+
+
+def _key(key):
+    '''returns string representation of dictionary *key*'''
+    if isinstance(key, six.string_types):
+        return key
+    if isinstance(key, tuple) and all(isinstance(k, tuple) and len(k) == 2 for k in key):
+        # constants, as used in result storage (e.g., ((N, 1000), (M, 2000)))
+        return ','.join(['{}={}'.format(k, v) for k, v in key])
+    return six.text_type(key)
+
+
+def normalize(obj):
+    '''
+    returns JSON serializable representation of *obj*
+
+    PrefixedUnit values are converted to base units (e.g., 1.2 GB/s becomes 1.2e9), numeric sympy
+    expressions to numbers, other sympy expressions to strings, dictionary keys to strings and
+    sets and tuples to lists.
+    '''
+    if obj is None or isinstance(obj, (bool, six.string_types)):
+        return obj
+    elif isinstance(obj, PrefixedUnit):
+        return _number(obj.base_value())
+    elif isinstance(obj, dict):
+        return {_key(k): normalize(v) for k, v in obj.items()}
+    elif isinstance(obj, (set, frozenset)):
+        return sorted([normalize(o) for o in obj], key=six.text_type)
+    elif isinstance(obj, (list, tuple)):
+        return [normalize(o) for o in obj]
+    elif isinstance(obj, numbers.Number) and not isinstance(obj, sympy.Basic):
+        return _number(obj)
+    elif isinstance(obj, sympy.Basic):
+        if obj.is_Integer:
+            return int(obj)
+        elif obj.is_number and obj.is_real:
+            return _number(float(obj))
+        return six.text_type(obj)
+    return six.text_type(obj)
+
+
+def flatten(obj, prefix=''):
+    '''yields (key, value) pairs of all values in normalized *obj*, nested keys joined by "."'''
+    if isinstance(obj, dict):
+        for k in sorted(obj):
+            for item in flatten(obj[k], prefix + k + '.'):
+                yield item
+    elif isinstance(obj, list):
+        for i, o in enumerate(obj):
+            for item in flatten(o, prefix + six.text_type(i) + '.'):
+                yield item
+    else:
+        yield prefix[:-1], obj
+
+
+class JSONLinesWriter(object):
+    '''writes one JSON object per record and line'''
+    def __init__(self, output_file):
+        self.output_file = output_file
+
+    def write(self, record):
+        print(json.dumps(normalize(record), sort_keys=True), file=self.output_file)
+        self.output_file.flush()
+
+
+class CSVWriter(object):
+    '''
+    writes records as CSV, one row per result value
+
+    Rows contain kernel, machine, model, constants (formatted as "N=1000,M=2000"), the result key
+    (nested keys joined by ".", e.g., "cycles.0.1") and value. Machine parameter changes
+    (what-if) are appended to the machine in brackets (e.g., "snb.yml [clock=3 GHz]").
+    '''
+    FIELDS = ['kernel', 'machine', 'model', 'constants', 'key', 'value']
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self._writer = csv.writer(output_file, lineterminator='\n')
+        self._writer.writerow(self.FIELDS)
+
+    def write(self, record):
+        constants = ','.join(['{}={}'.format(k, v) for k, v in record['constants'].items()])
+        machine = record['machine']
+        if record.get('what-if'):
+            machine += ' [{}]'.format(
+                ','.join(['{}={}'.format(k, v) for k, v in sorted(record['what-if'].items())]))
+        for key, value in flatten(normalize(record['results'])):
+            self._writer.writerow([record['kernel'], machine, record['model'],
+                                   constants, key, value])
+        self.output_file.flush()
+
+
+WRITERS = {'jsonl': JSONLinesWriter, 'csv': CSVWriter}
+
+
+class RecordCollector(object):
+    '''keeps records in memory (e.g., to pass them on from worker processes)'''
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+def summarize(model_name, model, machine, point=''):
+    '''
+    returns summary of analyzed *model* for the comparison of machines
+
+    The summary is a dictionary of machine, point (constants), model, predicted cycles per
+    cache line ("cy/CL"), bottleneck level and the number of cores at which performance
+    saturates ("saturation", None if not predicted by the model).
+    '''
+    summary = {'machine': machine, 'point': point, 'model': model_name,
+               'cy/CL': None, 'bottleneck': None, 'saturation': None}
+    results = model.results
+    if model_name in ['ECM', 'ECMData']:
+        transfers = results['cycles']
+        data_cycles = sum([c for l, c in transfers])
+        if transfers:
+            summary['bottleneck'] = max(transfers, key=lambda t: t[1])[0]
+        summary['cy/CL'] = data_cycles
+        if model_name == 'ECM':
+            summary['cy/CL'] = max(results['T_OL'], results['T_nOL'] + data_cycles)
+            summary['saturation'] = results['scaling cores']
+            if results['T_OL'] >= results['T_nOL'] + data_cycles:
+                summary['bottleneck'] = 'CPU'
+        elif transfers and transfers[-1][1] > 0:
+            # same approach as ECM model, without in-core contributions
+            summary['saturation'] = int(math.ceil(data_cycles/transfers[-1][1]))
+        elif transfers:
+            summary['saturation'] = float('inf')
+    elif model_name == 'ECMCPU':
+        summary['cy/CL'] = max(results['T_OL'], results['T_nOL'])
+        summary['bottleneck'] = 'CPU'
+    elif model_name in ['Roofline', 'RooflineIACA']:
+        if model_name == 'Roofline':
+            precision = 'DP' if model.kernel.datatype == 'double' else 'SP'
+            cpu_flops = float(model.machine['clock'])*model._args.cores * \
+                model.machine['FLOPs per cycle'][precision]['total']
+        else:
+            cpu_flops = float(results['cpu bottleneck']['performance throughput'])
+        if float(results['min performance']) > cpu_flops:
+            performance = cpu_flops
+            summary['bottleneck'] = 'CPU'
+        else:
+            performance = float(results['min performance'])
+            # CPU-L1 entry is replaced by in-core analysis in RooflineIACA
+            bottleneck = results['mem bottlenecks'][results['bottleneck level']]
+            summary['bottleneck'] = bottleneck['level'] if bottleneck else 'L1'
+        summary['cy/CL'] = float(model.conv_perf(PrefixedUnit(performance, 'FLOP/s'), 'cy/CL'))
+    return summary
+
+
+def print_comparison(summaries, output_file):
+    '''prints side-by-side table of *summaries* (see summarize()), one block per point and model'''
+    print('{:=^80}'.format(' comparison of machines '), file=output_file)
+    blocks = []
+    for s in summaries:
+        if (s['point'], s['model']) not in blocks:
+            blocks.append((s['point'], s['model']))
+    for point, model_name in blocks:
+        print('{:-^80}'.format(' {} {} '.format(model_name, point).replace('  ', ' ')),
+              file=output_file)
+        print('{:<40} {:>12} {:>12} {:>12}'.format(
+            'machine', 'cy/CL', 'bottleneck', 'saturation'), file=output_file)
+        for s in summaries:
+            if (s['point'], s['model']) != (point, model_name):
+                continue
+            print('{:<40} {:>12} {:>12} {:>12}'.format(
+                s['machine'],
+                '{:.2f}'.format(s['cy/CL']) if s['cy/CL'] is not None else '-',
+                s['bottleneck'] or '-',
+                s['saturation'] if s['saturation'] is not None else '-'), file=output_file)
+    print('', file=output_file)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+'''
+Timing instrumentation of analysis phases (kerncraft --profile)
+
+Phases are marked in code with::
+
+    with profiling.phase('compile'):
+        ...
+
+or by decorating functions with @profiling.profiled('compile'). Both are no-ops unless a profiler
+was enabled (see profile()).
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+import functools
+import cProfile
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def cpu_time():
+    '''returns user and system CPU time of process in seconds'''
+    t = os.times()
+    return t[0] + t[1]
+
+
+def max_rss():
+    '''returns peak resident set size of process in MB (None if unknown)'''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on OS X
+    if sys.platform == 'darwin':
+        return rss/1024**2
+    return rss/1024
+
+
+class Profiler(object):
+    '''Records wall time, CPU time and peak memory of phases, per sweep point'''
+    def __init__(self):
+        self.records = []
+        self.point = None
+        self._start = timer()
+
+    def set_point(self, point):
+        '''sets sweep *point* (e.g., constants and model) of following phases'''
+        self.point = point
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start, start_cpu, point = timer(), cpu_time(), self.point
+        try:
+            yield
+        finally:
+            self.records.append({
+                'phase': name, 'point': point, 'start': start - self._start,
+                'wall': timer() - start, 'cpu': cpu_time() - start_cpu, 'max rss': max_rss(),
+                'thread': threading.current_thread().ident})
+
+    def point_times(self, point):
+        '''returns dictionary of accumulated wall times per phase of *point*'''
+        times = OrderedDict()
+        for r in self.records:
+            if r['point'] == point:
+                times[r['phase']] = times.get(r['phase'], 0.0) + r['wall']
+        return times
+
+    def summary(self):
+        '''returns table of accumulated times per phase'''
+        phases = OrderedDict()
+        for r in self.records:
+            p = phases.setdefault(r['phase'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                                               'max rss': None})
+            p['calls'] += 1
+            p['wall'] += r['wall']
+            p['cpu'] += r['cpu']
+            p['max rss'] = r['max rss']
+
+        s = '{:-^80}\n'.format(' profile ')
+        s += '{:<24}{:>8}{:>16}{:>16}{:>16}\n'.format(
+            'phase', 'calls', 'wall [s]', 'CPU [s]', 'max RSS [MB]')
+        for name, p in phases.items():
+            s += '{:<24}{:>8}{:>16.4f}{:>16.4f}{:>16}\n'.format(
+                name, p['calls'], p['wall'], p['cpu'],
+                '{:.1f}'.format(p['max rss']) if p['max rss'] is not None else '-')
+        s += 'Total wall time: {:.4f} s\n'.format(timer() - self._start)
+        return s
+
+    def chrome_trace(self):
+        '''returns records in Chrome trace event format (load with chrome://tracing)'''
+        return {'traceEvents': [
+            {'name': r['phase'], 'cat': 'kerncraft', 'ph': 'X', 'pid': os.getpid(),
+             'tid': r['thread'], 'ts': r['start']*1e6, 'dur': r['wall']*1e6,
+             'args': {'point': r['point'], 'cpu': r['cpu'], 'max rss': r['max rss']}}
+            for r in self.records]}
+
+
+# Active profiler
+_profiler = None
+
+
+def get_profiler():
+    '''returns active profiler or None'''
+    return _profiler
+
+
+@contextlib.contextmanager
+def _no_phase():
+    yield
+
+
+def phase(name):
+    '''returns context manager recording phase *name* with the active profiler (if any)'''
+    if _profiler is None:
+        return _no_phase()
+    return _profiler.phase(name)
+
+
+def profiled(name):
+    '''decorator recording calls of function as phase *name*'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_point(point):
+    '''sets sweep *point* of the active profiler (if any)'''
+    if _profiler is not None:
+        _profiler.set_point(point)
+
+
+@contextlib.contextmanager
+def profile(output=None):
+    '''
+    enables profiling within context and yields Profiler
+
+    If *output* is given, a Chrome trace (if it ends with .json) or cProfile statistics (to be
+    read with pstats, otherwise) is written to that path.
+    '''
+    global _profiler
+    _profiler = profiler = Profiler()
+    cprofile = None
+    if output and not output.endswith('.json'):
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+    try:
+        yield profiler
+    finally:
+        _profiler = None
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(output)
+        elif output:
+            with open(output, 'w') as f:
+                json.dump(profiler.chrome_trace(), f)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+'''
+Long-running analysis server (kerncraft serve)
+
+Keeps parsed machine descriptions, C parsers, kernels and in-core analyses in memory and answers
+analysis requests with JSON over HTTP, either on localhost or on a UNIX socket.
+
+Endpoints:
+    GET /status    returns server information (cached machines and kernels)
+    POST /analyze  analyzes a kernel, the request body is a JSON object:
+        {"code": "<kernel C code>",
+         "machine": "<path to machine description yaml file>",
+         "pmodel": ["ECMData", ...],
+         "define": {"N": 1000, ...},         (optional)
+         "tile": [["j", 100], ...],           (optional)
+         "args": ["--cache-predictor=LC"]}    (optional, model options: --cache-predictor,
+                                              --cores, --unit, --incore-model, --asm-block,
+                                              --asm-increment and --verbose)
+        the response contains normalized results and textual reports per model:
+        {"results": {"ECMData": {...}}, "reports": {"ECMData": "..."}, "time": 0.05}
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import six
+from six.moves import BaseHTTPServer, socketserver
+
+from . import models
+from .api import analyze_many, create_options
+from .kernel import KernelCode, get_c_parser
+from .machinemodel import MachineModel
+from .output import normalize
+from .pycparser import clean_code
+
+
+# Number of parsed kernels kept by default, least recently used ones are dropped first
+KERNELS_LIMIT = 64
+
+
+class RequestError(Exception):
+    '''invalid analysis request'''
+    pass
+
+
+def create_request_parser():
+    '''
+    returns parser of "args" in requests
+
+    Only options of models are accepted, options which write files (e.g., --store) or start
+    processes (--jobs) are not.
+    '''
+    parser = argparse.ArgumentParser(prog='kerncraft serve request', add_help=False,
+                                     argument_default=argparse.SUPPRESS)
+    parser.add_argument('--cache-predictor', '-P', choices=['LC', 'SIM', 'AN'])
+    parser.add_argument('--cores', '-c', type=int)
+    parser.add_argument('--unit', '-u', choices=['cy/CL', 'cy/It', 'It/s', 'FLOP/s'])
+    parser.add_argument('--incore-model', choices=['IACA', 'builtin'])
+    parser.add_argument('--asm-block')
+    parser.add_argument('--asm-increment', type=int)
+    parser.add_argument('--verbose', '-v', action='count')
+    return parser
+
+
+class AnalysisServer(object):
+    '''
+    Analysis state shared by all requests: machine and kernel caches
+
+    At most *max_kernels* parsed kernels are kept, as they are keyed on code sent by clients.
+    '''
+    def __init__(self, verbose=0, max_kernels=KERNELS_LIMIT):
+        self.verbose = verbose
+        self.max_kernels = max_kernels
+        self.parser = create_request_parser()
+        self._machines = {}
+        self._kernels = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_machine(self, path):
+        '''returns MachineModel of *path*, reloaded if the file was modified'''
+        path = os.path.abspath(path)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            raise RequestError('machine file {} not found'.format(path))
+        with self._lock:
+            cached = self._machines.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        machine = MachineModel(path)
+        with self._lock:
+            self._machines[path] = (mtime, machine)
+        return machine
+
+    def get_kernel(self, code):
+        '''returns KernelCode of *code* and a lock which must be held while using it'''
+        with self._lock:
+            cached = self._kernels.pop(code, None)
+            if cached is not None:
+                self._kernels[code] = cached
+                return cached
+        kernel = KernelCode(clean_code(code))
+        with self._lock:
+            cached = self._kernels.setdefault(code, (kernel, threading.Lock()))
+            while len(self._kernels) > self.max_kernels:
+                self._kernels.popitem(last=False)
+            return cached
+
+    def check_tiling(self, kernel, tile):
+        '''raises RequestError if *tile* can not be applied to *kernel* (see set_tiling())'''
+        steps = {l['index']: l['increment'] for l in kernel.get_loop_stack()}
+        for index, size in tile:
+            if index not in steps:
+                raise RequestError('tile index {} is not a loop counter of the kernel ({})'.format(
+                    index, ', '.join(sorted(steps))))
+            if size <= 0 or size % steps[index] != 0:
+                raise RequestError('tile size of {} needs to be a positive multiple of {}'.format(
+                    index, steps[index]))
+
+    def parse_args(self, request):
+        '''returns command line arguments corresponding to *request*'''
+        pmodel = request.get('pmodel')
+        if isinstance(pmodel, six.string_types):
+            pmodel = [pmodel]
+        if not pmodel or any(m not in models.__all__ for m in pmodel):
+            raise RequestError('pmodel needs to be a list of: ' + ', '.join(models.__all__))
+        argv = [six.text_type(a) for a in request.get('args', [])]
+
+        # argparse reports errors on stderr and exits
+        try:
+            options = vars(self.parser.parse_args(argv))
+            args = create_options(options, pmodel)
+        except SystemExit:
+            raise RequestError('invalid arguments: ' + ' '.join(argv))
+
+        try:
+            args.define = [(six.text_type(k), int(v))
+                           for k, v in sorted(request.get('define', {}).items())]
+            args.tile = [(six.text_type(i), int(s)) for i, s in request.get('tile', [])]
+        except (AttributeError, TypeError, ValueError):
+            raise RequestError('define needs to map names to integers and tile needs to be a '
+                               'list of index and size pairs')
+        return args
+
+    def analyze(self, request):
+        '''analyzes *request* (as decoded from JSON) and returns the response'''
+        start = time.time()
+        for key in ['code', 'machine']:
+            if not isinstance(request.get(key), six.string_types):
+                raise RequestError('{} needs to be given as string'.format(key))
+        args = self.parse_args(request)
+        machine = self.get_machine(request['machine'])
+        kernel, lock = self.get_kernel(request['code'])
+        self.check_tiling(kernel, args.tile)
+
+        response = {'results': {}, 'reports': {}}
+        with lock:
+            for result in analyze_many(kernel, machine, args.pmodel, [args.define], args,
+                                       report=True):
+                response['results'][result['model']] = normalize(result['results'])
+                response['reports'][result['model']] = result['report']
+        response['time'] = time.time() - start
+        return response
+
+    def status(self):
+        with self._lock:
+            return {'machines': sorted(self._machines),
+                    'kernels': len(self._kernels)}
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    server_version = 'kerncraft'
+
+    def address_string(self):
+        # UNIX socket clients have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'local'
+
+    def log_message(self, format, *args):
+        if self.server.analysis.verbose > 0:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            self.send_json(self.server.analysis.status())
+        else:
+            self.send_json({'error': 'unknown path {}'.format(self.path)}, status=404)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/analyze':
+            self.send_json({'error': 'unknown path {}'.format(self.path)}, status=404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(request, dict):
+                raise RequestError('request needs to be a JSON object')
+            self.send_json(self.server.analysis.analyze(request))
+        except (RequestError, ValueError) as e:
+            self.send_json({'error': six.text_type(e)}, status=400)
+        except (Exception, SystemExit) as e:
+            # models exit on unsupported kernels or machines
+            self.send_json({'error': '{}: {}'.format(type(e).__name__, e)}, status=500)
+
+
+class PooledMixIn(socketserver.ThreadingMixIn):
+    '''handles requests concurrently on a fixed pool of worker threads'''
+    def process_request(self, request, client_address):
+        self.pool.apply_async(self.process_request_thread, (request, client_address))
+
+
+class HTTPServer(PooledMixIn, BaseHTTPServer.HTTPServer):
+    pass
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class UnixHTTPServer(PooledMixIn, socketserver.UnixStreamServer):
+        pass
+
+
+def create_server(host='localhost', port=0, socket=None, workers=4, verbose=0):
+    '''
+    returns server listening on *host*:*port* or on UNIX *socket* (if given)
+
+    Requests are served by *workers* threads, call serve_forever() to start serving.
+    '''
+    if socket:
+        if os.path.exists(socket):
+            os.remove(socket)
+        server = UnixHTTPServer(socket, RequestHandler)
+    else:
+        server = HTTPServer((host, port), RequestHandler)
+    server.analysis = AnalysisServer(verbose=verbose)
+    # warm up parsers of all worker threads
+    server.pool = ThreadPool(workers, initializer=get_c_parser)
+    return server
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='kerncraft serve',
+                                     description='Serve kernel analysis requests (JSON over HTTP).')
+    parser.add_argument('--host', default='localhost',
+                        help='Host name or address to listen on (default: localhost).')
+    parser.add_argument('--port', type=int, default=4242,
+                        help='TCP port to listen on (default: 4242).')
+    parser.add_argument('--socket', metavar='PATH',
+                        help='Listen on UNIX socket PATH instead of TCP.')
+    parser.add_argument('--workers', '-j', type=int, default=4,
+                        help='Number of requests processed concurrently (default: 4).')
+    parser.add_argument('--verbose', '-v', action='count', default=0,
+                        help='Increases verbosity level (logs requests).')
+    return parser
+
+
+def main(argv=None):
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error('--workers needs to be at least 1')
+
+    server = create_server(args.host, args.port, args.socket, args.workers, args.verbose)
+    print('kerncraft serving on {}'.format(
+        args.socket or 'http://{}:{}'.format(*server.server_address[:2])), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.terminate()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,21 @@ suite = unittest.TestLoader().loadTestsFromNames(
         'test_kerncraft',
         'test_intervals',
         'test_kernel',
-        'test_layer_condition'
+        'test_layer_condition',
+        'test_cachetile',
+        'test_likwid_bench_auto',
+        'test_iaca_marker',
+        'test_incore_model',
+        'test_output',
+        'test_server',
+        'test_api',
+        'test_profiling',
+        'test_testcases',
+        'test_affine',
+        'test_cacheprediction',
+        'test_footprint',
+        'test_models',
+        'test_corpus'
     ]
 )
 
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+'''
+Runs the cases of all .testcases files (by default in examples/kernels) in parallel.
+
+A .testcases file accompanies a kernel (e.g., 2d-5pt.testcases for 2d-5pt.c) and contains a list
+of cases, each with constants and optionally expected results:
+
+    [{'constants': [('N', 2000), ('M', 62500)],
+      'results-to-compare': {'L1-L2': 10, 'L2-L3': 6, 'L3-MEM': 13}}]
+
+Every case is analyzed with all given models, cache predictors and machines, in a process pool.
+Expected results are compared to the model's results (only those it provides) with tolerances.
+Exits with status 1 if any case failed.
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import glob
+import time
+import argparse
+import multiprocessing
+
+sys.path[0:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')]
+
+from kerncraft import models
+from kerncraft import corpus
+from kerncraft.api import create_options
+
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+# Models which make use of a cache predictor
+PREDICTOR_MODELS = ['ECM', 'ECMData', 'Roofline', 'RooflineIACA']
+
+
+def discover(paths):
+    '''returns sorted list of .testcases files in *paths* (files or directories)'''
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files += glob.glob(os.path.join(p, '*.testcases'))
+        else:
+            files.append(p)
+    return sorted(files)
+
+
+def collect_cases(testcase_files, machines, model_names, predictors):
+    '''
+    returns list of cases, one per testcase, machine, model and predictor
+
+    Cases are work items of kerncraft corpus (see corpus.collect_items()), with additional
+    "index", "expected" and "predictor".
+    '''
+    cases = []
+    for path in testcase_files:
+        kernel_file = os.path.splitext(path)[0] + '.c'
+        for index, testcase in enumerate(corpus.load_testcases(kernel_file)):
+            for machine in machines:
+                for model in model_names:
+                    for predictor in (predictors if model in PREDICTOR_MODELS else [None]):
+                        cases.append({'kernel': kernel_file,
+                                      'index': index,
+                                      'constants': dict(testcase['constants']),
+                                      'expected': testcase.get('results-to-compare', {}),
+                                      'machine': machine,
+                                      'model': model,
+                                      'predictor': predictor,
+                                      'options': ({'cache_predictor': predictor}
+                                                  if predictor else {})})
+    return cases
+
+
+def compare(expected, results, atol=0.5, rtol=0.05):
+    '''
+    returns dictionary of deviations (key: (expected, actual)) and list of keys not in *results*
+
+    Values deviate if they differ by more than atol + rtol*abs(expected).
+    '''
+    deviations = {}
+    missing = []
+    for key, value in sorted(expected.items()):
+        if key not in results:
+            missing.append(key)
+            continue
+        actual = float(results[key])
+        if abs(actual - value) > atol + rtol*abs(value):
+            deviations[key] = (value, actual)
+    return deviations, missing
+
+
+def check_case(case, atol=0.5, rtol=0.05):
+    '''
+    sets "status" of analyzed *case* to passed, failed (results deviate) or ran (nothing to
+    compare) and adds "deviations", errors and skipped cases are left unchanged
+    '''
+    if case['status'] != 'ok':
+        return
+    case['deviations'], case['missing'] = compare(case['expected'], case['results'], atol, rtol)
+    if case['deviations']:
+        case['status'] = 'failed'
+    elif len(case['missing']) < len(case['expected']):
+        case['status'] = 'passed'
+    else:
+        # nothing to compare with this model
+        case['status'] = 'ran'
+
+
+def run(cases, jobs=None, atol=0.5, rtol=0.05, callback=None):
+    '''runs *cases* on *jobs* processes and returns them with results, in order of completion'''
+    finished = []
+    for case in cases:
+        if not os.path.exists(case['kernel']):
+            # kernel not (yet) available
+            case = dict(case, status='skipped', time=0.0)
+            finished.append(case)
+            if callback:
+                callback(case)
+    cases = [c for c in cases if os.path.exists(c['kernel'])]
+    if not cases:
+        return finished
+
+    def report(case):
+        check_case(case, atol, rtol)
+        if callback:
+            callback(case)
+
+    args = create_options({}, sorted(set([c['model'] for c in cases])))
+    jobs = min(jobs or multiprocessing.cpu_count(), len(cases))
+    return finished + corpus.run(cases, args, jobs, callback=report)
+
+
+def format_case(case):
+    return '{:<7} {:>8.2f} s  {} #{} {} {}{} {}'.format(
+        case['status'], case['time'], os.path.basename(case['kernel']), case['index'],
+        corpus.format_constants(case['constants']),
+        case['model'], '/'+case['predictor'] if case['predictor'] else '',
+        os.path.basename(case['machine']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', metavar='PATH',
+                        default=[os.path.join(EXAMPLES_DIR, 'kernels')],
+                        help='.testcases files or directories containing them (default: '
+                             'examples/kernels).')
+    parser.add_argument('--machine', '-m', action='append', dest='machines',
+                        help='Machine description (default: examples/machine-files/'
+                             'phinally.yaml). May be given multiple times.')
+    parser.add_argument('--pmodel', '-p', action='append', dest='models',
+                        choices=models.__all__,
+                        help='Performance model (default: ECMData). May be given multiple times.')
+    parser.add_argument('--cache-predictor', '-P', nargs='+', choices=['LC', 'SIM', 'AN'],
+                        default=['LC', 'SIM'], dest='predictors',
+                        help='Cache predictors (default: LC SIM).')
+    parser.add_argument('--jobs', '-j', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of processes (default: number of CPUs).')
+    parser.add_argument('--atol', type=float, default=0.5,
+                        help='Absolute tolerance (default: 0.5).')
+    parser.add_argument('--rtol', type=float, default=0.05,
+                        help='Relative tolerance (default: 0.05).')
+    parser.add_argument('--verbose', '-v', action='count', default=0,
+                        help='Print deviations and errors.')
+    args = parser.parse_args()
+
+    machines = args.machines or [os.path.join(EXAMPLES_DIR, 'machine-files', 'phinally.yaml')]
+    cases = collect_cases(discover(args.paths), machines, args.models or ['ECMData'],
+                          args.predictors)
+
+    def report(case):
+        print(format_case(case))
+        if args.verbose > 0:
+            for key, (expected, actual) in sorted(case.get('deviations', {}).items()):
+                print('        {}: expected {}, got {:.2f}'.format(key, expected, actual))
+            if 'error' in case:
+                print('        ' + case['error'])
+        sys.stdout.flush()
+
+    start = time.time()
+    finished = run(cases, args.jobs, args.atol, args.rtol, callback=report)
+    statuses = [c['status'] for c in finished]
+    print('{} cases in {:.1f} s ({:.1f} s in cases): {}'.format(
+        len(finished), time.time() - start, sum([c['time'] for c in finished]),
+        ', '.join(['{} {}'.format(statuses.count(s), s)
+                   for s in ['passed', 'failed', 'error', 'ran', 'skipped'] if s in statuses])))
+    if 'failed' in statuses or 'error' in statuses:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
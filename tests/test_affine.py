@@ -0,0 +1,104 @@
+'''
+Unit tests for affine module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import unittest
+
+import sympy
+import numpy
+
+sys.path.insert(0, '..')
+from kerncraft.affine import AffineExpression, evaluate_many
+from kerncraft.kernel import KernelCode
+
+
+class TestAffine(unittest.TestCase):
+    def setUp(self):
+        self.i, self.j, self.N, self.M = [sympy.Symbol(s, positive=True) for s in 'ijNM']
+
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def test_from_sympy(self):
+        i, j, N = self.i, self.j, self.N
+        a = AffineExpression.from_sympy((j+1)*N + i - 1, [j, i])
+        self.assertEqual(a.coefficients, {'j': N, 'i': 1})
+        self.assertEqual(a.constant, N - 1)
+        self.assertFalse(a.is_numeric)
+        self.assertEqual(sympy.expand(a.to_sympy() - ((j+1)*N + i - 1)), 0)
+
+        c = AffineExpression.from_sympy(sympy.Integer(3), [j, i])
+        self.assertTrue(c.is_constant)
+        self.assertEqual(c.constant, 3)
+        self.assertIsInstance(c.constant, int)
+
+        with self.assertRaises(ValueError):
+            AffineExpression.from_sympy(i*j, [j, i])
+
+    def test_arithmetic(self):
+        i, j, N = self.i, self.j, self.N
+        a = AffineExpression.from_sympy(j*N + i + 1, [j, i])
+        b = AffineExpression.from_sympy(j*N + i - 1, [j, i])
+        self.assertEqual(a - b, 2)
+        self.assertEqual((a - b).to_sympy(), sympy.Integer(2))
+        self.assertEqual(a - a, AffineExpression())
+        self.assertEqual((a*8 + 16).coefficients, {'j': 8*N, 'i': 8})
+        self.assertEqual((-a).constant, -1)
+        self.assertEqual((a + b).to_sympy(), 2*j*N + 2*i)
+
+    def test_subs_and_ordering(self):
+        i, j, N = self.i, self.j, self.N
+        accesses = [AffineExpression.from_sympy(e, [j, i]).subs({N: 100})
+                    for e in [j*N + i, (j-1)*N + i, j*N + i + 1, (j+1)*N + i]]
+        self.assertTrue(all([a.is_numeric for a in accesses]))
+        self.assertEqual([a.constant for a in sorted(accesses, reverse=True)],
+                         [100, 1, 0, -100])
+        self.assertTrue(accesses[2] > accesses[0])
+        with self.assertRaises(TypeError):
+            AffineExpression({'i': 1}) < AffineExpression({'j': 1})
+
+    def test_evaluate(self):
+        a = AffineExpression({'j': 100, 'i': 1}, 5)
+        b = AffineExpression(constant=7)
+        indices = {'j': numpy.array([1, 1, 2]), 'i': numpy.array([1, 2, 1])}
+        self.assertEqual(list(a.evaluate(indices)), [106, 107, 206])
+        self.assertEqual(evaluate_many([a, b], indices).tolist(),
+                         [[106, 107, 206], [7, 7, 7]])
+        self.assertEqual(evaluate_many([], indices).shape, (0, 3))
+
+    def test_kernel_relative_distances(self):
+        with open(self._find_file('3d-7pt.c')) as f:
+            kernel = KernelCode(f.read())
+        distances = kernel.compile_relative_distances()
+        accesses = kernel.compile_sympy_accesses()
+        for var_name, d in distances.items():
+            expected = [accesses[var_name][k-1] - accesses[var_name][k]
+                        for k in range(1, len(accesses[var_name]))]
+            self.assertEqual([sympy.expand(e - r) for e, r in zip(expected, d)],
+                             [0]*len(expected))
+
+    def test_kernel_global_iterator(self):
+        with open(self._find_file('2d-5pt.c')) as f:
+            kernel = KernelCode(f.read())
+        # symbolic fallback without constants
+        symbolic = kernel.global_iterator_to_indices()
+        self.assertEqual(len(symbolic), 2)
+
+        kernel.set_constant('N', 50)
+        kernel.set_constant('M', 20)
+        j, i = kernel.index_symbols()
+        counters = kernel.global_iterator_to_indices()
+        self.assertEqual(list(counters[i](numpy.array([0, 1, 47, 48]))), [1, 2, 48, 1])
+        self.assertEqual(list(counters[j](numpy.array([0, 1, 47, 48]))), [1, 1, 1, 2])
+        indices = kernel.global_iterator_to_indices(48)
+        self.assertEqual(indices, {j: 2, i: 1})
+        self.assertEqual(kernel.indices_to_global_iterator(indices), 48)
@@ -0,0 +1,110 @@
+'''
+Tests for the programmatic interface (kerncraft.analyze_many)
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import unittest
+
+sys.path.insert(0, '..')
+import kerncraft
+from kerncraft import api
+from kerncraft.kernel import KernelCode
+from kerncraft.machinemodel import MachineModel
+
+
+def _setup_counter(start):
+    return {'count': start}
+
+
+def _setup_worker_other(name):
+    return {'name': name}
+
+
+def _count(_):
+    state = api.worker_state(_setup_counter)
+    state['count'] += 1
+    return os.getpid(), state['count']
+
+
+class TestAPI(unittest.TestCase):
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def setUp(self):
+        with open(self._find_file('2d-5pt.c')) as f:
+            self.code = f.read()
+        self.machine = self._find_file('phinally_gcc.yaml')
+
+    def test_create_options(self):
+        args = api.create_options({'cache_predictor': 'LC', 'asm_block': '1'}, ['ECM'])
+        self.assertEqual(args.cache_predictor, 'LC')
+        self.assertEqual(args.asm_block, 1)
+        self.assertEqual(args.cores, 1)
+        self.assertEqual(args.pmodel, ['ECM'])
+        self.assertIs(api.create_options(args), args)
+        with self.assertRaises(ValueError):
+            api.create_options({'no_such_option': 1})
+
+    def test_analyze_many(self):
+        constants = [{'N': 2000, 'M': 1000}, [('N', 100), ('M', 100)]]
+        results = list(kerncraft.analyze_many(
+            self.code, self.machine, ['ECMData', 'Roofline'], constants,
+            {'cache_predictor': 'LC'}))
+        self.assertEqual([(r['model'], r['constants']) for r in results],
+                         [('ECMData', {'N': 2000, 'M': 1000}),
+                          ('Roofline', {'N': 2000, 'M': 1000}),
+                          ('ECMData', {'N': 100, 'M': 100}),
+                          ('Roofline', {'N': 100, 'M': 100})])
+        ecmd = results[0]['results']
+        self.assertAlmostEqual(ecmd['L1-L2'], 10, places=1)
+        self.assertAlmostEqual(ecmd['L2-L3'], 6, places=1)
+        self.assertAlmostEqual(ecmd['L3-MEM'], 13, places=0)
+        self.assertNotIn('report', results[0])
+
+        # kernel and machine objects are reused
+        kernel = KernelCode(self.code)
+        machine = MachineModel(self.machine)
+        results = list(api.analyze_many(kernel, machine, 'ECMData', constants[:1],
+                                        {'cache_predictor': 'LC'}, report=True))
+        self.assertEqual(results[0]['results']['L3-MEM'], ecmd['L3-MEM'])
+        self.assertIn('L1-L2', results[0]['report'])
+        # constants remain set on given kernel
+        self.assertEqual(sorted(map(str, kernel.constants.items())), ['(M, 1000)', '(N, 2000)'])
+
+        with self.assertRaises(ValueError):
+            api.analyze_many(self.code, self.machine, ['NoSuchModel'], constants)
+
+    def test_analyze_many_processes(self):
+        constants = [{'N': n, 'M': 1000} for n in [100, 1000, 2000, 4000]]
+        serial = list(api.analyze_many(self.code, self.machine, 'ECMData', constants,
+                                       {'cache_predictor': 'LC'}))
+        parallel = list(api.analyze_many(self.code, MachineModel(self.machine), 'ECMData',
+                                         constants, {'cache_predictor': 'LC'}, processes=2))
+        self.assertEqual([r['constants'] for r in parallel], constants)
+        self.assertEqual([r['results']['cycles'] for r in parallel],
+                         [r['results']['cycles'] for r in serial])
+
+    def test_worker_pool(self):
+        # every process is set up once and keeps its state
+        pool = api.create_pool(2, _setup_counter, 10)
+        try:
+            counts = pool.map(_count, range(20), chunksize=1)
+        finally:
+            pool.terminate()
+        for pid in set([pid for pid, count in counts]):
+            self.assertEqual(sorted([c for p, c in counts if p == pid]),
+                             list(range(11, 11 + len([p for p, c in counts if p == pid]))))
+
+        # in this process, states of different setups do not interfere
+        api.init_worker(_setup_counter, 0)
+        api.init_worker(_setup_worker_other, 'other')
+        self.assertEqual(_count(None)[1], 1)
+        self.assertEqual(api.worker_state(_setup_worker_other), {'name': 'other'})
@@ -0,0 +1,80 @@
+'''
+Tests for the cachetile module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import unittest
+from io import StringIO
+
+import six
+
+sys.path.insert(0, '..')
+from kerncraft import cachetile
+
+
+class TestCachetile(unittest.TestCase):
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def test_pareto_sets(self):
+        evaluated = [
+            ({'N': 100, 'M': 100}, [('L1-L2', 6.0), ('L2-L3', 6.0)]),
+            ({'N': 200, 'M': 100}, [('L1-L2', 6.0), ('L2-L3', 6.0)]),
+            ({'N': 100, 'M': 300}, [('L1-L2', 6.0), ('L2-L3', 6.0)]),
+            ({'N': 400, 'M': 100}, [('L1-L2', 10.0), ('L2-L3', 6.0)]),
+            ({'N': 800, 'M': 800}, [('L1-L2', 10.0), ('L2-L3', 10.0)])]
+        pareto = cachetile.pareto_sets(evaluated)
+
+        self.assertEqual([p[0] for p in pareto], ['L1-L2', 'L2-L3'])
+        self.assertEqual(pareto[0][1], 6.0)
+        six.assertCountEqual(self, pareto[0][2], [{'N': 200, 'M': 100}, {'N': 100, 'M': 300}])
+        six.assertCountEqual(self, pareto[1][2], [{'N': 400, 'M': 100}, {'N': 100, 'M': 300}])
+
+    def test_2d5pt_LC(self):
+        parser = cachetile.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-D', 'M', '1000',
+                                  '-P', 'LC',
+                                  self._find_file('2d-5pt.yml')])
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            best = cachetile.run(parser, args)
+        finally:
+            sys.stdout = stdout
+
+        # 2D layer condition in 32kB L1 cache is fulfilled up to N=1024
+        self.assertEqual([str(c) for c in best], ['N'])
+        self.assertEqual(list(best.values()), [1024])
+
+    def test_2d5pt_analytic(self):
+        parser = cachetile.create_parser()
+        for safety_factor, cache_level, length in [('1.0', 'L1', 1024),
+                                                   ('0.5', 'L1', 512),
+                                                   ('0.5', 'L2', 4096)]:
+            args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                      '-D', 'M', '1000',
+                                      '--analytic',
+                                      '--safety-factor', safety_factor,
+                                      '--cache-level', cache_level,
+                                      self._find_file('2d-5pt.yml')])
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                best = cachetile.run(parser, args)
+            finally:
+                sys.stdout = stdout
+
+            self.assertEqual(list(best.values()), [length])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+'''
+Tests for corpus mode (kerncraft corpus)
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import unittest
+import tempfile
+import shutil
+import pickle
+from io import StringIO
+
+import sympy
+
+sys.path.insert(0, '..')
+from kerncraft import corpus
+
+
+class TestCorpus(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        for name in ['2d-5pt.c', 'copy.c', '3d-7pt.c']:
+            shutil.copy(self._find_file(name), self.temp_dir)
+        with open(os.path.join(self.temp_dir, '2d-5pt.testcases'), 'w') as f:
+            f.write("[{'constants': [('N', 1000), ('M', 500)]},\n"
+                    " {'constants': [('N', 4000), ('M', 100)]}]\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def test_collect_items(self):
+        kernels = corpus.discover_kernels([self.temp_dir])
+        self.assertEqual([os.path.basename(k) for k in kernels],
+                         ['2d-5pt.c', '3d-7pt.c', 'copy.c'])
+        self.assertEqual(corpus.discover_kernels([os.path.join(self.temp_dir, '*d-*.c')]),
+                         kernels[:2])
+
+        items = corpus.collect_items(kernels, ['m.yml'], ['ECMData', 'Roofline'],
+                                     [('N', [10, 20])])
+        # 2d-5pt from .testcases, 3d-7pt and copy with all defines
+        self.assertEqual(len(items), 2*2 + 2*2 + 2*2)
+        self.assertEqual(items[0], {'kernel': kernels[0], 'constants': {'N': 1000, 'M': 500},
+                                    'model': 'ECMData', 'machine': 'm.yml'})
+        self.assertEqual(items[-1]['constants'], {'N': 20})
+
+        # kernels without constants are skipped
+        items = corpus.collect_items(kernels, ['m.yml'], ['ECMData'])
+        self.assertEqual([i['constants'] for i in items],
+                         [{'N': 1000, 'M': 500}, {'N': 4000, 'M': 100}, None, None])
+
+    def test_run(self):
+        store_file = os.path.join(self.temp_dir, 'corpus.pickle')
+        outputs = []
+        for jobs in ['1', '2']:
+            output_stream = StringIO()
+            corpus.main([os.path.join(self.temp_dir, '2d-5pt.c'),
+                         os.path.join(self.temp_dir, 'copy.c'),
+                         '-m', self._find_file('phinally_gcc.yaml'),
+                         '-p', 'ECMData', '-P', 'LC', '-D', 'N', '100000',
+                         '-j', jobs, '--store', store_file], output_stream)
+            # status and item, without time (in order of completion)
+            lines = output_stream.getvalue().splitlines()[:-1]
+            outputs.append(sorted([l.split()[:1] + l.split()[3:] for l in lines]))
+
+        # same items, same predictions
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual([l[0] for l in outputs[0]], ['ok']*3)
+
+        results = pickle.load(open(store_file, 'rb'))
+        self.assertEqual(sorted(results), ['2d-5pt.c', 'copy.c'])
+        self.assertEqual(len(results['2d-5pt.c']), 2)
+        ecmd = results['copy.c'][((sympy.var('N'), 100000),)]['ECMData']
+        self.assertEqual([l for l, c in ecmd['cycles']], ['L1-L2', 'L2-L3', 'L3-MEM'])
+
+    def test_store_per_item(self):
+        store_file = os.path.join(self.temp_dir, 'corpus.pickle')
+        stored = []
+
+        class Output(StringIO):
+            def flush(self):
+                # results are stored before they are reported
+                stored.append(len(pickle.load(open(store_file, 'rb'))['2d-5pt.c']))
+
+        corpus.main([os.path.join(self.temp_dir, '2d-5pt.c'),
+                     '-m', self._find_file('phinally_gcc.yaml'),
+                     '-p', 'ECMData', '-P', 'LC', '-j', '1', '--store', store_file], Output())
+        self.assertEqual(stored, [1, 2])
@@ -0,0 +1,75 @@
+'''
+Unit tests for footprint module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import unittest
+import itertools
+
+sys.path.insert(0, '..')
+from kerncraft.kernel import KernelCode
+from kerncraft.intervals import Intervals
+from kerncraft.footprint import FootprintAnalyzer, repeat
+
+
+class TestFootprint(unittest.TestCase):
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def _kernel(self, name, **constants):
+        with open(self._find_file(name)) as f:
+            kernel = KernelCode(f.read(), filename=name)
+        for c, v in constants.items():
+            kernel.set_constant(c, v)
+        return kernel
+
+    def _touched_bytes(self, analyzer, var_name, level):
+        '''returns set of bytes touched, by going through all iterations'''
+        kernel = analyzer.kernel
+        element_size = kernel.datatypes_size[kernel.variables[var_name][0]]
+        ranges = [[analyzer.indices[l['index']]] if i < level else
+                  range(l['start'], l['stop'], l['increment'])
+                  for i, l in enumerate(analyzer.loop_stack)]
+        touched = set()
+        for access in kernel._sources.get(var_name, []) + kernel._destinations.get(var_name, []):
+            expr = kernel.access_to_affine(var_name, access, subs_consts=True)
+            for indices in itertools.product(*ranges):
+                address = expr.evaluate(
+                    {l['index']: i for l, i in zip(analyzer.loop_stack, indices)})*element_size
+                touched.update(range(address, address + element_size))
+        return touched
+
+    def test_repeat(self):
+        self.assertEqual(repeat(Intervals([0, 8]), 8, 10), Intervals([0, 80]))
+        self.assertEqual(repeat(Intervals([0, 8]), 16, 3), Intervals([0, 8], [16, 24], [32, 40]))
+        self.assertEqual(repeat(Intervals([0, 8]), -16, 2), Intervals([-16, -8], [0, 8]))
+        self.assertEqual(repeat(Intervals([0, 8], [16, 24]), 8, 3), Intervals([0, 40]))
+        self.assertEqual(repeat(Intervals([0, 8]), 0, 5), Intervals([0, 8]))
+
+    def test_2d5pt(self):
+        analyzer = FootprintAnalyzer(self._kernel('2d-5pt.c', N=20, M=10))
+        for level in range(3):
+            for var_name in analyzer.arrays():
+                self.assertEqual(len(analyzer.touched(var_name, level)),
+                                 len(self._touched_bytes(analyzer, var_name, level)))
+        # a without its four corners, b without its boundary
+        self.assertEqual(analyzer.analyze()[0]['arrays'], {'a': (20*10-4)*8, 'b': 18*8*8})
+        # three rows of a, one of b
+        self.assertEqual(analyzer.working_set(1), (3*18+2)*8 + 18*8)
+
+    def test_3d7pt(self):
+        analyzer = FootprintAnalyzer(self._kernel('3d-7pt.c', N=10, M=7), indices={'k': 3})
+        for level in range(4):
+            for var_name in analyzer.arrays():
+                self.assertEqual(len(analyzer.touched(var_name, level)),
+                                 len(self._touched_bytes(analyzer, var_name, level)))
+        self.assertEqual([r['loops'] for r in analyzer.analyze()],
+                         [['k', 'j', 'i'], ['j', 'i'], ['i'], []])
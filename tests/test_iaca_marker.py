@@ -0,0 +1,76 @@
+'''
+Unit tests for iaca_marker module
+'''
+from __future__ import print_function
+
+import sys
+import unittest
+
+sys.path.insert(0, '..')
+from kerncraft import iaca_marker
+
+
+ASM = '''main:
+        movl      $0, %eax
+.L2:
+        vmovsd    %xmm0, (%rdi,%rax,8)
+        addq      $1, %rax
+        cmpq      %rsi, %rax
+        jne       .L2
+.L3:
+        vmovupd   (%rsi,%rax,8), %ymm0     # %ymm7 in comment is counted
+        vaddpd    (%rdx,%rax,8), %ymm0, %ymm1
+        vmulpd    %ymm2, %ymm1, %ymm1
+        addpd     %xmm3, %xmm4
+        vmovupd   %ymm1, (%rdi,%rax,8)
+        addq      $4, %rax
+        cmpq      %r8, %rax
+        jb        .L3
+        ret
+'''.splitlines(True)
+
+
+class TestIACAMarker(unittest.TestCase):
+    def test_find_asm_blocks(self):
+        blocks = iaca_marker.find_asm_blocks(ASM)
+        self.assertEqual([idx for idx, b in blocks], [0, 1])
+
+        scalar = blocks[0][1]
+        self.assertEqual(scalar['label'], '.L2')
+        self.assertEqual((scalar['first_line'], scalar['last_line'], scalar['ops']), (2, 6, 4))
+        self.assertEqual((scalar['packed_instr'], scalar['avx_instr']), (0, 0))
+        self.assertEqual(scalar['XMM'], (1, 1))
+        self.assertEqual(scalar['YMM'], (0, 0))
+        self.assertEqual(scalar['GP'], (5, 3))
+        self.assertEqual(scalar['regs'], (6, 4))
+        self.assertEqual(scalar['pointer_increment'], 8)
+        self.assertEqual(scalar['lines'], ASM[2:7])
+
+        vector = blocks[1][1]
+        self.assertEqual(vector['label'], '.L3')
+        self.assertEqual((vector['first_line'], vector['last_line'], vector['ops']), (7, 15, 8))
+        self.assertEqual((vector['packed_instr'], vector['avx_instr']), (3, 2))
+        self.assertEqual(vector['XMM'], (2, 2))
+        self.assertEqual(vector['YMM'], (8, 4))
+        self.assertEqual(vector['GP'], (9, 5))
+        self.assertEqual(vector['regs'], (19, 11))
+        self.assertEqual(vector['pointer_increment'], 32)
+
+        self.assertEqual(iaca_marker.select_best_block(blocks), 1)
+
+    def test_find_asm_blocks_unrolled(self):
+        unroll = 100
+        asm = ['.LOOP:\n']
+        for u in range(unroll):
+            asm += ['        vaddpd    {}(%rsi,%rax,8), %ymm{}, %ymm{}\n'.format(32*u, u % 16, 15),
+                    '        vmovupd   %ymm15, {}(%rdi,%rax,8)\n'.format(32*u)]
+        asm += ['        addq      ${}, %rax\n'.format(4*unroll),
+                '        cmpq      %r8, %rax\n',
+                '        jb        .LOOP\n']
+        blocks = iaca_marker.find_asm_blocks(asm)
+        self.assertEqual(len(blocks), 1)
+        block = blocks[0][1]
+        self.assertEqual((block['packed_instr'], block['avx_instr']), (unroll, unroll))
+        self.assertEqual(block['YMM'], (3*unroll, 16))
+        self.assertEqual(block['GP'], (4*unroll+3, 4))
+        self.assertEqual(block['pointer_increment'], 8*4*unroll)
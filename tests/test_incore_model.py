@@ -0,0 +1,187 @@
+'''
+Unit tests for incore_model module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import unittest
+from distutils.spawn import find_executable
+
+sys.path.insert(0, '..')
+from kerncraft import incore_model
+from kerncraft.kernel import KernelCode
+from kerncraft.machinemodel import MachineModel
+
+
+HSW_ASM = '''.L3:
+        vmovupd   (%rsi,%rax), %ymm0
+        vfmadd231pd (%rdx,%rax), %ymm1, %ymm0
+        vmovupd   %ymm0, (%rdi,%rax)
+        addq      $32, %rax
+        cmpq      %rcx, %rax
+        jne       .L3
+'''.splitlines(True)
+
+
+class TestIncoreModel(unittest.TestCase):
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def setUp(self):
+        self.hsw = incore_model.load_instruction_table(
+            MachineModel(self._find_file('hasep1.yaml')))
+        self.snb = incore_model.load_instruction_table(
+            MachineModel(self._find_file('phinally_gcc.yaml')))
+
+    def test_load_instruction_table(self):
+        self.assertIn('7', self.hsw['ports'])
+        self.assertNotIn('7', self.snb['ports'])
+        machine = MachineModel(machine_yaml={'micro-architecture': 'HSW',
+                                             'instruction table': self.snb})
+        self.assertIs(incore_model.load_instruction_table(machine), self.snb)
+        with self.assertRaises(ValueError):
+            incore_model.load_instruction_table(
+                MachineModel(machine_yaml={'micro-architecture': 'NONE'}))
+
+    def test_parse_instruction(self):
+        self.assertEqual(incore_model.parse_instruction('.L3:\n'), None)
+        self.assertEqual(incore_model.parse_instruction('  .p2align 4,,10\n'), None)
+        self.assertEqual(
+            incore_model.parse_instruction('  vaddpd 8(%rsi,%rax,8), %ymm0, %ymm1  # comment\n'),
+            ('vaddpd', ['8(%rsi,%rax,8)', '%ymm0', '%ymm1']))
+
+    def test_lookup_instruction(self):
+        def key(line, table):
+            return incore_model.lookup_instruction(
+                *(incore_model.parse_instruction(line) + (table,)))[0]
+        self.assertEqual(key('addpd %xmm0, %xmm1', self.snb), 'vaddpd')
+        self.assertEqual(key('vmulps %ymm0, %ymm1, %ymm2', self.snb), 'vmulpd')
+        self.assertEqual(key('vdivpd %ymm0, %ymm1, %ymm2', self.snb), 'vdivpd ymm')
+        self.assertEqual(key('vdivpd %xmm0, %xmm1, %xmm2', self.snb), 'vdivpd')
+        self.assertEqual(key('vfmadd213ps %ymm0, %ymm1, %ymm2', self.hsw), 'vfmaddpd')
+        self.assertEqual(key('vfmadd213pd %ymm0, %ymm1, %ymm2', self.snb), None)
+        self.assertEqual(key('addq $8, %rax', self.snb), 'add')
+        self.assertEqual(key('movq %rax, %rbx', self.snb), 'mov')
+        self.assertEqual(key('movq (%rax), %xmm0', self.snb), 'vmovq')
+        self.assertEqual(key('jb .L3', self.snb), 'jcc')
+
+    def test_distribute(self):
+        port_cycles = {'0': 0.0, '1': 1.0, '5': 3.0}
+        self.assertEqual(incore_model.distribute(port_cycles, 2, ['0', '1']),
+                         {'0': 1.5, '1': 0.5})
+        self.assertEqual(port_cycles, {'0': 1.5, '1': 1.5, '5': 3.0})
+        self.assertEqual(incore_model.distribute(port_cycles, 1, ['5']), {'5': 1.0})
+
+    def test_port_pressure_analysis(self):
+        analysis = incore_model.port_pressure_analysis(HSW_ASM, self.hsw)
+        self.assertEqual(analysis['port cycles'],
+                         {'0': 1.0, '0DV': 0.0, '1': 0.5, '2': 1.0, '2D': 1.0, '3': 1.0,
+                          '3D': 1.0, '4': 1.0, '5': 0.5, '6': 1.0, '7': 1.0})
+        self.assertEqual(analysis['throughput'], 1.0)
+        # cmp is macro-fused with jne
+        self.assertEqual(analysis['uops'], 7)
+        self.assertEqual([i['uops'] for i in analysis['instructions']], [1, 2, 2, 1, 0, 1])
+        self.assertEqual(analysis['unknown instructions'], [])
+
+        analysis = incore_model.port_pressure_analysis(HSW_ASM, self.snb)
+        self.assertEqual(analysis['unknown instructions'],
+                         ['vfmadd231pd (%rdx,%rax), %ymm1, %ymm0'])
+        # 32 byte loads and stores occupy SNB's data ports for two cycles
+        self.assertEqual(analysis['port cycles']['2D'], 1.0)
+        self.assertEqual(analysis['port cycles']['4'], 2.0)
+        self.assertEqual(analysis['throughput'], 2.0)
+
+        output = incore_model.format_analysis(analysis, self.snb['ports'])
+        self.assertIn('Block Throughput: 2.00 Cycles', output)
+        self.assertIn('X - instruction not found', output)
+
+    def test_instruction_dependencies(self):
+        def deps(line):
+            return incore_model.instruction_dependencies(*incore_model.parse_instruction(line))
+        self.assertEqual(deps('addq $32, %rax'), (['rax'], [], ['rax']))
+        self.assertEqual(deps('vaddpd %ymm1, %ymm2, %ymm0'), (['vmm1', 'vmm2'], [], ['vmm0']))
+        self.assertEqual(deps('vfmadd231pd 8(%rdx,%rax), %ymm1, %ymm0'),
+                         (['vmm1', 'vmm0'], ['rdx', 'rax'], ['vmm0']))
+        self.assertEqual(deps('vmovupd (%rsi,%rax), %ymm0'), ([], ['rsi', 'rax'], ['vmm0']))
+        self.assertEqual(deps('vmovupd %ymm0, (%rdi,%rax)'), (['vmm0'], ['rdi', 'rax'], []))
+        self.assertEqual(deps('cmpl %eax, %ebx'), (['rax', 'rbx'], [], []))
+        self.assertEqual(deps('vxorpd %xmm0, %xmm0, %xmm0'), ([], [], ['vmm0']))
+        self.assertEqual(deps('xorl %eax, %eax'), ([], [], ['rax']))
+        self.assertEqual(deps('subq %rax, %rax'), ([], [], ['rax']))
+        self.assertEqual(deps('sub %rax, %rax'), ([], [], ['rax']))
+        self.assertEqual(deps('subq %rbx, %rax'), (['rbx', 'rax'], [], ['rax']))
+
+    def test_latency_analysis(self):
+        # streaming kernel: only the loop counter is carried
+        analysis = incore_model.latency_analysis(HSW_ASM, self.hsw)
+        self.assertEqual(analysis['latency'], 1.0)
+        self.assertEqual(analysis['dependency chain'], ['addq      $32, %rax'])
+
+        # reduction: load latency is not part of the loop-carried chain
+        reduction = '''.L3:
+            vaddsd    (%rsi,%rax,8), %xmm0, %xmm0
+            vaddsd    8(%rsi,%rax,8), %xmm0, %xmm0
+            addq      $2, %rax
+            cmpq      %rcx, %rax
+            jne       .L3
+        '''.splitlines(True)
+        analysis = incore_model.latency_analysis(reduction, self.hsw)
+        self.assertEqual(analysis['latency'], 6.0)
+        self.assertEqual(analysis['dependency chain'], ['vaddsd    (%rsi,%rax,8), %xmm0, %xmm0',
+                                                        'vaddsd    8(%rsi,%rax,8), %xmm0, %xmm0'])
+        # which dominates the throughput bound
+        self.assertEqual(
+            incore_model.port_pressure_analysis(reduction, self.hsw)['throughput'], 2.0)
+
+    @unittest.skipUnless(find_executable('gcc'), "GCC not available")
+    def test_analyze_kernel_async(self):
+        machine = MachineModel(self._find_file('phinally_gcc.yaml'))
+        with open(self._find_file('copy.c')) as f:
+            code = f.read()
+
+        # concurrent analyses of the same code share one compilation
+        compilations = []
+
+        class CountingKernel(KernelCode):
+            def compile(self, *args, **kwargs):
+                compilations.append(self)
+                return KernelCode.compile(self, *args, **kwargs)
+
+        kernels = [CountingKernel(code) for i in range(3)]
+        for k in kernels:
+            k.set_constant('N', 1000)
+        pending = [incore_model.analyze_kernel_async(k, machine, incore_model='builtin',
+                                                     timeout=60)
+                   for k in kernels]
+        analyses = [p.get() for p in pending]
+        self.assertEqual(len(compilations), 1)
+        self.assertTrue(all([p.ready() for p in pending]))
+        for k, a in zip(kernels, analyses):
+            self.assertEqual(a, analyses[0])
+            self.assertEqual(k.asm_block['pointer_increment'],
+                             kernels[0].asm_block['pointer_increment'])
+
+        # what-if variants of cycle model parameters share the analysis
+        variant = machine.what_if([('clock', '*2'), ('MEM.bandwidth', '*2')])
+        self.assertEqual(incore_model.machine_key(variant), incore_model.machine_key(machine))
+        self.assertEqual(incore_model.analyze_kernel(kernels[1], variant, incore_model='builtin'),
+                         analyses[0])
+        self.assertEqual(len(compilations), 1)
+        self.assertNotEqual(
+            incore_model.machine_key(machine.what_if([('compiler flags', '[-O1]')])),
+            incore_model.machine_key(machine))
+
+        # errors (and exits) are raised by get()
+        pending = incore_model.analyze_kernel_async(
+            kernels[0], machine.what_if([('compiler', 'no-such-compiler')]),
+            incore_model='builtin')
+        with self.assertRaises(SystemExit):
+            pending.get()
+        self.assertEqual(incore_model._analysis_locks, {})
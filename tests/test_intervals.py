@@ -33,3 +33,24 @@ class TestIntervals(unittest.TestCase):
         self.assertTrue(5 in Intervals([0,2], [4,10]))
         self.assertFalse(10 in Intervals([0, 10]))
         self.assertFalse(3 in Intervals([0,2], [4,10]))
+
+    def test_add(self):
+        i = Intervals([0, 2], [4, 6], [8, 10], [20, 30])
+        i.add(5, 9)
+        self.assertEqual(i.data, [[0, 2], [4, 10], [20, 30]])
+        i.add(12, 14)
+        self.assertEqual(i.data, [[0, 2], [4, 10], [12, 14], [20, 30]])
+        i.add(-5, 40)
+        self.assertEqual(i.data, [[-5, 40]])
+
+    def test_union_many(self):
+        a = Intervals(*[[i, i+2] for i in range(0, 1000, 4)])
+        b = Intervals(*[[i, i+2] for i in range(2, 1000, 4)])
+        self.assertEqual((a & b).data, [[0, 1000]])
+        self.assertEqual(a | Intervals([1, 3]),
+                         Intervals([0, 3], *[[i, i+2] for i in range(4, 1000, 4)]))
+        self.assertEqual(a, Intervals.from_arrays([i for i in range(996, -1, -4)],
+                                                  [i+2 for i in range(996, -1, -4)]))
+
+    def test_shift(self):
+        self.assertEqual(Intervals([0, 2], [4, 6]).shift(10), Intervals([10, 12], [14, 16]))
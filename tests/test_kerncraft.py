@@ -12,6 +12,7 @@ import unittest
 import tempfile
 import shutil
 import pickle
+import json
 from pprint import pprint
 from io import StringIO
 from distutils.spawn import find_executable
@@ -282,6 +283,36 @@ class TestKerncraft(unittest.TestCase):
         self.assertAlmostEqual(ecmd['T_OL'], 26, places=1)
         self.assertAlmostEqual(ecmd['T_nOL'], 20, places=1)
 
+    @unittest.skipUnless(find_executable('gcc'), "GCC not available")
+    def test_2d5pt_ECMCPU_builtin(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECMCPU_builtin.pickle')
+        output_stream = StringIO()
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'ECMCPU',
+                                  self._find_file('2d-5pt.c'),
+                                  '-D', 'N', '2000',
+                                  '-D', 'M', '1000',
+                                  '-vvv',
+                                  '--incore-model', 'builtin',
+                                  '--unit=cy/CL',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = pickle.load(open(store_file, 'rb'))
+        result = list(results['2d-5pt.c'].values())[0]
+        ecmd = result['ECMCPU']
+
+        # Exact numbers depend on the code generated by the installed compiler
+        self.assertEqual(ecmd['in-core model'], 'builtin')
+        self.assertIn('Block Throughput', ecmd['builtin output'])
+        self.assertGreater(ecmd['T_nOL'], 0)
+        self.assertGreaterEqual(ecmd['T_OL'], ecmd['port cycles']['1'])
+        self.assertGreaterEqual(ecmd['T_OL'], ecmd['loop-carried latency'])
+        self.assertIn(ecmd['in-core bound'], ['throughput', 'latency'])
+
     @unittest.skipUnless(find_executable('iaca.sh'), "IACA not available")
     @unittest.skipUnless(find_executable('gcc'), "GCC not available")
     def test_2d5pt_ECM(self):
@@ -369,6 +400,29 @@ class TestKerncraft(unittest.TestCase):
         self.assertAlmostEqual(ecmd['L2-L3'], 6, places=1)
         self.assertAlmostEqual(ecmd['L3-MEM'], 13, places=0)
 
+    def test_2d5pt_ECMData_LC_jsonl(self):
+        output_stream = StringIO()
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'ECMData',
+                                  self._find_file('2d-5pt.c'),
+                                  '-D', 'N', '1000-2000:2',
+                                  '-D', 'M', '1000',
+                                  '--cache-predictor=LC',
+                                  '--output-format=jsonl'])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        records = [json.loads(l) for l in output_stream.getvalue().splitlines()]
+        self.assertEqual([(r['kernel'], r['model'], r['constants']) for r in records],
+                         [('2d-5pt.c', 'ECMData', {'N': 1000, 'M': 1000}),
+                          ('2d-5pt.c', 'ECMData', {'N': 2000, 'M': 1000})])
+        ecmd = records[1]['results']
+        self.assertAlmostEqual(ecmd['L1-L2'], 10, places=1)
+        self.assertAlmostEqual(ecmd['L2-L3'], 6, places=1)
+        self.assertAlmostEqual(ecmd['L3-MEM'], 13, places=0)
+
     @unittest.skipUnless(find_executable('iaca.sh'), "IACA not available")
     @unittest.skipUnless(find_executable('gcc'), "GCC not available")
     def test_2d5pt_RooflineIACA(self):
@@ -456,7 +510,49 @@ class TestKerncraft(unittest.TestCase):
 
         for k, v in correct_results.items():
             self.assertAlmostEqual(roofline[k], v, places=1)
+
+        # Dummy runtimes do not vary, so sampling stops after minimal number of samples
+        self.assertEqual(roofline['Samples'], 3)
+        self.assertEqual(roofline['Outliers'], 0)
+        self.assertEqual(roofline['Runtime CI (per repetition) [s]'], 0.0)
     
+    @unittest.skipUnless(find_executable('gcc'), "GCC not available")
+    @unittest.skipUnless(find_executable('likwid-perfctr'), "GCC not available")
+    @unittest.skipIf(platform.system() == "Darwin", "Won't build on OS X.")
+    def test_2d5pt_Benchmark_multicore(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_Benchmark_multicore.pickle')
+        output_stream = StringIO()
+
+        os.environ['PATH'] = self._find_file('dummy_likwid')+':'+os.environ['PATH']
+        os.environ['LIKWID_LIB'] = ''
+        os.environ['LIKWID_INCLUDE'] = '-I'+self._find_file('dummy_likwid/include')
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'Benchmark',
+                                  self._find_file('2d-5pt.c'),
+                                  '-D', 'N', '1000',
+                                  '-D', 'M', '1000',
+                                  '--cores', '4',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = pickle.load(open(store_file, 'rb'))
+        result = list(results['2d-5pt.c'].values())[0]['Benchmark']
+
+        # Per-core counters are aggregated: memory traffic was only counted on first core
+        correct_results = {
+            'Cores': 4,
+            'MEM BW [MByte/s]': 272.7272,
+            'MEM volume (per repetition) [B]': 252525.2,
+            'Performance [MLUP/s]': 8.07,
+            'Performance per core [MLUP/s]': 2.02,
+            'Runtime (per repetition) [s]': 0.123456}
+
+        for k, v in correct_results.items():
+            self.assertAlmostEqual(result[k], v, places=1)
+
     def test_2d5pt_pragma(self):
         output_stream = StringIO()
 
@@ -596,6 +692,97 @@ class TestKerncraft(unittest.TestCase):
         self.assertEqual(args.define[0][0], 'M')
         self.assertEqual(list(args.define[0][1]), [10, 100, 1000])
 
+    def test_2d5pt_what_if(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_what_if.pickle')
+        output_stream = StringIO()
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'ECMData',
+                                  self._find_file('2d-5pt.c'),
+                                  '-D', 'N', '2000',
+                                  '-D', 'M', '1000',
+                                  '-P', 'LC',
+                                  '--what-if', 'MEM.bandwidth=*1,*2',
+                                  '--what-if', 'L2.cycles per cacheline transfer=4',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        self.assertEqual(args.what_if, [('MEM.bandwidth', ['*1', '*2']),
+                                        ('L2.cycles per cacheline transfer', ['4'])])
+        kc.run(parser, args, output_file=output_stream)
+
+        results = pickle.load(open(store_file, 'rb'))
+        six.assertCountEqual(self, results['2d-5pt.c'][((sympy.var('N'), 2000),
+                                                         (sympy.var('M'), 1000))],
+                             ['ECMData [MEM.bandwidth=*1 L2.cycles per cacheline transfer=4]',
+                              'ECMData [MEM.bandwidth=*2 L2.cycles per cacheline transfer=4]'])
+        single, double = [results['2d-5pt.c'][((sympy.var('N'), 2000), (sympy.var('M'), 1000))][
+            'ECMData [MEM.bandwidth=*{} L2.cycles per cacheline transfer=4]'.format(f)]
+            for f in [1, 2]]
+        self.assertEqual(single['L1-L2'], double['L1-L2'])
+        self.assertAlmostEqual(single['L2-L3'], 4*(single['misses'][1]+single['evicts'][1]))
+        self.assertAlmostEqual(single['L3-MEM'], 2*double['L3-MEM'])
+        self.assertIn("--what-if 'MEM.bandwidth=*2'", output_stream.getvalue())
+
+        # unknown parameter
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'ECMData',
+                                  self._find_file('2d-5pt.c'),
+                                  '--what-if', 'L2.foo=1'])
+        kc.check_arguments(args, parser)
+        with self.assertRaises(SystemExit) as cm:
+            kc.run(parser, args, output_file=StringIO())
+        self.assertEqual(cm.exception.code, 2)
+
+    def test_2d5pt_multiple_machines(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_multiple_machines.pickle')
+        machine_dir = os.path.join(self.temp_dir, 'machines')
+        os.mkdir(machine_dir)
+        shutil.copy(self._find_file('hasep1.yaml'), machine_dir)
+
+        outputs = []
+        for jobs in ['1', '2']:
+            output_stream = StringIO()
+            parser = kc.create_parser()
+            args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                      '-m', machine_dir,
+                                      '-p', 'ECMData',
+                                      self._find_file('2d-5pt.c'),
+                                      '-D', 'N', '1000',
+                                      '-D', 'M', '500',
+                                      '-P', 'LC',
+                                      '-j', jobs,
+                                      '--store', store_file])
+            kc.check_arguments(args, parser)
+            self.assertEqual(args.machines, [self._find_file('phinally_gcc.yaml'),
+                                             os.path.join(machine_dir, 'hasep1.yaml')])
+            kc.run(parser, args, output_file=output_stream)
+            outputs.append(output_stream.getvalue())
+
+        # parallel analysis produces the same output
+        self.assertEqual(outputs[0], outputs[1])
+        comparison = outputs[0].split(' comparison of machines ')[1].splitlines()
+        self.assertEqual(comparison[2].split(), ['machine', 'cy/CL', 'bottleneck', 'saturation'])
+        self.assertEqual([l.split()[0] for l in comparison[3:5]],
+                         ['phinally_gcc.yaml', 'hasep1.yaml'])
+
+        results = pickle.load(open(store_file, 'rb'))
+        point = results['2d-5pt.c'][((sympy.var('N'), 1000), (sympy.var('M'), 500))]
+        six.assertCountEqual(self, point, ['ECMData (phinally_gcc.yaml)',
+                                           'ECMData (hasep1.yaml)'])
+        self.assertAlmostEqual(float(comparison[3].split()[1]),
+                               sum([c for l, c in point['ECMData (phinally_gcc.yaml)']['cycles']]),
+                               places=2)
+
+        # directory without machine files
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self.temp_dir, '-p', 'ECMData',
+                                  self._find_file('2d-5pt.c')])
+        with self.assertRaises(SystemExit) as cm:
+            kc.check_arguments(args, parser)
+        self.assertEqual(cm.exception.code, 2)
+
     def test_space_linear(self):
         self.assertEqual(list(kc.space(1, 10, 10)), [1,2,3,4,5,6,7,8,9,10])
         self.assertEqual(list(kc.space(1, 10, 3)), [1, 6, 10])
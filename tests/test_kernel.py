@@ -12,6 +12,9 @@ import unittest
 import tempfile
 import shutil
 import pickle
+import subprocess
+import threading
+import time
 from pprint import pprint
 from io import StringIO
 from itertools import chain
@@ -21,7 +24,7 @@ import sympy
 from ruamel import yaml
 
 sys.path.insert(0, '..')
-from kerncraft.kernel import Kernel, KernelCode, KernelDescription
+from kerncraft.kernel import Kernel, KernelCode, KernelDescription, check_output, TimeoutExpired
 
 
 class TestKernel(unittest.TestCase):
@@ -101,6 +104,95 @@ class TestKernel(unittest.TestCase):
         self.assertEqual(k_descr.variables, k_code.variables)
         self.assertEqual(k_descr._loop_stack, k_code._loop_stack)
 
+    def test_as_code_tiling(self):
+        k = KernelCode(self.twod_code)
+        k.set_constant('N', 1000)
+        k.set_constant('M', 1000)
+        k.set_tiling('i', 128)
+        self.assertEqual(k.tiled_loops(), [('i', 'i_block', 128)])
+
+        code = k.as_code(type_='likwid')
+        # block size follows constants on command line, repeat comes last
+        self.assertIn('const int i_block = atoi(argv[3]);', code)
+        self.assertIn('atoi(argv[4])', code)
+        # block loop is interchanged to the outside
+        self.assertLess(code.index('for (int i_tile = 1; i_tile < (N - 1); i_tile += i_block)'),
+                        code.index('for (int j = 1; j < (M - 1); ++j)'))
+        self.assertIn('for (int i = i_tile; i < (((i_tile + i_block) < (N - 1)) ? '
+                      '(i_tile + i_block) : (N - 1)); ++i)', code)
+
+        # untiled after clearing state
+        k.clear_state()
+        self.assertNotIn('i_tile', k.as_code())
+
+    def test_as_code_openmp(self):
+        k = KernelCode(self.twod_code)
+        k.set_constant('N', 1000)
+        k.set_constant('M', 1000)
+        k.set_tiling('i', 128)
+        code = k.as_code(type_='likwid', openmp=True)
+        # marker thread init in parallel region, arrays initialized in parallel (first touch)
+        self.assertIn('#pragma omp parallel\n  {\n    likwid_markerThreadInit();\n  }', code)
+        self.assertEqual(code.count('#pragma omp parallel for\n  for (int i = 0;'), 2)
+        # each thread repeats and measures on its own, block loop is shared
+        self.assertLess(code.index('#pragma omp parallel\n  {\n    int repeat'),
+                        code.index('likwid_markerStartRegion'))
+        self.assertIn('#pragma omp for\n      for (int i_tile', code)
+        self.assertLess(code.index('likwid_markerStopRegion'),
+                        code.index('likwid_markerClose'))
+
+        # scalar destinations are reductions
+        with open(self._find_file('scalar_product.c')) as f:
+            k = KernelCode(f.read())
+        self.assertIn('#pragma omp for reduction(+:s)',
+                      k.as_code(type_='likwid', openmp=True))
+
+    def test_subs_consts_threads(self):
+        # substitution caches are per kernel, kernels can be used concurrently
+        kernels = [KernelCode(self.twod_code) for i in range(4)]
+        errors = []
+
+        def run(kernel, n):
+            try:
+                for m in range(50):
+                    kernel.set_constant('N', n)
+                    kernel.set_constant('M', m+3)
+                    self.assertEqual(kernel.array_sizes(subs_consts=True)['a'], n*(m+3))
+                    self.assertEqual([l['stop'] for l in kernel.get_loop_stack(subs_consts=True)],
+                                     [m+2, n-1])
+            except Exception as e:
+                errors.append(e)
+
+        if hasattr(sys, 'setswitchinterval'):
+            # switch threads often
+            switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+        threads = [threading.Thread(target=run, args=(k, 100*(i+1)))
+                   for i, k in enumerate(kernels)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if hasattr(sys, 'setswitchinterval'):
+            sys.setswitchinterval(switch_interval)
+        self.assertEqual(errors, [])
+
+    def test_check_output_timeout(self):
+        self.assertEqual(check_output([sys.executable, '-c', 'print(42)']).strip(), b'42')
+        with self.assertRaises(subprocess.CalledProcessError):
+            check_output([sys.executable, '-c', 'import sys; sys.exit(3)'], timeout=60)
+        start = time.time()
+        with self.assertRaises(TimeoutExpired) as cm:
+            check_output([sys.executable, '-c', 'import time; time.sleep(60)'], timeout=0.5)
+        self.assertLess(time.time() - start, 30)
+        self.assertIn('timed out after 0.5 seconds', str(cm.exception))
+
+        # children of wrappers (e.g., iaca.sh) are killed too
+        start = time.time()
+        with self.assertRaises(TimeoutExpired):
+            check_output(['sh', '-c', 'sleep 6; echo done'], timeout=0.5)
+        self.assertLess(time.time() - start, 3)
+
 if __name__ == '__main__':
     #unittest.main()
     suite = unittest.TestLoader().loadTestsFromTestCase(TestKernel)
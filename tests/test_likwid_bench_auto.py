@@ -0,0 +1,148 @@
+'''
+Tests for the likwid_bench_auto module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import unittest
+import tempfile
+import shutil
+
+from ruamel import yaml
+
+sys.path.insert(0, '..')
+from kerncraft import likwid_bench_auto
+from kerncraft.prefixedunit import PrefixedUnit
+
+
+@unittest.skipUnless(os.path.exists('/proc/cpuinfo'), "/proc/cpuinfo not available")
+class TestLikwidBenchAuto(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.machine_file = os.path.join(self.temp_dir, 'machine.yml')
+        self.log_file = os.path.join(self.temp_dir, 'likwid-bench.log')
+        self.environ = dict(os.environ)
+        os.environ['PATH'] = self._find_file('dummy_likwid')+':'+os.environ['PATH']
+        os.environ['DUMMY_LIKWID_BENCH_LOG'] = self.log_file
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.temp_dir)
+
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def _bench_calls(self):
+        if not os.path.exists(self.log_file):
+            return []
+        with open(self.log_file) as f:
+            calls = f.read().splitlines()
+        os.remove(self.log_file)
+        return calls
+
+    def _load_machine(self):
+        with open(self.machine_file) as f:
+            return yaml.load(f, Loader=yaml.Loader)
+
+    def test_adaptive_core_counts(self):
+        measured_cores = []
+
+        def measure(cores):
+            # linear scaling until saturation at 6 cores
+            measured_cores.append(cores)
+            return PrefixedUnit(min(cores, 6)*10.0e3, 'MB/s')
+
+        cores = list(range(1, 29))
+        results = likwid_bench_auto.adaptive_core_counts(measure, cores, tolerance=0.05)
+
+        self.assertEqual(sorted(measured_cores), [1, 2, 3, 4, 5, 6, 7, 8, 12, 16])
+        self.assertEqual([m for bw, m in results], [c in measured_cores for c in cores])
+        for c, (bw, m) in zip(cores, results):
+            self.assertAlmostEqual(float(bw), min(c, 6)*10e9)
+            # same unit as measurements
+            self.assertEqual((bw.prefix, bw.unit), ('M', 'B/s'))
+
+    def test_adaptive(self):
+        likwid_bench_auto.main([self.machine_file, '--levels', 'MEM', '--kernels', 'copy',
+                                '--threads-per-core', '1', '--adaptive'])
+        mem = self._load_machine()['benchmarks']['measurements']['MEM'][1]
+        # dummy bandwidth scales linearly with threads, so both core counts are measured
+        self.assertEqual(len(self._bench_calls()), 2)
+        self.assertEqual(mem['measured'], {'copy': [True, True]})
+
+    @unittest.skipUnless(os.path.exists('/sys/devices/system/cpu/cpu0/cache'),
+                         "/sys/devices/system/cpu not available")
+    def test_sysfs_topology(self):
+        machine = likwid_bench_auto.get_machine_topology_sysfs()
+        self.assertGreaterEqual(machine['sockets'], 1)
+        self.assertGreaterEqual(machine['cores per socket'], 1)
+        levels = [m['level'] for m in machine['memory hierarchy']]
+        self.assertEqual(levels[0], 'L1')
+        self.assertEqual(levels[-1], 'MEM')
+        l1 = machine['memory hierarchy'][0]
+        self.assertEqual(float(l1['size per group']),
+                         l1['cache per group']['sets']*l1['cache per group']['ways'] *
+                         l1['cache per group']['cl_size'])
+        self.assertNotIn('load_from', machine['memory hierarchy'][-2]['cache per group'])
+
+    def test_numpy_engine(self):
+        for kernel in sorted(likwid_bench_auto.NUMPY_KERNELS):
+            bw = likwid_bench_auto.measure_bw_numpy(kernel, 100, 1, 1, 1, 1, duration=0.01)
+            self.assertGreater(float(bw), 0.0)
+            self.assertEqual(bw.unit, 'B/s')
+
+    def test_selection_and_resume(self):
+        likwid_bench_auto.main([self.machine_file, '--levels', 'L1', '--kernels', 'copy',
+                                '--cores', '1', '--threads-per-core', '1'])
+        self.assertEqual(self._bench_calls(), ['-t copy -w S0:21kB:1:1:2'])
+
+        machine = self._load_machine()
+        self.assertEqual(machine['cores per socket'], 2)
+        self.assertEqual([m['level'] for m in machine['memory hierarchy']],
+                         ['L1', 'L2', 'L3', 'MEM'])
+        l1 = machine['benchmarks']['measurements']['L1'][1]
+        self.assertEqual(l1['cores'], [1, 2])
+        self.assertEqual(l1['results'], {'copy': [PrefixedUnit(10000.0, 'MB/s'), None]})
+        self.assertEqual(machine['benchmarks']['measurements']['L2'][1]['results'], {})
+
+        # Restart with more cores only measures what is missing
+        likwid_bench_auto.main([self.machine_file, '--levels', 'L1', '--kernels', 'copy',
+                                '--threads-per-core', '1'])
+        self.assertEqual(self._bench_calls(), ['-t copy -w S0:42kB:2:1:2'])
+        l1 = self._load_machine()['benchmarks']['measurements']['L1'][1]
+        self.assertEqual(l1['results'], {'copy': [PrefixedUnit(10000.0, 'MB/s'),
+                                                  PrefixedUnit(20000.0, 'MB/s')]})
+
+        # Nothing left to do
+        likwid_bench_auto.main([self.machine_file, '--levels', 'L1', '--kernels', 'copy',
+                                '--threads-per-core', '1'])
+        self.assertEqual(self._bench_calls(), [])
+
+    def test_keep_manual_information(self):
+        likwid_bench_auto.main([self.machine_file, '--levels', 'L1', '--kernels', 'load',
+                                '--cores', '1', '--threads-per-core', '1'])
+        machine = self._load_machine()
+        machine['clock'] = PrefixedUnit(1.9, 'GHz')
+        with open(self.machine_file, 'w') as f:
+            f.write(yaml.dump(machine))
+
+        likwid_bench_auto.main([self.machine_file, '--levels', 'MEM', '--kernels', 'load',
+                                '--cores', '1', '--threads-per-core', '1'])
+        machine = self._load_machine()
+        self.assertEqual(machine['clock'], PrefixedUnit(1.9, 'GHz'))
+        self.assertEqual(machine['benchmarks']['measurements']['L1'][1]['results']['load'][0],
+                         PrefixedUnit(10000.0, 'MB/s'))
+        self.assertEqual(machine['benchmarks']['measurements']['MEM'][1]['results']['load'][0],
+                         PrefixedUnit(10000.0, 'MB/s'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+'''
+Unit tests for batch evaluation in performance models and what-if machine variants
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import threading
+import unittest
+
+sys.path.insert(0, '..')
+from kerncraft.kernel import KernelCode
+from kerncraft.machinemodel import MachineModel
+from kerncraft.models import ECMData, Roofline
+from kerncraft.kerncraft import create_parser
+from kerncraft.cacheprediction import PREDICTIONS_LIMIT
+
+
+class TestModels(unittest.TestCase):
+    def setUp(self):
+        self.machine = MachineModel(self._find_file('phinally_gcc.yaml'))
+        with open(self._find_file('2d-5pt.c')) as f:
+            self.kernel = KernelCode(f.read(), filename='2d-5pt.c')
+        self.kernel.set_constant('N', 1000)
+        self.kernel.set_constant('M', 1000)
+        self.parser = create_parser()
+
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def _args(self, pmodel):
+        return self.parser.parse_args([
+            '-m', self._find_file('phinally_gcc.yaml'), '-p', pmodel,
+            self._find_file('2d-5pt.c'), '-D', 'N', '1000', '-D', 'M', '1000'])
+
+    def test_get_bandwidth_memoized(self):
+        bw = self.machine.get_bandwidth(3, 3, 1, 1)
+        self.assertIs(self.machine.get_bandwidth(3, 3, 1, 1), bw)
+        bws, kernels = self.machine.get_bandwidths(3, [3, 2, 3], [1, 1, 1], 1)
+        self.assertEqual(bws[0], bw[0])
+        self.assertEqual(kernels[0], bw[1])
+        self.assertEqual(bws[0], bws[2])
+
+    def test_get_bandwidth_unmeasured(self):
+        # e.g., from an interrupted benchmark run
+        for threads in self.machine['benchmarks']['measurements']['L3'].values():
+            threads['results']['copy'] = [None]*len(threads['results']['copy'])
+        with self.assertRaises(ValueError) as cm:
+            self.machine.get_bandwidth(2, 2, 1, 1)
+        self.assertIn('L3 with copy kernel', str(cm.exception))
+
+    def test_ecmdata_batch(self):
+        misses = [[4, 4, 4], [3, 3, 3], [4, 2, 1]]
+        evicts = [[1, 1, 1], [1, 1, 1], [1, 1, 0]]
+        batch = ECMData.calculate_cycles_batch(self.kernel, self.machine, misses, evicts)
+        self.assertEqual(batch['cycles'].shape, (3, 3))
+        self.assertEqual(batch['levels'], ['L1-L2', 'L2-L3', 'L3-MEM'])
+
+        # every row equals the single point evaluation
+        for i in range(len(misses)):
+            single = ECMData.calculate_cycles_batch(
+                self.kernel, self.machine, [misses[i]], [evicts[i]])
+            self.assertEqual(batch['cycles'][i].tolist(), single['cycles'][0].tolist())
+            self.assertEqual(batch['memory bandwidth'][i], single['memory bandwidth'][0])
+
+        # L1-L2 and L2-L3 have fixed cycles per cacheline transfer
+        self.assertEqual(batch['cycles'][0][0], 5*2)
+        self.assertEqual(batch['cycles'][0][1], 5*2)
+
+    def test_ecmdata_single_point(self):
+        model = ECMData(self.kernel, self.machine, self._args('ECMData'), self.parser)
+        model.analyze()
+        self.assertEqual([l for l, c in model.results['cycles']],
+                         ['L1-L2', 'L2-L3', 'L3-MEM'])
+        for level, cycles in model.results['cycles']:
+            self.assertEqual(model.results[level], cycles)
+            self.assertIsInstance(cycles, float)
+        self.assertIn('memory bandwidth', model.results)
+
+    def test_roofline_batch(self):
+        misses = [[4, 4, 4], [3, 3, 3], [0, 0, 0]]
+        evicts = [[1, 1, 1], [1, 1, 1], [0, 0, 0]]
+        batch = Roofline.calculate_bottlenecks_batch(
+            self.kernel, self.machine, [6, 6, 6], [1, 1, 1], misses, evicts, cores=1)
+        self.assertEqual(batch['levels'], ['L1', 'L2', 'L3', 'MEM'])
+        for i in range(len(misses)):
+            single = Roofline.calculate_bottlenecks_batch(
+                self.kernel, self.machine, [6], [1], [misses[i]], [evicts[i]], cores=1)
+            self.assertEqual(batch['performance'][i], single['performance'][0])
+            self.assertEqual(batch['bottleneck level'][i], single['bottleneck level'][0])
+            self.assertEqual(batch['min performance'][i],
+                             min(batch['performance'][i]))
+        # without any transfers beyond L1, the bottleneck is L1
+        self.assertEqual(batch['bottleneck level'][2], 0)
+        self.assertEqual(batch['performance'][2][1:], [float('inf')]*3)
+
+    def test_roofline_single_point(self):
+        model = Roofline(self.kernel, self.machine, self._args('Roofline'), self.parser)
+        model.analyze()
+        bottlenecks = model.results['mem bottlenecks']
+        self.assertEqual([b['level'] for b in bottlenecks], ['L1', 'L2', 'L3', 'MEM'])
+        level = model.results['bottleneck level']
+        self.assertEqual(model.results['min performance'],
+                         min([float(b['performance']) for b in bottlenecks]))
+        self.assertEqual(float(bottlenecks[level]['performance']),
+                         model.results['min performance'])
+
+    def test_what_if(self):
+        variant = self.machine.what_if([('clock', '3 GHz'), ('MEM.bandwidth', '*2'),
+                                        ('L2.cycles per cacheline transfer', '3')])
+        self.assertEqual(float(variant['clock']), 3e9)
+        self.assertEqual(float(self.machine['clock']), 2.7e9)
+        self.assertEqual(variant['memory hierarchy'][1]['cycles per cacheline transfer'], 3)
+        self.assertAlmostEqual(float(variant.get_bandwidth(3, 3, 1, 1)[0]),
+                               2*float(self.machine.get_bandwidth(3, 3, 1, 1)[0]))
+        # only cycle model parameters changed, predictions are shared
+        self.assertIs(variant.predictions, self.machine.predictions)
+
+        larger = self.machine.what_if([('L2.size', '1 MB'), ('clock', '*2')])
+        self.assertEqual(larger['memory hierarchy'][1]['cache per group']['sets'], 2048)
+        self.assertEqual(float(larger['clock']), 5.4e9)
+        self.assertIsNot(larger.predictions, self.machine.predictions)
+        self.assertIs(self.machine.what_if([('L2.size', '1 MB')]).predictions,
+                      larger.predictions)
+
+        for overrides in [[('L2.foo', '1')], [('L2.size', '1000 B')], [('MEM.size', '1 MB')]]:
+            with self.assertRaises(ValueError):
+                self.machine.what_if(overrides)
+
+    def test_what_if_reuses_prediction(self):
+        args = self._args('ECMData')
+        args.cache_predictor = 'LC'
+        model = ECMData(self.kernel, self.machine, args, self.parser)
+        model.analyze()
+        variant = self.machine.what_if([('MEM.bandwidth', '*2')])
+        variant_model = ECMData(self.kernel, variant, args, self.parser)
+        variant_model.analyze()
+        self.assertIs(variant_model.predictor, model.predictor)
+        self.assertAlmostEqual(variant_model.results['L3-MEM'], model.results['L3-MEM']/2)
+
+        # new constants require a new prediction
+        self.kernel.set_constant('N', 2000)
+        variant_model = ECMData(self.kernel, variant, args, self.parser)
+        variant_model.analyze()
+        self.assertIsNot(variant_model.predictor, model.predictor)
+
+    def test_predictions_per_kernel(self):
+        args = self._args('ECMData')
+        args.cache_predictor = 'LC'
+        with open(self._find_file('2d-5pt.c')) as f:
+            other_kernel = KernelCode(f.read())
+        other_kernel.set_constant('N', 2000)
+        other_kernel.set_constant('M', 2000)
+
+        # kernels on the same machine keep their predictions
+        model = ECMData(self.kernel, self.machine, args, self.parser)
+        model.analyze()
+        other_model = ECMData(other_kernel, self.machine, args, self.parser)
+        other_model.analyze()
+        model_again = ECMData(self.kernel, self.machine, args, self.parser)
+        model_again.analyze()
+        self.assertIs(model_again.predictor, model.predictor)
+        self.assertIsNot(other_model.predictor, model.predictor)
+
+        # also from concurrent threads
+        errors = []
+
+        def run(kernel):
+            try:
+                for n in range(100, 120):
+                    kernel.set_constant('N', n)
+                    ECMData(kernel, self.machine, args, self.parser).analyze()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(k,)) for k in [self.kernel, other_kernel]]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+    def test_predictions_limit(self):
+        args = self._args('ECMData')
+        args.cache_predictor = 'LC'
+        with open(self._find_file('2d-5pt.c')) as f:
+            code = f.read()
+
+        # many kernels (e.g., in kerncraft serve) only keep the recently used predictors
+        kernels = []
+        for i in range(PREDICTIONS_LIMIT + 4):
+            kernel = KernelCode(code)
+            kernel.set_constant('N', 1000 + i)
+            kernel.set_constant('M', 1000)
+            ECMData(kernel, self.machine, args, self.parser).analyze()
+            kernels.append(kernel)
+        self.assertEqual(len(self.machine.predictions), PREDICTIONS_LIMIT)
+        predicted = [p[0] for p in self.machine.predictions.values()]
+        self.assertEqual(predicted, kernels[-PREDICTIONS_LIMIT:])
@@ -0,0 +1,59 @@
+'''
+Unit tests for output module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import json
+import unittest
+from io import StringIO
+
+import sympy
+
+sys.path.insert(0, '..')
+from kerncraft.output import normalize, flatten, CSVWriter
+from kerncraft.prefixedunit import PrefixedUnit
+
+
+class TestOutput(unittest.TestCase):
+    def test_normalize(self):
+        N, M = sympy.symbols('N M')
+        results = {
+            'T_OL': 8.0,
+            'cycles': [('L1', 1), ('L2', sympy.Integer(2))],
+            'performance': PrefixedUnit(1.5, 'GFLOP/s'),
+            'scaling cores': float('inf'),
+            'loads': {sympy.Symbol('a'): {1, 0}},
+            ((N, 1000), (M, 2000)): {'expression': N*M, 'ratio': sympy.Rational(1, 4)},
+            'flag': True,
+            'missing': None}
+        normalized = normalize(results)
+        self.assertEqual(normalized, {
+            'T_OL': 8.0,
+            'cycles': [['L1', 1], ['L2', 2]],
+            'performance': 1.5e9,
+            'scaling cores': 'inf',
+            'loads': {'a': [0, 1]},
+            'N=1000,M=2000': {'expression': 'M*N', 'ratio': 0.25},
+            'flag': True,
+            'missing': None})
+        self.assertIsInstance(normalized['cycles'][1][1], int)
+        # must be serializable
+        self.assertEqual(json.loads(json.dumps(normalized)), normalized)
+
+    def test_flatten(self):
+        self.assertEqual(list(flatten({'cycles': [['L1', 2]], 'T_OL': 8.0})),
+                         [('T_OL', 8.0), ('cycles.0.0', 'L1'), ('cycles.0.1', 2)])
+
+    def test_csv_writer(self):
+        output = StringIO()
+        writer = CSVWriter(output)
+        writer.write({'kernel': 'copy.c', 'machine': 'm.yml', 'model': 'ECMData',
+                      'constants': {'N': 10}, 'results': {'T_OL': 1.0, 'flops': {'+': 1}}})
+        self.assertEqual(output.getvalue().splitlines(),
+                         ['kernel,machine,model,constants,key,value',
+                          'copy.c,m.yml,ECMData,N=10,T_OL,1.0',
+                          'copy.c,m.yml,ECMData,N=10,flops.+,1'])
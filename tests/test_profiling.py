@@ -0,0 +1,89 @@
+'''
+Unit tests for profiling module
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+
+import six
+
+sys.path.insert(0, '..')
+from kerncraft import profiling
+from kerncraft import kerncraft as kc
+
+
+@profiling.profiled('square')
+def square(x):
+    return x*x
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def test_disabled(self):
+        self.assertIsNone(profiling.get_profiler())
+        with profiling.phase('nothing'):
+            pass
+        self.assertEqual(square(3), 9)
+
+    def test_profile(self):
+        trace_file = os.path.join(self.temp_dir, 'trace.json')
+        with profiling.profile(trace_file) as profiler:
+            self.assertIs(profiling.get_profiler(), profiler)
+            with profiling.phase('parse'):
+                pass
+            for point in ['N=10', 'N=20']:
+                profiling.set_point(point)
+                with profiling.phase('analysis'):
+                    square(2)
+                    square(3)
+        self.assertIsNone(profiling.get_profiler())
+
+        self.assertEqual([(r['phase'], r['point']) for r in profiler.records],
+                         [('parse', None),
+                          ('square', 'N=10'), ('square', 'N=10'), ('analysis', 'N=10'),
+                          ('square', 'N=20'), ('square', 'N=20'), ('analysis', 'N=20')])
+        self.assertEqual(list(profiler.point_times('N=20')), ['square', 'analysis'])
+        six.assertRegex(self, profiler.summary(), r'\nsquare +4 ')
+
+        with open(trace_file) as f:
+            trace = json.load(f)
+        self.assertEqual([e['name'] for e in trace['traceEvents']],
+                         [r['phase'] for r in profiler.records])
+        self.assertEqual(trace['traceEvents'][1]['args']['point'], 'N=10')
+
+    def test_run_profile(self):
+        output_stream = StringIO()
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'ECMData',
+                                  self._find_file('2d-5pt.c'),
+                                  '-D', 'N', '1000',
+                                  '-D', 'M', '1000',
+                                  '--cache-predictor=LC',
+                                  '--output-format=jsonl',
+                                  '--profile'])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        record = json.loads(output_stream.getvalue())
+        self.assertEqual(set(record['results']['profile']), {'layer conditions', 'analysis'})
@@ -0,0 +1,121 @@
+'''
+Tests for the analysis server (kerncraft serve)
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import json
+import threading
+import unittest
+
+from six.moves import http_client
+
+sys.path.insert(0, '..')
+from kerncraft import server
+
+
+class TestServer(unittest.TestCase):
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def setUp(self):
+        self.server = server.create_server(port=0, workers=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.pool.terminate()
+
+    def _request(self, method, path, body=None):
+        connection = http_client.HTTPConnection(*self.server.server_address[:2])
+        connection.request(method, path, body and json.dumps(body))
+        response = connection.getresponse()
+        result = response.status, json.loads(response.read().decode('utf-8'))
+        connection.close()
+        return result
+
+    def test_analyze(self):
+        with open(self._find_file('2d-5pt.c')) as f:
+            code = f.read()
+        request = {'code': code,
+                   'machine': self._find_file('phinally_gcc.yaml'),
+                   'pmodel': ['ECMData'],
+                   'define': {'N': 2000, 'M': 1000},
+                   'args': ['--cache-predictor=LC', '--unit=cy/CL']}
+        status, response = self._request('POST', '/analyze', request)
+        self.assertEqual(status, 200)
+        ecmd = response['results']['ECMData']
+        self.assertAlmostEqual(ecmd['L1-L2'], 10, places=1)
+        self.assertAlmostEqual(ecmd['L2-L3'], 6, places=1)
+        self.assertAlmostEqual(ecmd['L3-MEM'], 13, places=0)
+        self.assertIn('L1-L2', response['reports']['ECMData'])
+
+        # second request is answered from warm caches
+        request['define'] = {'N': 100, 'M': 100}
+        status, response = self._request('POST', '/analyze', request)
+        self.assertEqual(status, 200)
+        self.assertEqual(self.server.analysis.status()['kernels'], 1)
+
+        status, response = self._request('GET', '/status')
+        self.assertEqual(status, 200)
+        self.assertEqual(response['machines'], [self._find_file('phinally_gcc.yaml')])
+
+    def test_invalid_request(self):
+        status, response = self._request('POST', '/analyze', {'code': '', 'pmodel': ['ECM']})
+        self.assertEqual(status, 400)
+        self.assertIn('machine', response['error'])
+        status, response = self._request('POST', '/analyze', {
+            'code': 'a[i] = 1;', 'machine': self._find_file('phinally_gcc.yaml'),
+            'pmodel': ['NoSuchModel']})
+        self.assertEqual(status, 400)
+        status, response = self._request('GET', '/nothing')
+        self.assertEqual(status, 404)
+
+    def test_rejected_args(self):
+        store_file = os.path.join(os.path.dirname(__file__), 'rejected.pickle')
+        request = {'code': 'a[i] = 1;', 'machine': self._find_file('phinally_gcc.yaml'),
+                   'pmodel': ['ECMData']}
+        # only model options are accepted, nothing writing files or starting processes
+        for args in [['--store', store_file], ['-o', store_file], ['-j', '4'],
+                     ['-m', os.path.dirname(store_file)], ['--profile-output', store_file]]:
+            request['args'] = args
+            status, response = self._request('POST', '/analyze', request)
+            self.assertEqual(status, 400)
+            self.assertIn('invalid arguments', response['error'])
+        self.assertFalse(os.path.exists(store_file))
+
+    def test_invalid_tile(self):
+        code = 'double a[N];\nfor (int i = 0; i < N; i += 2)\n    a[i] = a[i] + 1.0;\n'
+        request = {'code': code, 'machine': self._find_file('phinally_gcc.yaml'),
+                   'pmodel': ['ECMData'], 'define': {'N': 1000}, 'args': ['-P', 'LC']}
+        # unknown index, non-positive size and size not a multiple of the step
+        for tile in [[['j', 16]], [['i', 0]], [['i', -2]], [['i', 15]]]:
+            request['tile'] = tile
+            status, response = self._request('POST', '/analyze', request)
+            self.assertEqual(status, 400)
+            self.assertIn('tile', response['error'])
+        kernel, lock = self.server.analysis.get_kernel(code)
+        self.server.analysis.check_tiling(kernel, [('i', 16)])
+
+    def test_kernels_limit(self):
+        analysis = server.AnalysisServer(max_kernels=2)
+        codes = ['double a[N];\nfor (int i = 0; i < N; ++i)\n    a[i] = {}.0;\n'.format(v)
+                 for v in range(3)]
+        first = analysis.get_kernel(codes[0])
+        analysis.get_kernel(codes[1])
+        # recently used kernels are kept, others are dropped
+        self.assertIs(analysis.get_kernel(codes[0]), first)
+        analysis.get_kernel(codes[2])
+        self.assertEqual(analysis.status()['kernels'], 2)
+        self.assertIs(analysis.get_kernel(codes[0]), first)
+        self.assertEqual(list(analysis._kernels), [codes[2], codes[0]])
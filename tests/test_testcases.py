@@ -0,0 +1,47 @@
+'''
+Tests for the .testcases runner (run_testcases.py)
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import run_testcases
+
+
+class TestTestcases(unittest.TestCase):
+    def _find_example(self, *path):
+        name = os.path.join(run_testcases.EXAMPLES_DIR, *path)
+        assert os.path.exists(name)
+        return name
+
+    def test_collect_cases(self):
+        files = run_testcases.discover([self._find_example('kernels')])
+        self.assertIn(self._find_example('kernels', '2d-5pt.testcases'), files)
+
+        cases = run_testcases.collect_cases(
+            [self._find_example('kernels', '2d-5pt.testcases')],
+            [self._find_example('machine-files', 'phinally.yaml')], ['ECMData', 'LC'],
+            ['LC', 'SIM'])
+        # 4 testcases with two predictors for ECMData and once for LC
+        self.assertEqual(len(cases), 12)
+        self.assertEqual(cases[0]['constants'], {'N': 300, 'M': 416666})
+        self.assertEqual(cases[0]['expected'], {'L1-L2': 6, 'L2-L3': 6, 'L3-MEM': 13})
+
+    def test_compare(self):
+        self.assertEqual(
+            run_testcases.compare({'L1-L2': 10, 'L2-L3': 6, 'T_OL': 8},
+                                  {'L1-L2': 10.4, 'L2-L3': 8}),
+            ({'L2-L3': (6, 8.0)}, ['T_OL']))
+
+    def test_run(self):
+        cases = run_testcases.collect_cases(
+            [self._find_example('kernels', '2d-5pt.testcases')],
+            [self._find_example('machine-files', 'phinally.yaml')], ['ECMData', 'LC'], ['LC'])
+        finished = run_testcases.run(cases, jobs=2)
+        self.assertEqual(sorted([c['status'] for c in finished]), ['passed']*4 + ['ran']*4)